@@ -0,0 +1,77 @@
+"""Benchmark: COLISOES_LINHA com lambdas por grupo vs. line_collisions.
+
+Antes: ``groupby("LINHA").apply`` com ``sorted(set(s))`` por linha e um
+segundo ``.apply`` partindo o texto para contar. Agora:
+``variacoes_linha`` + ``colisoes_linha``. Confere que os exemplos batem.
+
+Uso:
+    python benchmarks/bench_colisoes_linha.py                       # 2.000.000 eventos, ~300k grafias
+    python benchmarks/bench_colisoes_linha.py --eventos 500000 --grafias 2000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hackaton.routers.processing.line_collisions import colisoes_linha, variacoes_linha  # noqa: E402
+
+
+def gerar_eventos(n: int, grafias_por_linha: int, linhas: int = 300, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    li = rng.integers(0, linhas, n)
+    gi = rng.integers(0, grafias_por_linha, n)
+    nomes = np.array([f"LINHA {i}" for i in range(linhas)], dtype=object)
+    ev = pd.DataFrame({
+        "LINHA": nomes[li],
+        "LINHA_ORIGINAL": np.char.add(np.char.add("Linha ", li.astype(str)), np.char.add(" - ", gi.astype(str))).astype(object),
+        "DATA_EVENTO": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, n), unit="D"),
+    })
+    ev.loc[::97, "LINHA_ORIGINAL"] = None
+    return ev
+
+
+def antes(eventos: pd.DataFrame) -> pd.DataFrame:
+    col_lin = eventos[["LINHA"]].copy()
+    col_lin["LINHA_ORIGINAL"] = eventos.get("LINHA_ORIGINAL", pd.Series("", index=eventos.index)).fillna("").astype(str)
+    col_lin = col_lin[col_lin["LINHA_ORIGINAL"].str.strip() != ""].groupby("LINHA")["LINHA_ORIGINAL"].apply(lambda s: " | ".join(sorted(set(s))[:30])).reset_index(name="EXEMPLOS_LINHA_ORIGINAL")
+    col_lin["QTD_VARIACOES"] = col_lin["EXEMPLOS_LINHA_ORIGINAL"].apply(lambda x: len([p for p in str(x).split("|") if p.strip()]))
+    return col_lin
+
+
+def agora(eventos: pd.DataFrame) -> pd.DataFrame:
+    return colisoes_linha(variacoes_linha(eventos))
+
+
+def _medir(fn, ev: pd.DataFrame, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn(ev)
+        tempos.append(time.perf_counter() - t0)
+    return float(np.median(tempos))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--eventos", type=int, default=2_000_000)
+    ap.add_argument("--grafias", type=int, default=1000, help="grafias distintas por LINHA (300 linhas)")
+    ap.add_argument("--repeticoes", type=int, default=3)
+    args = ap.parse_args()
+
+    ev = gerar_eventos(args.eventos, args.grafias)
+    # a etapa events entrega as colunas como category (schema.py)
+    ev_cat = ev.astype({"LINHA": "category", "LINHA_ORIGINAL": "category"})
+    a, b = antes(ev), agora(ev_cat)
+    pd.testing.assert_series_equal(a["EXEMPLOS_LINHA_ORIGINAL"], b["EXEMPLOS_LINHA_ORIGINAL"], check_dtype=False)
+    print(f"{len(ev):,} eventos | {ev['LINHA_ORIGINAL'].nunique():,} grafias distintas")
+    print(f"antes | {_medir(antes, ev, args.repeticoes):6.2f} s")
+    print(f"agora | {_medir(agora, ev_cat, args.repeticoes):6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Benchmark: etapas events + daily_cube com tipos compactos vs. o caminho antigo.
+
+Antes: colunas de texto como vêm do builder, contadores ``astype(int)``
+(int64), ``base_diaria = eventos.copy()`` e groupby sobre as strings. Agora:
+o que está em ``pipeline._events`` / ``pipeline.agregar_eventos`` (category,
+int8, somas por célula sobre os códigos, sem cópia da base).
+
+Mede tempo (mediana), pico de memória alocada (tracemalloc) e o tamanho
+final de ``eventos`` e da agregada, e confere que as duas agregadas batem.
+
+Uso:
+    python benchmarks/bench_eventos_dtypes.py                  # 2.000.000 eventos
+    python benchmarks/bench_eventos_dtypes.py --eventos 500000 --repeticoes 3
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hackaton.routers.processing.pipeline import _daily_cube, _events  # noqa: E402
+
+
+def gerar_eventos(n: int, seed: int = 42) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Saída no formato do builder (tudo ``object``) + auditoria NC (~5% do tamanho)."""
+    rng = np.random.default_rng(seed)
+    linhas = np.array([f"LINHA {i}" for i in range(1, 121)], dtype=object)
+    pns = np.array([f"PN{i:05d}" for i in range(1200)], dtype=object)
+    motivos = np.array(["vazamento na solda", "rebarba", "trinca na peça", "cor errada", "falha de montagem"], dtype=object)
+    li = rng.integers(0, len(linhas), n)
+    # cada linha produz ~10 PNs
+    pi = (li * 10 + rng.integers(0, 10, n)) % len(pns)
+    tipo = rng.choice(np.array(["REFUGO", "RECLAMACAO_FORMAL", "RECLAMACAO_INFORMAL"], dtype=object), n, p=[0.7, 0.15, 0.15])
+    ev = pd.DataFrame({
+        "TIPO": tipo,
+        "DATA_EVENTO": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, n), unit="D"),
+        "LINHA_ORIGINAL": np.char.add("Linha ", (li + 1).astype(str)).astype(object),
+        "LINHA": linhas[li],
+        "PN_ORIGINAL": pns[pi],
+        "PN_LIMPO": pns[pi],
+        "DESCRICAO": motivos[rng.integers(0, len(motivos), n)],
+        "QTD": np.where(tipo == "REFUGO", rng.integers(1, 50, n), 0),
+        "FREQ": 1,
+    })
+    m = max(1, n // 20)
+    nc_raw = pd.DataFrame({
+        "Created": pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 730, m), unit="D"),
+        "LINHA_ORIGINAL": linhas[rng.integers(0, len(linhas), m)],
+        "LINHA": linhas[rng.integers(0, len(linhas), m)],
+        "Description": motivos[rng.integers(0, len(motivos), m)],
+        "Status": rng.choice(np.array(["Open", "Closed", "In progress"], dtype=object), m),
+        "Due date": pd.Timestamp("2023-02-01") + pd.to_timedelta(rng.integers(0, 730, m), unit="D"),
+        "Closing date": pd.Series(pd.Timestamp("2023-03-01") + pd.to_timedelta(rng.integers(0, 730, m), unit="D")).where(rng.random(m) < 0.5),
+        "14Q": rng.choice(np.array(["Q1", "Q2", "Q3"], dtype=object), m),
+    })
+    return ev, nc_raw
+
+
+# caminho antigo (cópia fiel de _events + _daily_cube antes dos tipos compactos)
+
+def antes(ev: pd.DataFrame, nc_raw: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    eventos = ev.copy()
+    nc_ev = pd.DataFrame({
+        "TIPO": "NC_AUDITORIA",
+        "DATA_EVENTO": pd.to_datetime(nc_raw.get("Created"), errors="coerce"),
+        "LINHA_ORIGINAL": nc_raw.get("LINHA_ORIGINAL", ""),
+        "LINHA": nc_raw.get("LINHA", "SEM_LINHA"),
+        "PN_ORIGINAL": "",
+        "PN_LIMPO": "",
+        "DESCRICAO": nc_raw.get("Description", ""),
+        "QTD": 0,
+        "FREQ": 1,
+        "STATUS": nc_raw.get("Status", ""),
+        "DUE_DATE": pd.to_datetime(nc_raw.get("Due date"), errors="coerce"),
+        "CLOSING_DATE": pd.to_datetime(nc_raw.get("Closing date"), errors="coerce"),
+        "Q14": nc_raw.get("14Q", ""),
+    })
+    eventos = pd.concat([eventos, nc_ev], ignore_index=True)
+    eventos["DATA_EVENTO"] = pd.to_datetime(eventos.get("DATA_EVENTO"), errors="coerce")
+    eventos["LINHA"] = eventos.get("LINHA", "SEM_LINHA").fillna("SEM_LINHA")
+    eventos["PN_LIMPO"] = eventos.get("PN_LIMPO", "").fillna("")
+    eventos["DESCRICAO"] = eventos.get("DESCRICAO", "").fillna("")
+    eventos["FLAG_RISCO_OCULTO"] = (
+        (eventos["LINHA"] == "SEM_LINHA") | (eventos["PN_LIMPO"] == "DESCONHECIDO") | (eventos["PN_LIMPO"] == "")
+    ).astype(int)
+
+    base_diaria = eventos.copy()
+    base_diaria["DATA"] = base_diaria["DATA_EVENTO"].dt.normalize()
+    tipo = base_diaria["TIPO"]
+    nc_aberta = (tipo == "NC_AUDITORIA") & (base_diaria.get("CLOSING_DATE").isna())
+    base_diaria["REF_QTD"] = pd.to_numeric(base_diaria.get("QTD", 0), errors="coerce").fillna(0)
+    base_diaria["REF_FREQ"] = (tipo == "REFUGO").astype(int)
+    base_diaria["REC_FORMAL"] = (tipo == "RECLAMACAO_FORMAL").astype(int)
+    base_diaria["REC_INFORMAL"] = (tipo == "RECLAMACAO_INFORMAL").astype(int)
+    base_diaria["NC_TOTAL"] = (tipo == "NC_AUDITORIA").astype(int)
+    base_diaria["NC_ABERTA"] = nc_aberta.astype(int)
+    anchor = pd.Timestamp(base_diaria["DATA"].dropna().max()).normalize()
+    due_dt = pd.to_datetime(base_diaria.get("DUE_DATE"), errors="coerce").dt.normalize()
+    base_diaria["NC_VENCIDA"] = (nc_aberta & due_dt.notna() & (due_dt < anchor)).astype(int)
+    agregada = base_diaria.groupby(["DATA", "LINHA", "PN_LIMPO"], dropna=False).agg(
+        REF_QTD_SUM=("REF_QTD", "sum"),
+        REF_FREQ_SUM=("REF_FREQ", "sum"),
+        REC_FORMAL_SUM=("REC_FORMAL", "sum"),
+        REC_INFORMAL_SUM=("REC_INFORMAL", "sum"),
+        NC_TOTAL_SUM=("NC_TOTAL", "sum"),
+        NC_ABERTA_SUM=("NC_ABERTA", "sum"),
+        NC_VENCIDA_SUM=("NC_VENCIDA", "sum"),
+    ).reset_index()
+    return eventos, agregada
+
+
+def agora(ev: pd.DataFrame, nc_raw: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # as etapas só usam run[...]: um dict faz o papel do PipelineRun
+    run = {"build_master": {"eventos": ev}, "nc_enrich": {"nc_pack": {"nc_raw": nc_raw}}}
+    run["events"] = _events(run)
+    return run["events"], _daily_cube(run)["agregada"]
+
+
+def _medir(fn, ev: pd.DataFrame, nc_raw: pd.DataFrame, repeticoes: int) -> tuple[float, float]:
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn(ev, nc_raw)
+        tempos.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn(ev, nc_raw)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(tempos)), pico / 2**20
+
+
+def _mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--eventos", type=int, default=2_000_000)
+    ap.add_argument("--repeticoes", type=int, default=3)
+    args = ap.parse_args()
+
+    ev, nc_raw = gerar_eventos(args.eventos)
+    print(f"{len(ev):,} eventos + {len(nc_raw):,} NC | entrada {_mb(ev):,.0f} MB")
+
+    ev_a, ag_a = antes(ev, nc_raw)
+    ev_b, ag_b = agora(ev, nc_raw)
+    chaves = ["DATA", "LINHA", "PN_LIMPO"]
+    # mesma ordem do groupby antigo, sem reordenar
+    pd.testing.assert_frame_equal(ag_a, ag_b.astype({c: ag_a[c].dtype for c in chaves}), check_dtype=False)
+
+    for nome, fn, (e, a) in (("antes", antes, (ev_a, ag_a)), ("agora", agora, (ev_b, ag_b))):
+        seg, pico = _medir(fn, ev, nc_raw, args.repeticoes)
+        print(f"{nome:5s} | {seg:6.2f} s | pico alocado {pico:7,.0f} MB | eventos {_mb(e):6,.0f} MB | agregada {_mb(a):5,.0f} MB ({len(a):,} células)")
+
+
+if __name__ == "__main__":
+    main()
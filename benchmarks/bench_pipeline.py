@@ -0,0 +1,243 @@
+"""Suíte de benchmark do pipeline de auditoria, ponta a ponta, com saída em JSON.
+
+Para cada escala (linhas somando as planilhas de entrada):
+
+1. gera as planilhas sintéticas (``gerar_planilhas.py``; reaproveita se já existirem);
+2. roda o ``PipelineRun`` no próprio processo e registra o tempo de cada etapa
+   e o pico de RSS;
+3. sobe o app (``hackaton.routers.ai``) num cliente ASGI em processo (httpx,
+   sem servidor nem rede) com ``STORAGE_DIR`` numa pasta temporária e mede:
+   ``POST /api/process`` (resposta e run concluído, acompanhando
+   ``/api/jobs``), o mesmo upload de novo (reaproveitado), ``POST /process``
+   (que espera o run) e a latência de ``/api/top_linhas`` e ``/api/chat``.
+
+Antes de medir, o ``LAYOUT`` das planilhas é conferido contra os builders
+(``gerar_planilhas.validar_layout``); se não bater, a suíte para.
+
+O resultado vai para ``benchmarks/resultados/pipeline_<data>.json`` (ou
+``--saida``; a pasta é ignorada pelo git) com commit, versões e máquina, para
+comparar execuções.
+
+Uso:
+    python benchmarks/bench_pipeline.py                              # 10k e 100k linhas
+    python benchmarks/bench_pipeline.py --eventos 10000 1000000 5000000 --requisicoes 100
+    python benchmarks/bench_pipeline.py --eventos 50000 --sem-http    # só as etapas
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+RAIZ = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(RAIZ))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from gerar_planilhas import gerar, validar_layout  # noqa: E402
+
+PRESETS = ["desde_sempre", "30d", "90d", "mes_anterior", "ano_atual"]
+MENSAGENS = [
+    "quais as linhas mais críticas?",
+    "principais motivos da {linha} nos últimos 30 dias",
+    "buscar vazamento",
+    "resumo do mês anterior",
+]
+
+
+def _pico_rss_mb() -> float:
+    # ru_maxrss em KiB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _estatisticas(ms: list[float]) -> dict:
+    a = np.asarray(ms)
+    return {
+        "n": int(a.size),
+        "p50_ms": round(float(np.percentile(a, 50)), 2),
+        "p95_ms": round(float(np.percentile(a, 95)), 2),
+        "max_ms": round(float(a.max()), 2),
+        "media_ms": round(float(a.mean()), 2),
+    }
+
+
+def bench_etapas(paths: dict[str, Path], pasta: Path) -> dict:
+    """PipelineRun no processo atual, sem cache de ingest (etapas a frio)."""
+    from hackaton.routers.processing.pipeline import PipelineRun
+    from hackaton.settings import Settings
+
+    out_dir = pasta / "run_etapas"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    run = PipelineRun(
+        "bench", {k: str(v) for k, v in paths.items()}, out_dir,
+        export_workers=Settings().EXPORT_MAX_WORKERS, ingest_workers=Settings().INGEST_MAX_WORKERS,
+    ).executar()
+    total = time.perf_counter() - t0
+    eventos = run["events"]
+    return {
+        "total_s": round(total, 3),
+        "etapas_s": dict(run.tempos),
+        "pico_rss_mb": round(_pico_rss_mb(), 1),
+        "eventos": len(eventos),
+        "celulas_agregada": len(run["daily_cube"]["agregada"]),
+        "linhas_distintas": int(eventos["LINHA"].nunique()),
+        "saida_mb": round(sum(p.stat().st_size for p in out_dir.iterdir() if p.is_file()) / 2**20, 1),
+    }
+
+
+async def _acompanhar(cliente, run_id: str, intervalo: float = 0.05) -> dict:
+    while True:
+        st = (await cliente.get(f"/api/jobs/{run_id}")).json()
+        if st.get("state") in ("done", "error"):
+            return st
+        await asyncio.sleep(intervalo)
+
+
+async def _latencias(cliente, metodo: str, url: str, n: int, **kw) -> list[float]:
+    ms = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        r = await cliente.request(metodo, url, **kw)
+        ms.append((time.perf_counter() - t0) * 1000)
+        r.raise_for_status()
+    return ms
+
+
+async def bench_http(paths: dict[str, Path], storage: Path, requisicoes: int) -> dict:
+    """Requisições pelo app real num cliente ASGI em processo."""
+    import httpx
+
+    from hackaton.routers import ai
+
+    def arquivos() -> dict:
+        return {nome: (f"{nome}.xlsx", Path(p).read_bytes()) for nome, p in paths.items()}
+
+    res = {}
+    transporte = httpx.ASGITransport(app=ai.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+        corpo = arquivos()
+        t0 = time.perf_counter()
+        r = await cliente.post("/api/process", files=corpo)
+        resposta = time.perf_counter() - t0
+        r.raise_for_status()
+        run_id = r.json()["run_id"]
+        st = await _acompanhar(cliente, run_id)
+        if st.get("state") != "done":
+            raise RuntimeError(f"run {run_id} falhou: {st.get('error')}")
+        res["api_process"] = {
+            "resposta_s": round(resposta, 3),
+            "concluido_s": round(time.perf_counter() - t0, 3),
+            "etapas_s": {e["name"]: e.get("seconds") for e in st.get("stages", [])},
+        }
+
+        t0 = time.perf_counter()
+        r = await cliente.post("/api/process", files=corpo)
+        res["api_process_reaproveitado"] = {"resposta_s": round(time.perf_counter() - t0, 3), "reused": r.json().get("reused")}
+
+        # /process a frio: sem o índice de entradas nem o cache de ingest, senão reaproveita o run acima
+        shutil.rmtree(storage / "index", ignore_errors=True)
+        shutil.rmtree(storage / "cache", ignore_errors=True)
+        ai.indice_entradas.index_dir.mkdir(parents=True, exist_ok=True)
+        t0 = time.perf_counter()
+        r = await cliente.post("/process", files=arquivos())
+        res["process_html"] = {"concluido_s": round(time.perf_counter() - t0, 3), "status": r.status_code}
+
+        top = (await cliente.get(f"/api/top_linhas/{run_id}?limit=5")).json().get("top_linhas") or [{}]
+        linha = top[0].get("LINHA", "LINHA 1")
+        res["api_top_linhas"] = {
+            p: _estatisticas(await _latencias(cliente, "GET", f"/api/top_linhas/{run_id}?preset={p}&limit=15", requisicoes))
+            for p in PRESETS
+        }
+        res["api_chat"] = {}
+        for msg in MENSAGENS:
+            texto = msg.format(linha=linha)
+            ms = await _latencias(cliente, "POST", "/api/chat", requisicoes, json={"run_id": run_id, "message": texto})
+            res["api_chat"][texto] = _estatisticas(ms)
+    res["run_id"] = run_id
+    return res
+
+
+def _versao_git() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--eventos", type=int, nargs="+", default=[10_000, 100_000])
+    ap.add_argument("--linhas", type=int, default=120)
+    ap.add_argument("--pns", type=int, default=5000)
+    ap.add_argument("--requisicoes", type=int, default=30, help="requisições por preset/mensagem")
+    ap.add_argument("--planilhas", type=Path, default=Path(tempfile.gettempdir()) / "bench_planilhas", help="onde ficam as planilhas geradas")
+    ap.add_argument("--saida", type=Path, default=None)
+    ap.add_argument("--sem-http", action="store_true", help="só as etapas do pipeline")
+    args = ap.parse_args()
+
+    # o app (e os workers da fila, que herdam o ambiente) gravam numa pasta descartável
+    storage = Path(tempfile.mkdtemp(prefix="bench_storage_"))
+    os.environ["STORAGE_DIR"] = str(storage)
+
+    with tempfile.TemporaryDirectory(prefix="bench_layout_") as tmp:
+        problemas = validar_layout(Path(tmp))
+    if problemas:
+        sys.exit("LAYOUT das planilhas não bate com os builders:\n" + "\n".join(problemas))
+
+    resultado = {
+        "gerado_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _versao_git(),
+        "ambiente": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "pyarrow": pa.__version__,
+            "numpy": np.__version__,
+            "maquina": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "parametros": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "escalas": [],
+    }
+    try:
+        for n in args.eventos:
+            t0 = time.perf_counter()
+            paths = gerar(args.planilhas / f"eventos_{n}", n, args.linhas, args.pns)
+            escala = {
+                "eventos_entrada": n,
+                "geracao_s": round(time.perf_counter() - t0, 2),
+                "planilhas_mb": {k: round(p.stat().st_size / 2**20, 2) for k, p in paths.items()},
+            }
+            with tempfile.TemporaryDirectory(prefix="bench_run_") as tmp:
+                escala["pipeline"] = bench_etapas(paths, Path(tmp))
+            print(f"{n:>10,} linhas | pipeline {escala['pipeline']['total_s']:8.2f} s | {escala['pipeline']['etapas_s']}", flush=True)
+            if not args.sem_http:
+                escala["http"] = asyncio.run(bench_http(paths, storage, args.requisicoes))
+                h = escala["http"]
+                print(
+                    f"{'':>10} | /api/process {h['api_process']['concluido_s']:.2f} s | /process {h['process_html']['concluido_s']:.2f} s"
+                    f" | top_linhas p50 {h['api_top_linhas']['30d']['p50_ms']} ms", flush=True,
+                )
+            resultado["escalas"].append(escala)
+    finally:
+        shutil.rmtree(storage, ignore_errors=True)
+
+    saida = args.saida or Path(__file__).resolve().parent / "resultados" / f"pipeline_{datetime.now():%Y%m%d_%H%M%S}.json"
+    saida.parent.mkdir(parents=True, exist_ok=True)
+    saida.write_text(json.dumps(resultado, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+    print(f"resultado: {saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark: leitura da base de eventos/agregada em xlsx vs Parquet.
+
+Gera bases sintéticas no formato do pipeline, grava nos dois formatos e mede,
+cada leitura em um processo novo, o tempo de carga e o RSS máximo.
+
+Uso:
+    python benchmarks/bench_run_store.py                 # 100k e 1M eventos
+    python benchmarks/bench_run_store.py --linhas 100000 --pular-xlsx-acima 200000
+"""
+import argparse
+import multiprocessing as mp
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hackaton.routers.processing import run_store  # noqa: E402
+
+TIPOS = ["REFUGO", "RECLAMACAO_FORMAL", "RECLAMACAO_INFORMAL", "NC_AUDITORIA"]
+
+
+def gerar_eventos(n: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    linhas = np.array([f"LINHA {i}" for i in range(1, 81)])
+    pns = np.array([f"PN{i:05d}" for i in range(4000)])
+    datas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 730, n), unit="D")
+    tipo = rng.choice(TIPOS, n, p=[0.6, 0.1, 0.2, 0.1])
+    linha = linhas[rng.zipf(1.6, n) % len(linhas)]
+    return pd.DataFrame({
+        "TIPO": tipo,
+        "DATA_EVENTO": datas,
+        "LINHA_ORIGINAL": np.char.replace(linha.astype(str), "LINHA ", "L-"),
+        "LINHA": linha,
+        "PN_ORIGINAL": pns[rng.integers(0, len(pns), n)],
+        "PN_LIMPO": pns[rng.integers(0, len(pns), n)],
+        "DESCRICAO": rng.choice(["vazamento", "rebarba", "trinca", "dimensional fora", "cor"], n),
+        "QTD": np.where(tipo == "REFUGO", rng.integers(1, 100, n), 0),
+        "FREQ": 1,
+        "FLAG_RISCO_OCULTO": (rng.random(n) < 0.05).astype(int),
+    })
+
+
+def agregar(ev: pd.DataFrame) -> pd.DataFrame:
+    ev = ev.assign(DATA=ev["DATA_EVENTO"].dt.normalize())
+    return ev.groupby(["DATA", "LINHA", "PN_LIMPO"]).agg(
+        REF_QTD_SUM=("QTD", "sum"),
+        REF_FREQ_SUM=("FREQ", "sum"),
+    ).reset_index()
+
+
+def _rss_pico_kb() -> int:
+    # VmHWM é por espaço de memória; o ru_maxrss herda o pico do pai no exec
+    try:
+        for linha in Path("/proc/self/status").read_text().splitlines():
+            if linha.startswith("VmHWM:"):
+                return int(linha.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _ler(formato: str, out_dir: str, q: mp.Queue) -> None:
+    base = _rss_pico_kb()
+    t0 = time.perf_counter()
+    if formato == "xlsx":
+        ev = pd.read_excel(Path(out_dir) / "BASE_EVENTOS_LONG.xlsx", sheet_name="EVENTOS")
+        ag = pd.read_excel(Path(out_dir) / "BASE_AGREGADA_DIA_LINHA_PN.xlsx", sheet_name="AGREGADA_DIA_LINHA_PN")
+    else:
+        ev = pd.read_parquet(Path(out_dir) / run_store.EVENTOS_FILE)
+        ag = pd.read_parquet(Path(out_dir) / run_store.AGREGADA_FILE)
+    dt = time.perf_counter() - t0
+    rss = _rss_pico_kb()
+    q.put({"segundos": dt, "rss_mb": rss / 1024, "rss_delta_mb": (rss - base) / 1024, "linhas": len(ev) + len(ag)})
+
+
+def medir(formato: str, out_dir: Path) -> dict:
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    p = ctx.Process(target=_ler, args=(formato, str(out_dir), q))
+    p.start()
+    res = q.get()
+    p.join()
+    return res
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--linhas", type=int, nargs="+", default=[100_000, 1_000_000])
+    ap.add_argument("--pular-xlsx-acima", type=int, default=None,
+                    help="não gera xlsx acima desse nº de eventos (o openpyxl leva minutos)")
+    args = ap.parse_args()
+
+    for n in args.linhas:
+        with tempfile.TemporaryDirectory() as tmp:
+            out_dir = Path(tmp)
+            ev = gerar_eventos(n)
+            ag = agregar(ev)
+            run_store.salvar_run(out_dir, ev, ag)
+            fazer_xlsx = args.pular_xlsx_acima is None or n <= args.pular_xlsx_acima
+            if fazer_xlsx:
+                with pd.ExcelWriter(out_dir / "BASE_EVENTOS_LONG.xlsx", engine="openpyxl") as w:
+                    ev.to_excel(w, sheet_name="EVENTOS", index=False)
+                with pd.ExcelWriter(out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx", engine="openpyxl") as w:
+                    ag.to_excel(w, sheet_name="AGREGADA_DIA_LINHA_PN", index=False)
+
+            print(f"\n== {n:,} eventos ({len(ag):,} linhas agregadas) ==")
+            for formato in (["xlsx"] if fazer_xlsx else []) + ["parquet"]:
+                arquivos = (
+                    ["BASE_EVENTOS_LONG.xlsx", "BASE_AGREGADA_DIA_LINHA_PN.xlsx"] if formato == "xlsx"
+                    else [run_store.EVENTOS_FILE, run_store.AGREGADA_FILE]
+                )
+                tamanho = sum((out_dir / a).stat().st_size for a in arquivos) / 1024 ** 2
+                r = medir(formato, out_dir)
+                print(f"{formato:8s} disco {tamanho:8.1f} MB | carga {r['segundos']:8.3f} s | "
+                      f"RSS pico {r['rss_mb']:8.1f} MB (+{r['rss_delta_mb']:.1f})")
+
+
+if __name__ == "__main__":
+    main()
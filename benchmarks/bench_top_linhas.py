@@ -0,0 +1,155 @@
+"""Benchmark: montagem + serialização da resposta do /api/top_linhas.
+
+Compara, por requisição, o caminho antigo (máscara na agregada, groupby,
+``.apply`` por linha, ``iterrows`` e ``jsonable_encoder`` + JSONResponse)
+com o atual (cubo acumulado, ranking por ``argpartition``, faixas vetorizadas,
+``registros`` por coluna e ``RespostaRapida``/orjson). O ranking devolve todas
+as linhas (limit = nº de linhas), que é o pior caso da serialização.
+
+Uso:
+    python benchmarks/bench_top_linhas.py                      # 15, 500 e 5.000 linhas
+    python benchmarks/bench_top_linhas.py --linhas 15 500 --dias 730 --repeticoes 50
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hackaton.routers.processing.line_cube import METRICAS, construir_cubo, ranking  # noqa: E402
+from hackaton.routers.processing.respostas import (  # noqa: E402
+    TOP_LINHAS_COLUNAS, RespostaRapida, classe_linha, nivel_linha, orjson, registros,
+)
+
+
+def gerar_agregada(n_linhas: int, dias: int, seed: int = 42) -> pd.DataFrame:
+    """Uma linha da agregada por (dia, LINHA) com ~60% de ocupação."""
+    rng = np.random.default_rng(seed)
+    d, lin = np.meshgrid(np.arange(dias), np.arange(n_linhas), indexing="ij")
+    keep = rng.random(d.size) < 0.6
+    d, lin = d.ravel()[keep], lin.ravel()[keep]
+    n = len(d)
+    df = pd.DataFrame({
+        "DATA": pd.Timestamp("2024-01-01") + pd.to_timedelta(d, unit="D"),
+        "LINHA": np.char.add("LINHA ", lin.astype(str)),
+        "PN_LIMPO": "PN",
+    })
+    for m in METRICAS:
+        df[m] = rng.poisson(2, n) if m != "REF_QTD_SUM" else rng.integers(0, 80, n).astype(float)
+    return df
+
+
+# caminho antigo (cópia fiel do api_top_linhas antes do cubo)
+
+def _normalize_0_100(series: pd.Series) -> pd.Series:
+    s = pd.to_numeric(series, errors="coerce").fillna(0)
+    mx = s.max()
+    if mx <= 0:
+        return pd.Series([0.0] * len(s), index=s.index)
+    return (s / mx) * 100.0
+
+
+def _classificar(score: float) -> str:
+    if score >= 80:
+        return "Crítico"
+    if score >= 55:
+        return "Atenção"
+    if score >= 30:
+        return "Médio"
+    return "Estável"
+
+
+def _nivel_simples(score: float) -> str:
+    if score >= 70:
+        return "Alta"
+    if score >= 45:
+        return "Média"
+    return "Baixa"
+
+
+def antes(df: pd.DataFrame, start: pd.Timestamp, end: pd.Timestamp, limit: int) -> bytes:
+    d = pd.to_datetime(df["DATA"], errors="coerce")
+    m = (d >= start) & (d <= end + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1))
+    dfp = df[m].copy()
+    g = dfp.groupby("LINHA", dropna=False).agg(
+        REF_QTD=("REF_QTD_SUM", "sum"),
+        REF_FREQ=("REF_FREQ_SUM", "sum"),
+        REC_FORMAL=("REC_FORMAL_SUM", "sum"),
+        REC_INFORMAL=("REC_INFORMAL_SUM", "sum"),
+        NC_TOTAL=("NC_TOTAL_SUM", "sum"),
+        NC_ABERTA=("NC_ABERTA_SUM", "sum"),
+        NC_VENCIDA=("NC_VENCIDA_SUM", "sum"),
+    ).reset_index()
+    g["TOTAL_RECLAMACOES"] = g["REC_FORMAL"] + g["REC_INFORMAL"]
+    score = (0.40 * _normalize_0_100(g["TOTAL_RECLAMACOES"]) + 0.30 * _normalize_0_100(g["NC_TOTAL"])
+             + 0.20 * _normalize_0_100(g["REF_QTD"]) + 0.10 * _normalize_0_100(g["REF_FREQ"]))
+    g["Score_Linha"] = score.round(2)
+    g["Classe_Linha"] = g["Score_Linha"].apply(_classificar)
+    g = g.sort_values("Score_Linha", ascending=False).head(max(1, int(limit)))
+    out = []
+    for _, r in g.iterrows():
+        out.append({
+            "LINHA": r.get("LINHA", "SEM_LINHA"),
+            "Score_Linha": float(r.get("Score_Linha", 0) or 0),
+            "Classe_Linha": r.get("Classe_Linha", "Médio"),
+            "Nivel": _nivel_simples(float(r.get("Score_Linha", 0) or 0)),
+            "Total_Reclamacoes": int(r.get("TOTAL_RECLAMACOES", 0) or 0),
+            "Reclamacoes_Formais": int(r.get("REC_FORMAL", 0) or 0),
+            "Reclamacoes_Informais": int(r.get("REC_INFORMAL", 0) or 0),
+            "NC_Total": int(r.get("NC_TOTAL", 0) or 0),
+            "NC_Aberta": int(r.get("NC_ABERTA", 0) or 0),
+            "NC_Vencida": int(r.get("NC_VENCIDA", 0) or 0),
+            "Refugo_Qtd": float(r.get("REF_QTD", 0) or 0),
+            "Refugo_Freq": int(r.get("REF_FREQ", 0) or 0),
+        })
+    return JSONResponse(jsonable_encoder({"ok": True, "top_linhas": out})).body
+
+
+def agora(cubo, start: pd.Timestamp, end: pd.Timestamp, limit: int) -> bytes:
+    g = ranking(cubo, cubo.totais(start, end), limit)
+    score = g["Score_Linha"].to_numpy()
+    colunas = {**g, "Classe_Linha": classe_linha(score), "Nivel": nivel_linha(score)}
+    return RespostaRapida({"ok": True, "top_linhas": registros(colunas, TOP_LINHAS_COLUNAS)}).body
+
+
+def _cronometrar(fn, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - t0)
+    return float(np.median(tempos)) * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--linhas", type=int, nargs="+", default=[15, 500, 5_000])
+    ap.add_argument("--dias", type=int, default=365)
+    ap.add_argument("--repeticoes", type=int, default=20)
+    args = ap.parse_args()
+
+    print(f"encoder: orjson {orjson.__version__}")
+    for n in args.linhas:
+        df = gerar_agregada(n, args.dias)
+        cubo = construir_cubo(df)
+        end = df["DATA"].max()
+        start = end - pd.Timedelta(days=29)
+
+        a, b = antes(df, start, end, n), agora(cubo, start, end, n)
+        assert len(json.loads(a)["top_linhas"]) == len(json.loads(b)["top_linhas"])
+
+        t_antes = _cronometrar(lambda: antes(df, start, end, n), args.repeticoes)
+        t_agora = _cronometrar(lambda: agora(cubo, start, end, n), args.repeticoes)
+        print(f"{n:6,d} linhas ({len(df):,} linhas agregadas) | antes {t_antes:9.2f} ms | agora {t_agora:8.2f} ms "
+              f"| {t_antes / t_agora:6.1f}x | {len(b) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
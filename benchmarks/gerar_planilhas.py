@@ -0,0 +1,276 @@
+"""Gerador de planilhas sintéticas de entrada do pipeline de auditoria.
+
+Produz reclamacoes.xlsx, refugos.xlsx, mapa_cc.xlsx e auditoria_nc.xlsx em
+qualquer escala (10 mil a 5 milhões de linhas no total), com o que deixa o
+dado de planta difícil:
+
+- distribuição assimétrica: poucas linhas e poucos PNs concentram a maior
+  parte dos eventos (pesos ~ 1/posição^``ASSIMETRIA``);
+- grafias bagunçadas da linha ("LINHA 12", "Linha 012", "L-12", " linha 12 ",
+  "LN12"...), PN com espaço e minúscula, células vazias;
+- NC com status, prazo e fechamento coerentes (fechada só depois de criada).
+
+Os cabeçalhos estão em ``LAYOUT``. O builder da base mestra (v2_builder) e o
+parser da auditoria NC não estão neste repositório, então não há lista de
+colunas para copiar: ``validar_layout`` prova o ``LAYOUT`` passando planilhas
+pequenas pelas etapas do pipeline até ``events``. Cada planilha tem que virar
+eventos do seu TIPO, com data e LINHA reconhecida, e a auditoria NC tem que
+trazer as colunas que ``pipeline._events`` lê. O bench_pipeline roda a
+validação antes de medir (um cabeçalho errado não quebra o builder: só gera
+uma base vazia, e o benchmark mediria nada).
+
+Aba acima do limite do Excel (1.048.575 linhas) continua em Sheet2, Sheet3...
+O gerador grava ``gerado.json`` com os parâmetros: chamar de novo com os
+mesmos parâmetros na mesma pasta reaproveita os arquivos.
+
+Uso:
+    python benchmarks/gerar_planilhas.py /tmp/planilhas_100k --eventos 100000
+    python benchmarks/gerar_planilhas.py /tmp/planilhas_layout --validar
+    python benchmarks/gerar_planilhas.py /tmp/planilhas_5m --eventos 5000000 --linhas 400 --pns 20000
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from hackaton.routers.processing.excel_export import EXCEL_MAX_LINHAS  # noqa: E402
+
+LAYOUT = {
+    "refugos": ["Data", "Linha", "PN", "Motivo", "Qtd", "Centro de Custo"],
+    "reclamacoes": ["Data", "Linha", "PN", "Tipo", "Descricao", "Cliente"],
+    "mapa_cc": ["Centro de Custo", "Linha"],
+    "auditoria_nc": ["Created", "Linha", "Description", "Status", "Due date", "Closing date", "14Q"],
+}
+# fração do total de linhas em cada planilha de eventos
+PROPORCAO = {"refugos": 0.70, "reclamacoes": 0.25, "auditoria_nc": 0.05}
+# TIPO dos eventos que cada planilha gera (pipeline.agregar_eventos)
+TIPOS = {"refugos": ("REFUGO",), "reclamacoes": ("RECLAMACAO_FORMAL", "RECLAMACAO_INFORMAL"), "auditoria_nc": ("NC_AUDITORIA",)}
+# colunas da auditoria NC que pipeline._events lê do nc_raw
+COLUNAS_NC_PIPELINE = ("Created", "Description", "Status", "Due date", "Closing date", "14Q")
+ASSIMETRIA = 1.1
+
+MOTIVOS_REFUGO = [
+    "vazamento na solda", "rebarba", "trinca na peça", "cor errada", "falha de montagem",
+    "dimensional fora", "porosidade", "amassado", "rosca danificada", "peça faltando",
+]
+DESCRICOES_RECLAMACAO = [
+    "cliente reclamou de vazamento", "ruído na montagem", "peça chegou amassada", "falha de montagem no cliente",
+    "embalagem danificada", "cor diferente do padrão", "trinca encontrada na inspeção", "rebarba cortante",
+]
+DESCRICOES_NC = ["vazamento de óleo", "5S fora do padrão", "EPI ausente", "instrução de trabalho desatualizada", "calibração vencida"]
+STATUS_NC = ["Open", "In progress", "Closed"]
+CLIENTES = ["Cliente A", "Cliente B", "Cliente C", "Cliente D"]
+
+
+def _pesos(n: int) -> np.ndarray:
+    p = 1.0 / np.arange(1, n + 1) ** ASSIMETRIA
+    return p / p.sum()
+
+
+def _grafias(numeros: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Nome da linha como digitado na planta: ~60% no padrão, o resto variado."""
+    n = numeros.astype(str)
+    variantes = [
+        np.char.add("LINHA ", n),
+        np.char.add("Linha ", n),
+        np.char.add("Linha ", np.char.zfill(n, 3)),
+        np.char.add("L-", n),
+        np.char.add(np.char.add(" linha ", n), " "),
+        np.char.add("LN", n),
+        np.char.add("Linha-", n),
+    ]
+    escolha = rng.choice(len(variantes), len(numeros), p=[0.6, 0.15, 0.06, 0.07, 0.05, 0.04, 0.03])
+    saida = variantes[0].astype(object)
+    for i in range(1, len(variantes)):
+        m = escolha == i
+        saida[m] = variantes[i][m]
+    return saida
+
+
+def _datas(n: int, inicio: pd.Timestamp, dias: int, rng: np.random.Generator) -> pd.Series:
+    # volume cresce ao longo do período (mais eventos recentes)
+    d = np.floor(dias * np.sqrt(rng.random(n))).astype(np.int64)
+    return pd.Series(inicio + pd.to_timedelta(d, unit="D"))
+
+
+def gerar_eventos(
+    n_total: int, n_linhas: int = 120, n_pns: int = 5000, dias: int = 730,
+    inicio: str = "2024-01-01", seed: int = 42,
+) -> dict[str, pd.DataFrame]:
+    """As quatro planilhas como DataFrames (colunas de ``LAYOUT``)."""
+    rng = np.random.default_rng(seed)
+    inicio_ts = pd.Timestamp(inicio)
+    p_linha, p_pn = _pesos(n_linhas), _pesos(n_pns)
+    # cada linha fabrica uma fatia de PNs: PN = (base da linha + deslocamento assimétrico)
+    pns = np.array([f"{7000000 + i:08d}" for i in range(n_pns)], dtype=object)
+    ordem_linhas = rng.permutation(n_linhas) + 1
+    cc = np.arange(4100, 4100 + n_linhas)
+
+    def linhas_e_pns(n: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        li = rng.choice(n_linhas, n, p=p_linha)
+        pi = (li * (n_pns // max(n_linhas, 1)) + rng.choice(n_pns, n, p=p_pn)) % n_pns
+        pn = pns[pi]
+        # PN como vem do ERP: às vezes com espaço ou sufixo de revisão
+        sujo = rng.random(n)
+        pn = np.where(sujo < 0.05, np.char.add(pn.astype(str), " "), pn)
+        pn = np.where((sujo >= 0.05) & (sujo < 0.08), np.char.add(pn.astype(str), "-A"), pn).astype(object)
+        return ordem_linhas[li], li, pn
+
+    planilhas = {}
+    n_ref = int(n_total * PROPORCAO["refugos"])
+    num, li, pn = linhas_e_pns(n_ref)
+    planilhas["refugos"] = pd.DataFrame({
+        "Data": _datas(n_ref, inicio_ts, dias, rng),
+        "Linha": _grafias(num, rng),
+        "PN": pn,
+        "Motivo": np.array(MOTIVOS_REFUGO, dtype=object)[rng.choice(len(MOTIVOS_REFUGO), n_ref, p=_pesos(len(MOTIVOS_REFUGO)))],
+        "Qtd": np.maximum(1, rng.geometric(0.08, n_ref)),
+        "Centro de Custo": cc[li],
+    })
+
+    n_rec = int(n_total * PROPORCAO["reclamacoes"])
+    num, li, pn = linhas_e_pns(n_rec)
+    linha_rec = _grafias(num, rng)
+    linha_rec[rng.random(n_rec) < 0.02] = None
+    planilhas["reclamacoes"] = pd.DataFrame({
+        "Data": _datas(n_rec, inicio_ts, dias, rng),
+        "Linha": linha_rec,
+        "PN": pn,
+        "Tipo": rng.choice(np.array(["Formal", "Informal"], dtype=object), n_rec, p=[0.35, 0.65]),
+        "Descricao": np.array(DESCRICOES_RECLAMACAO, dtype=object)[rng.integers(0, len(DESCRICOES_RECLAMACAO), n_rec)],
+        "Cliente": rng.choice(np.array(CLIENTES, dtype=object), n_rec),
+    })
+
+    planilhas["mapa_cc"] = pd.DataFrame({"Centro de Custo": cc, "Linha": np.char.add("LINHA ", (np.arange(n_linhas) + 1).astype(str))})
+
+    n_nc = max(1, n_total - n_ref - n_rec)
+    num, _, _ = linhas_e_pns(n_nc)
+    criada = _datas(n_nc, inicio_ts, dias, rng)
+    prazo = criada + pd.to_timedelta(rng.integers(7, 90, n_nc), unit="D")
+    status = rng.choice(np.array(STATUS_NC, dtype=object), n_nc, p=[0.3, 0.2, 0.5])
+    fechada = criada + pd.to_timedelta(rng.integers(1, 120, n_nc), unit="D")
+    planilhas["auditoria_nc"] = pd.DataFrame({
+        "Created": criada,
+        "Linha": _grafias(num, rng),
+        "Description": np.array(DESCRICOES_NC, dtype=object)[rng.integers(0, len(DESCRICOES_NC), n_nc)],
+        "Status": status,
+        "Due date": prazo,
+        "Closing date": fechada.where(status == "Closed"),
+        "14Q": rng.choice(np.array(["Q1", "Q2", "Q3", "Q4"], dtype=object), n_nc),
+    })
+    return {nome: df[LAYOUT[nome]] for nome, df in planilhas.items()}
+
+
+def escrever_planilha(path: Path, df: pd.DataFrame) -> None:
+    """openpyxl write-only; acima do limite do Excel continua na aba seguinte."""
+    wb = Workbook(write_only=True)
+    colunas = list(df.columns)
+    # openpyxl quer objetos Python: datetime, int, float, str ou None
+    valores = []
+    for c in colunas:
+        s = df[c]
+        if s.dtype.kind == "M":
+            valores.append([None if pd.isna(v) else v.to_pydatetime() for v in s])
+        else:
+            valores.append(s.astype(object).where(s.notna(), None).tolist())
+    for n_aba, ini in enumerate(range(0, max(len(df), 1), EXCEL_MAX_LINHAS), start=1):
+        ws = wb.create_sheet(f"Sheet{n_aba}")
+        ws.append(colunas)
+        for linha in zip(*(v[ini:ini + EXCEL_MAX_LINHAS] for v in valores)):
+            ws.append(linha)
+    tmp = path.with_name(path.name + ".tmp")
+    wb.save(tmp)
+    tmp.replace(path)
+
+
+def gerar(pasta: Path, n_total: int, n_linhas: int = 120, n_pns: int = 5000, dias: int = 730, seed: int = 42) -> dict[str, Path]:
+    """Grava as quatro planilhas em ``pasta`` (reaproveita se já geradas com os mesmos parâmetros)."""
+    pasta = Path(pasta)
+    pasta.mkdir(parents=True, exist_ok=True)
+    parametros = {"eventos": n_total, "linhas": n_linhas, "pns": n_pns, "dias": dias, "seed": seed, "layout": LAYOUT}
+    paths = {nome: pasta / f"{nome}.xlsx" for nome in LAYOUT}
+    marca = pasta / "gerado.json"
+    try:
+        if json.loads(marca.read_text(encoding="utf-8")).get("parametros") == parametros and all(p.exists() for p in paths.values()):
+            return paths
+    except (OSError, ValueError):
+        pass
+
+    t0 = time.perf_counter()
+    for nome, df in gerar_eventos(n_total, n_linhas, n_pns, dias, seed=seed).items():
+        escrever_planilha(paths[nome], df)
+    marca.write_text(json.dumps({"parametros": parametros, "segundos": round(time.perf_counter() - t0, 2)}), encoding="utf-8")
+    return paths
+
+
+def validar_layout(pasta: Path, n_total: int = 2000) -> list[str]:
+    """Planilhas pequenas de ``LAYOUT`` pelas etapas do pipeline até ``events``; devolve o que não bateu (vazio = ok)."""
+    from hackaton.routers.processing.pipeline import PipelineRun
+
+    pasta = Path(pasta)
+    paths = gerar(pasta, n_total, n_linhas=10, n_pns=50)
+    run = PipelineRun("layout", {k: str(v) for k, v in paths.items()}, pasta, ingest_workers=1)
+    try:
+        eventos = run["events"]
+    except Exception as e:
+        # cabeçalho que falta costuma sair como KeyError de dentro do builder
+        return [f"o builder recusou as planilhas: {type(e).__name__}: {e} (LAYOUT {LAYOUT})"]
+    problemas = []
+    nc_pack = run["nc_enrich"]["nc_pack"]
+    if "erro" in nc_pack:
+        problemas.append(f"auditoria_nc: o parser da NC recusou a planilha ({nc_pack['erro']})")
+    elif isinstance(nc_pack.get("nc_raw"), pd.DataFrame):
+        faltam = [c for c in COLUNAS_NC_PIPELINE if c not in nc_pack["nc_raw"]]
+        if faltam:
+            problemas.append(f"auditoria_nc: o pipeline lê {faltam} e o parser não devolveu (cabeçalhos {LAYOUT['auditoria_nc']})")
+
+    n_ref, n_rec = int(n_total * PROPORCAO["refugos"]), int(n_total * PROPORCAO["reclamacoes"])
+    esperado = {"refugos": n_ref, "reclamacoes": n_rec, "auditoria_nc": max(1, n_total - n_ref - n_rec)}
+    tipo = eventos["TIPO"].astype(str)
+    for nome, tipos in TIPOS.items():
+        ev = eventos[tipo.isin(tipos).to_numpy()]
+        # o builder pode descartar uma ou outra linha (código excluído, PN vazio); metade já é cabeçalho errado
+        if len(ev) < esperado[nome] * 0.9:
+            problemas.append(f"{nome}: {len(ev)} de {esperado[nome]} linhas viraram eventos {'/'.join(tipos)} (cabeçalhos {LAYOUT[nome]})")
+            continue
+        if ev["DATA_EVENTO"].isna().mean() > 0.01:
+            problemas.append(f"{nome}: eventos sem DATA_EVENTO (cabeçalhos {LAYOUT[nome]})")
+        # reclamações têm ~2% de linha vazia de propósito
+        if (ev["LINHA"].astype(str) == "SEM_LINHA").mean() > 0.05:
+            problemas.append(f"{nome}: LINHA não reconhecida na maior parte dos eventos (cabeçalhos {LAYOUT[nome]})")
+    return problemas
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pasta", type=Path)
+    ap.add_argument("--eventos", type=int, default=100_000, help="linhas somando refugos, reclamações e NC")
+    ap.add_argument("--linhas", type=int, default=120, help="linhas de produção distintas")
+    ap.add_argument("--pns", type=int, default=5000, help="PNs distintos")
+    ap.add_argument("--dias", type=int, default=730)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--validar", action="store_true", help="confere o LAYOUT contra os builders do pipeline e sai")
+    args = ap.parse_args()
+
+    if args.validar:
+        problemas = validar_layout(args.pasta)
+        for p in problemas:
+            print(p)
+        sys.exit(1 if problemas else 0)
+
+    t0 = time.perf_counter()
+    paths = gerar(args.pasta, args.eventos, args.linhas, args.pns, args.dias, args.seed)
+    for nome, p in paths.items():
+        print(f"{nome:13s} {p.stat().st_size / 2**20:8.1f} MB  {p}")
+    print(f"{time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
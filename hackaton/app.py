@@ -1,8 +1,32 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from hackaton.metrics import instrumentar
 from hackaton.routers import users, audits, auth, files
+from hackaton.routers.processing.retention import Varredor, limpar_pasta
+from hackaton.settings import Settings
+
+
+def _limpar_uploads() -> dict:
+    cfg = Settings()
+    return limpar_pasta(files.UPLOAD_DIR, cfg.UPLOADS_RETENCAO_DIAS * 24 * 3600, cfg.UPLOADS_MAX_BYTES)
+
+
+# hackaton/uploads (routers/files.py) com a mesma retenção por idade/tamanho dos runs
+varredor_uploads = Varredor(Settings().RETENCAO_INTERVALO_S, _limpar_uploads, trava=files.UPLOAD_DIR / ".limpeza.lock")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    varredor_uploads.iniciar()
+    yield
+    varredor_uploads.parar()
+
+
+app = FastAPI(title='Audit', lifespan=lifespan)
 
-app = FastAPI(title='Audit')
+instrumentar(app)
 
 app.include_router(users.router)
 
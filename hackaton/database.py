@@ -1,9 +1,11 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
 
+from hackaton.metrics import instrumentar_engine
 from hackaton.settings import Settings
 
 engine = create_engine(Settings().DATABASE_URL)
+instrumentar_engine(engine)
 
 
 def get_session():
@@ -0,0 +1,288 @@
+"""Métricas dos apps no formato texto do Prometheus (``GET /metrics``).
+
+Registro próprio (sem prometheus_client): contadores e histogramas com
+rótulos, e gauges lidos na hora da coleta. O que entra:
+
+- ``http_request_duration_seconds``: latência por método, rota (o template,
+  ``/api/top_linhas/{run_id}``, não a URL) e status;
+- ``http_request_db_queries`` / ``http_request_db_seconds``: consultas e tempo
+  de banco de cada requisição (eventos do SQLAlchemy, ver ``instrumentar_engine``);
+- ``pipeline_stage_seconds`` / ``pipeline_stage_rows_total`` / ``pipeline_runs_total``:
+  o pipeline roda nos processos da fila, então as etapas são lidas do
+  ``job.json`` quando o job termina (``observar_run``);
+- gauges de cache e fila registrados pelo app (``REGISTRO.gauge``).
+
+Os números são do processo: com vários workers do uvicorn cada um expõe os seus.
+"""
+import math
+import threading
+import time
+from collections.abc import Callable, Iterable
+from contextvars import ContextVar
+
+from fastapi import FastAPI
+from starlette.requests import Request
+from starlette.responses import Response
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_ETAPA = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _valor(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _escapar(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(nomes: tuple[str, ...], valores: tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Iterable[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(rotulos.get(n, "")) for n in self.rotulos)
+
+    def cabecalho(self) -> list[str]:
+        return [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Iterable[str] = ()):
+        super().__init__(nome, ajuda, rotulos)
+        self._valores: dict[tuple[str, ...], float] = {}
+
+    def inc(self, valor: float = 1, **rotulos: str) -> None:
+        k = self._chave(rotulos)
+        with self._lock:
+            self._valores[k] = self._valores.get(k, 0) + valor
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            itens = sorted(self._valores.items())
+        return [f"{self.nome}{_rotulos(self.rotulos, k)} {_valor(v)}" for k, v in itens]
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Iterable[str] = (), buckets: Iterable[float] = BUCKETS_LATENCIA):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+        # por série: contagem por bucket (não acumulada), soma, total
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, **rotulos: str) -> None:
+        k = self._chave(rotulos)
+        i = next((i for i, b in enumerate(self.buckets) if valor <= b), len(self.buckets))
+        with self._lock:
+            s = self._series.get(k)
+            if s is None:
+                s = self._series[k] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += valor
+            s[2] += 1
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            itens = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        linhas = []
+        for k, (contagens, soma, total) in itens:
+            acumulado = 0
+            for b, c in zip((*self.buckets, math.inf), contagens):
+                acumulado += c
+                le = f'le="{_valor(b)}"'
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos, k, le)} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, k)} {_valor(soma)}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, k)} {total}")
+        return linhas
+
+
+class Gauge(_Metrica):
+    """Valor lido na coleta (``fn`` devolve um número ou ``{(rótulos...): número}``)."""
+
+    def __init__(self, nome: str, ajuda: str, fn: Callable[[], float | dict], rotulos: Iterable[str] = (), tipo: str = "gauge"):
+        super().__init__(nome, ajuda, rotulos)
+        self.fn = fn
+        self.tipo = tipo
+
+    def exportar(self) -> list[str]:
+        v = self.fn()
+        if not isinstance(v, dict):
+            return [f"{self.nome} {_valor(v)}"]
+        return [f"{self.nome}{_rotulos(self.rotulos, k)} {_valor(x)}" for k, x in sorted(v.items())]
+
+
+class Registro:
+    def __init__(self):
+        self._metricas: dict[str, _Metrica] = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, m: _Metrica) -> _Metrica:
+        with self._lock:
+            # mesmo nome de novo (os dois apps, reload): devolve a já registrada,
+            # exceto gauge, cuja função é trocada pela nova
+            atual = self._metricas.get(m.nome)
+            if atual is not None and not isinstance(m, Gauge):
+                return atual
+            self._metricas[m.nome] = m
+            return m
+
+    def contador(self, nome: str, ajuda: str, rotulos: Iterable[str] = ()) -> Contador:
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome: str, ajuda: str, rotulos: Iterable[str] = (), buckets: Iterable[float] = BUCKETS_LATENCIA) -> Histograma:
+        return self._registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+    def gauge(self, nome: str, ajuda: str, fn: Callable[[], float | dict], rotulos: Iterable[str] = (), tipo: str = "gauge") -> Gauge:
+        return self._registrar(Gauge(nome, ajuda, fn, rotulos, tipo))
+
+    def exportar(self) -> str:
+        with self._lock:
+            metricas = list(self._metricas.values())
+        linhas = []
+        for m in metricas:
+            try:
+                corpo = m.exportar()
+            except Exception:
+                # gauge com erro não derruba a coleta inteira
+                continue
+            linhas += m.cabecalho() + corpo
+        return "\n".join(linhas) + "\n"
+
+
+REGISTRO = Registro()
+
+HTTP_DURACAO = REGISTRO.histograma(
+    "http_request_duration_seconds", "Latência das requisições HTTP.", ("method", "route", "status"),
+)
+HTTP_DB_CONSULTAS = REGISTRO.histograma(
+    "http_request_db_queries", "Consultas ao banco por requisição (só as que usaram o banco).", ("route",), BUCKETS_CONSULTAS,
+)
+HTTP_DB_SEGUNDOS = REGISTRO.histograma(
+    "http_request_db_seconds", "Tempo de banco por requisição (só as que usaram o banco).", ("route",),
+)
+DB_CONSULTAS = REGISTRO.contador("db_queries_total", "Consultas executadas no banco.")
+DB_SEGUNDOS = REGISTRO.contador("db_query_seconds_total", "Tempo somado das consultas ao banco.")
+ETAPA_SEGUNDOS = REGISTRO.histograma(
+    "pipeline_stage_seconds", "Duração de cada etapa do pipeline.", ("stage",), BUCKETS_ETAPA,
+)
+ETAPA_LINHAS = REGISTRO.contador(
+    "pipeline_stage_rows_total", "Linhas produzidas por etapa (maior tabela da etapa).", ("stage",),
+)
+RUNS = REGISTRO.contador("pipeline_runs_total", "Runs terminados, por estado.", ("state",))
+RUN_SEGUNDOS = REGISTRO.histograma(
+    "pipeline_run_seconds", "Duração do run inteiro (soma das etapas).", ("state",), BUCKETS_ETAPA,
+)
+
+# [consultas, segundos] da requisição em andamento; None fora de requisição
+_banco: ContextVar[list | None] = ContextVar("metricas_banco", default=None)
+
+
+def instrumentar_engine(engine) -> None:
+    """Conta consultas e tempo de banco por requisição (listeners do SQLAlchemy)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metricas_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _depois(conn, cursor, statement, parameters, context, executemany):
+        pilha = conn.info.get("metricas_t0")
+        if not pilha:
+            return
+        dur = time.perf_counter() - pilha.pop()
+        DB_CONSULTAS.inc()
+        DB_SEGUNDOS.inc(dur)
+        acc = _banco.get()
+        if acc is not None:
+            acc[0] += 1
+            acc[1] += dur
+
+
+def observar_run(status: dict) -> None:
+    """Etapas e linhas de um run terminado, a partir do job.json (``JobQueue(ao_terminar=...)``)."""
+    estado = status.get("state") or "unknown"
+    total = 0.0
+    for e in status.get("stages") or []:
+        seg = float(e.get("seconds") or 0)
+        total += seg
+        ETAPA_SEGUNDOS.observar(seg, stage=e.get("name", ""))
+        if e.get("rows") is not None:
+            ETAPA_LINHAS.inc(int(e["rows"]), stage=e.get("name", ""))
+    RUNS.inc(state=estado)
+    RUN_SEGUNDOS.observar(total, state=estado)
+
+
+def _rota(scope: dict) -> str:
+    # o FastAPI grava a rota casada no scope; 404 e mounts ficam agrupados
+    return getattr(scope.get("route"), "path", None) or "<sem rota>"
+
+
+class MetricasHTTP:
+    """Middleware ASGI: latência por rota e banco por requisição."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        acc = [0, 0.0]
+        token = _banco.set(acc)
+
+        async def _send(msg):
+            nonlocal status
+            if msg["type"] == "http.response.start":
+                status = msg["status"]
+            await send(msg)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            dur = time.perf_counter() - t0
+            _banco.reset(token)
+            rota = _rota(scope)
+            HTTP_DURACAO.observar(dur, method=scope.get("method", ""), route=rota, status=str(status))
+            if acc[0]:
+                HTTP_DB_CONSULTAS.observar(acc[0], route=rota)
+                HTTP_DB_SEGUNDOS.observar(acc[1], route=rota)
+
+
+async def _metrics(request: Request) -> Response:
+    return Response(REGISTRO.exportar(), media_type=CONTENT_TYPE)
+
+
+def instrumentar(app: FastAPI) -> None:
+    """``/metrics``, latência por rota e ``?profile=1`` (admin) no app."""
+    from .profiling import PerfilRequisicao
+
+    app.add_api_route("/metrics", _metrics, methods=["GET"], include_in_schema=False)
+    # o último adicionado é o mais externo: o perfil mede a requisição inteira
+    app.add_middleware(MetricasHTTP)
+    app.add_middleware(PerfilRequisicao)
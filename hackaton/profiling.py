@@ -0,0 +1,156 @@
+"""``?profile=1``: perfil amostrado de uma requisição, só para admin.
+
+Com o parâmetro na query string e um Bearer de admin (o mesmo JWT de
+``security.get_current_admin``), a requisição roda normalmente mas a resposta
+é descartada; no lugar volta um JSON com o perfil. Uma thread tira a pilha das
+outras threads a cada ``INTERVALO`` (``sys._current_frames``), então pega
+tanto o event loop quanto o threadpool dos endpoints síncronos. Thread parada
+esperando (select do loop, fila vazia do pool) não conta como amostra.
+
+O perfil traz as funções com mais amostras (``proprio`` = no topo da pilha,
+``total`` = em qualquer nível) e as pilhas mais frequentes no formato
+"collapsed" (``raiz;...;folha``), que os geradores de flame graph leem direto.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from http import HTTPStatus
+from urllib.parse import parse_qs
+
+from jwt import PyJWTError, decode
+from starlette.responses import JSONResponse
+
+from hackaton.security import ALGORITHM
+from hackaton.settings import Settings
+
+INTERVALO = 0.002
+MAX_PROFUNDIDADE = 128
+TOP_FUNCOES = 40
+TOP_PILHAS = 25
+
+# folha da pilha de uma thread que está só esperando
+_OCIOSOS = ("threading.py", "selectors.py", "queue.py")
+
+
+def _rotulo(code) -> str:
+    arquivo = "/".join(code.co_filename.replace("\\", "/").rsplit("/", 2)[-2:])
+    return f"{code.co_name} ({arquivo}:{code.co_firstlineno})"
+
+
+def _pilha(frame) -> tuple[str, ...] | None:
+    """Pilha raiz→folha da thread, ou None se ela está parada esperando."""
+    folha = frame.f_code
+    if folha.co_filename.endswith(_OCIOSOS) or (folha.co_name == "_worker" and folha.co_filename.endswith("thread.py")):
+        return None
+    rotulos = []
+    while frame is not None and len(rotulos) < MAX_PROFUNDIDADE:
+        rotulos.append(_rotulo(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(rotulos))
+
+
+class Amostrador(threading.Thread):
+    def __init__(self, intervalo: float = INTERVALO):
+        super().__init__(name="perfil-amostrador", daemon=True)
+        self.intervalo = intervalo
+        self.amostras = 0
+        self.pilhas: Counter[tuple[str, ...]] = Counter()
+        self._parar = threading.Event()
+
+    def run(self) -> None:
+        proprio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            self.amostras += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == proprio:
+                    continue
+                pilha = _pilha(frame)
+                if pilha is not None:
+                    self.pilhas[pilha] += 1
+
+    def parar(self) -> None:
+        self._parar.set()
+        self.join()
+
+    def resumo(self) -> dict:
+        proprio, total = Counter(), Counter()
+        for pilha, n in self.pilhas.items():
+            proprio[pilha[-1]] += n
+            for f in set(pilha):
+                total[f] += n
+        ativas = sum(self.pilhas.values())
+        return {
+            "intervalo_ms": self.intervalo * 1000,
+            "amostras": self.amostras,
+            "amostras_ativas": ativas,
+            "funcoes": [
+                {"funcao": f, "proprio": proprio[f], "total": n, "pct_total": round(100 * n / ativas, 1)}
+                for f, n in total.most_common(TOP_FUNCOES)
+            ],
+            "pilhas": [{"pilha": ";".join(p), "amostras": n} for p, n in self.pilhas.most_common(TOP_PILHAS)],
+        }
+
+
+def _pediu_perfil(scope: dict) -> bool:
+    qs = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return qs.get("profile", ["0"])[-1] in ("1", "true")
+
+
+def _erro_admin(scope: dict) -> tuple[HTTPStatus, str] | None:
+    cabecalhos = dict(scope.get("headers") or [])
+    auth = cabecalhos.get(b"authorization", b"").decode("latin-1")
+    esquema, _, token = auth.partition(" ")
+    if esquema.lower() != "bearer" or not token:
+        return HTTPStatus.UNAUTHORIZED, "profile=1 exige token de admin"
+    try:
+        payload = decode(token, Settings().SECRETY_KEY, algorithms=[ALGORITHM])
+    except PyJWTError:
+        return HTTPStatus.UNAUTHORIZED, "Invalid or expired token!"
+    if payload.get("role") != "admin":
+        return HTTPStatus.FORBIDDEN, "profile=1 é só para admin"
+    return None
+
+
+class PerfilRequisicao:
+    """Middleware ASGI do ``?profile=1`` (ver docstring do módulo)."""
+
+    def __init__(self, app, intervalo: float = INTERVALO):
+        self.app = app
+        self.intervalo = intervalo
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _pediu_perfil(scope):
+            await self.app(scope, receive, send)
+            return
+        erro = _erro_admin(scope)
+        if erro is not None:
+            status, msg = erro
+            await JSONResponse({"ok": False, "error": msg}, status_code=status)(scope, receive, send)
+            return
+
+        resposta = {"status": None, "bytes": 0}
+
+        async def _descartar(msg):
+            if msg["type"] == "http.response.start":
+                resposta["status"] = msg["status"]
+            elif msg["type"] == "http.response.body":
+                resposta["bytes"] += len(msg.get("body", b""))
+
+        amostrador = Amostrador(self.intervalo)
+        amostrador.start()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _descartar)
+        finally:
+            duracao = time.perf_counter() - t0
+            amostrador.parar()
+        perfil = {
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "status": resposta["status"],
+            "response_bytes": resposta["bytes"],
+            "duracao_ms": round(duracao * 1000, 2),
+            **amostrador.resumo(),
+        }
+        await JSONResponse({"ok": True, "profile": perfil})(scope, receive, send)
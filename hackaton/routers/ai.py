@@ -1,28 +1,118 @@
+import asyncio
+import os
 import shutil
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any
+from urllib.parse import quote, urlencode
 
+import numpy as np
 import pandas as pd
-from fastapi import FastAPI, UploadFile, File, Request, Form
-from fastapi.responses import HTMLResponse, FileResponse
+import pyarrow.parquet as pq
+from fastapi import FastAPI, UploadFile, File, Request, Form, Query
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from .config import settings
-from .processing.v2_builder import construir_base_mestra_v2
-from .processing.v3_2_moritz import gerar_planilha_v3_2
-from .processing.nc_auditoria import processar_nc_auditoria
+from .processing import run_store
+from .processing.pipeline import PipelineRun, config_pontuacao
+from .processing.delta import DeltaRun
+from .processing.jobs import DONE, ERROR, QUEUED, RUNNING, FilaCheia, JobQueue, ProgressoRun, conferir, ler_status
+from .processing.input_cache import IndiceEntradas, chave_run, copiar_com_hash, hash_arquivo
+from .processing.http_cache import IMUTAVEL, REVALIDAR, com_cache, combina, etag_arquivo, etag_leitura, nao_modificado
+from .processing.history import COLUNAS_AGREGAR, HistoricoEventos, cubo_periodo, tendencia_mensal
+from .processing.bundle import BUNDLE_FILE, ENTREGAVEIS, NOMES, stream_zip
+from .processing.lazy_exports import materializar
+from .processing.manifest import MANIFEST_FILE, ancora, ler_manifest, montar_manifest, resumo, salvar_manifest
+from .processing.periodos import PeriodoInvalido, datas_explicitas, resolver_periodo
+from .processing.line_cube import CUBO_FILE, METRICAS, C, CuboLinhaDia, construir_cubo, ler_cubo, ranking
+from .processing.event_stream import FORMATOS, LIMITE_PADRAO, CursorInvalido, FiltroEventos, paginar, stream_arrow, stream_ndjson
+from .processing.compare import comparar, ranking_completo, transicoes
+from .processing.scenarios import COMPONENTES, CenarioInvalido, linhas_do_top, matriz_pesos, pontuar
+from .processing.respostas import CENARIO_COLUNAS, COMPARE_COLUNAS, TENDENCIA_COLUNAS, TOP_LINHAS_COLUNAS, RespostaRapida, classe_linha, nivel_linha, registros
+from .processing.text_index import INDICE_FILE, IndiceDescricoes, construir_indice, ler_indice, termo_busca
+from .processing.run_cache import RunDataCache
+from .processing.retention import Politica, Varredor, arquivado, desafixar, estado_runs, fixado, fixar, limpar_pasta, restaurar, tocar, varrer
+from hackaton.metrics import REGISTRO, instrumentar, observar_run
+from hackaton.settings import Settings
 
 APP_ROOT = Path(__file__).resolve().parent
-STORAGE = (APP_ROOT / ".." / "storage").resolve()
+STORAGE = Path(Settings().STORAGE_DIR or APP_ROOT / ".." / "storage").resolve()
 INPUTS = STORAGE / "inputs"
 OUTPUTS = STORAGE / "outputs"
+# eventos de todos os runs, por mês (ver processing/history.py)
+HISTORY = STORAGE / "history"
+# resultado dos builders por sha256 das planilhas (ver processing/ingest.py)
+INGEST_CACHE = STORAGE / "cache" / "ingest"
 INPUTS.mkdir(parents=True, exist_ok=True)
 OUTPUTS.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI(title="Auditoria IA Leve", version="0.1.0")
+# hash das entradas + config -> run_id já processado
+indice_entradas = IndiceEntradas(STORAGE / "index")
+historico = HistoricoEventos(HISTORY)
+
+# o histórico é escrito numa thread só: o fim do job não espera a cópia dos eventos
+historico_fila = ThreadPoolExecutor(max_workers=1, thread_name_prefix="historico")
+
+
+def _sincronizar_historico() -> list[str]:
+    return historico.sincronizar(OUTPUTS, _run_concluido)
+
+
+def _ao_terminar(status: dict) -> None:
+    """Métricas do run e, se ele concluiu, a cópia dos eventos para o histórico."""
+    observar_run(status)
+    if status.get("state") == DONE:
+        historico_fila.submit(_sincronizar_historico)
+
+
+# runs pesados vão para um pool de processos; o event loop fica livre para as leituras
+job_queue = JobQueue(Settings().JOBS_MAX_WORKERS, Settings().JOBS_MAX_PENDING, ao_terminar=_ao_terminar)
+
+
+def _politica_retencao() -> Politica:
+    cfg, dia = Settings(), 24 * 3600
+    return Politica(cfg.RETENCAO_ARQUIVAR_DIAS * dia, cfg.RETENCAO_APAGAR_DIAS * dia, cfg.RETENCAO_MAX_BYTES)
+
+
+def _varrer_storage() -> dict:
+    """Retenção dos runs (ver processing/retention.py)."""
+    # run que ainda não foi para o histórico (de outro worker, de antes do
+    # servidor subir) entra antes de sair do disco
+    _sincronizar_historico()
+    politica = _politica_retencao()
+    resultado = varrer(OUTPUTS, INPUTS, politica)
+    for run_id in resultado["archived"] + resultado["deleted"]:
+        run_cache.invalidar(run_id)
+    # reaproveitamento de upload não aponta para run apagado
+    resultado["index_removed"] = indice_entradas.limpar(lambda run_id: (OUTPUTS / run_id).is_dir())
+    # o cache dos builders é por conteúdo (vários runs podem usar a mesma entrada): vai por idade/tamanho
+    if INGEST_CACHE.is_dir():
+        resultado["ingest_cache"] = limpar_pasta(INGEST_CACHE, politica.arquivar_apos_s, Settings().RETENCAO_CACHE_MAX_BYTES)
+    return resultado
+
+
+varredor = Varredor(Settings().RETENCAO_INTERVALO_S, _varrer_storage, trava=STORAGE / ".retencao.lock")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    varredor.iniciar()
+    # runs concluídos enquanto o servidor estava fora
+    historico_fila.submit(_sincronizar_historico)
+    yield
+    varredor.parar()
+    job_queue.shutdown()
+    historico_fila.shutdown(wait=True, cancel_futures=True)
+
+
+# respostas de dados saem pelo orjson (ver processing/respostas.py)
+app = FastAPI(title="Auditoria IA Leve", version="0.1.0", lifespan=lifespan, default_response_class=RespostaRapida)
 
 # Integração Front (Vite/React) <-> Back (FastAPI)
 # - Dev: o front roda em http://localhost:5173
@@ -42,8 +132,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 app.mount("/static", StaticFiles(directory=str(APP_ROOT / "static")), name="static")
+# /metrics (Prometheus) e ?profile=1 para admin (ver hackaton/metrics.py)
+instrumentar(app)
 templates = Jinja2Templates(directory=str(APP_ROOT / "templates"))
 
+# bases já lidas ficam em memória entre as requisições (polling do dashboard)
+run_cache = RunDataCache(Settings().RUN_CACHE_MAX_BYTES)
+
+REGISTRO.gauge("run_cache_hits_total", "Leituras servidas pelo cache de bases.", lambda: run_cache.hits, tipo="counter")
+REGISTRO.gauge("run_cache_misses_total", "Leituras que foram ao disco.", lambda: run_cache.misses, tipo="counter")
+REGISTRO.gauge("run_cache_evictions_total", "Entradas despejadas por falta de espaço.", lambda: run_cache.evictions, tipo="counter")
+REGISTRO.gauge("run_cache_bytes", "Bytes ocupados pelo cache de bases.", lambda: run_cache.bytes)
+REGISTRO.gauge(
+    "run_cache_hit_ratio", "Fração das leituras servidas pelo cache.",
+    lambda: run_cache.hits / max(run_cache.hits + run_cache.misses, 1),
+)
+REGISTRO.gauge("jobs_pending", "Runs na fila ou rodando enfileirados por este processo.", lambda: job_queue.pendentes())
+
 
 # Utilidades datas presets
 
@@ -60,110 +165,186 @@ def _to_dt(s: Any) -> pd.Series:
     return pd.to_datetime(s, errors="coerce")
 
 
-def _data_ancora_from_outputs(run_id: str) -> pd.Timestamp | None:
-    """Usa a ltima data disponível nos dados do run """
+def _pasta_run(run_id: str) -> Path:
+    """Pasta do run para ler as bases: run arquivado é extraído de volta (ver processing/retention.py)."""
     out_dir = OUTPUTS / run_id
-    p = out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx"
-    if not p.exists():
-        return None
-    try:
-        df = pd.read_excel(p, sheet_name="AGREGADA_DIA_LINHA_PN")
-        df = _norm_cols(df)
-        if "DATA" not in df.columns:
+    if restaurar(out_dir, INPUTS / run_id):
+        run_cache.invalidar(run_id)
+    tocar(out_dir)
+    return out_dir
+
+
+def _carregar_agregada(run_id: str) -> pd.DataFrame | None:
+    """Base agregada do run via cache (somente leitura, não alterar in-place)."""
+    out_dir = _pasta_run(run_id)
+
+    def _load() -> pd.DataFrame | None:
+        df = run_store.ler_agregada(out_dir)
+        if df is None:
             return None
-        d = _to_dt(df["DATA"])
-        mx = d.max()
-        if pd.isna(mx):
+        df = _norm_cols(df)
+        df["DATA"] = _to_dt(df.get("DATA"))
+        return df
+
+    return run_cache.get(run_id, run_store.AGREGADA_FILE, run_store.mtime(out_dir, run_store.AGREGADA_FILE), _load)
+
+
+def _carregar_eventos(run_id: str) -> pd.DataFrame | None:
+    """Eventos do run via cache, só as colunas que o chat usa (somente leitura)."""
+    out_dir = _pasta_run(run_id)
+
+    def _load() -> pd.DataFrame | None:
+        ev = run_store.ler_eventos(out_dir, columns=["DATA_EVENTO", "LINHA", "DESCRICAO"])
+        if ev is None:
             return None
-        return pd.Timestamp(mx).normalize()
-    except Exception:
-        return None
+        ev = _norm_cols(ev)
+        ev["DATA_EVENTO"] = _to_dt(ev.get("DATA_EVENTO"))
+        return ev
 
+    return run_cache.get(run_id, run_store.EVENTOS_FILE, run_store.mtime(out_dir, run_store.EVENTOS_FILE), _load)
 
-def _periodo_range(preset: str | None, anchor: pd.Timestamp | None) -> tuple[pd.Timestamp | None, pd.Timestamp | None, str]:
-    """Converte presets do front em intervalo de datas pra nao cagar."""
-    preset = (preset or "desde_sempre").strip().lower()
-    # normaliza alguns sinonimos pro front
-    preset = preset.replace("-", "_")
-    if preset in {"all", "desde", "desde_sempre", "desde sempre", "sempre", "since"}:
-        return None, None, "Desde sempre"
-    if anchor is None or pd.isna(anchor):
-        # sem âncora ele não consegue filtrar
-        return None, None, "Desde sempre"
 
-    end = anchor.normalize()
+def _carregar_cubo(run_id: str) -> CuboLinhaDia | None:
+    """Cubo LINHA × dia do run; run antigo sem o .npz tem o cubo montado da agregada (só em memória)."""
+    out_dir = _pasta_run(run_id)
+    mt = run_store.mtime(out_dir, CUBO_FILE)
+    if mt is not None:
+        return run_cache.get(run_id, CUBO_FILE, mt, lambda: ler_cubo(out_dir))
 
-    if preset in {"hoje", "today"}:
-        return end, end, f"Hoje ({end.date()})"
-    if preset in {"ultimos_7_dias", "ultimos 7 dias", "últimos 7 dias", "7d", "last7"}:
-        start = end - pd.Timedelta(days=6)
-        return start, end, f"Últimos 7 dias ({start.date()}–{end.date()})"
-    if preset in {"ultimos_30_dias", "ultimos 30 dias", "últimos 30 dias", "ultimo_mes", "último mês", "30d", "last30"}:
-        start = end - pd.Timedelta(days=29)
-        return start, end, f"Últimos 30 dias ({start.date()}–{end.date()})"
+    def _montar() -> CuboLinhaDia | None:
+        df = _carregar_agregada(run_id)
+        return construir_cubo(df) if df is not None else None
 
-    if preset in {"este_mes", "mtd", "month_to_date", "mes_atual", "mês atual"}:
-        start = end.replace(day=1)
-        return start, end, f"Este mês ({start.date()}–{end.date()})"
+    return run_cache.get(run_id, CUBO_FILE, run_store.mtime(out_dir, run_store.AGREGADA_FILE), _montar)
 
-    # fallback
-    return None, None, "Desde sempre"
 
+def _carregar_indice(run_id: str) -> IndiceDescricoes | None:
+    """Índice de descrições do run; run antigo sem o .npz tem o índice montado dos eventos (só em memória)."""
+    out_dir = _pasta_run(run_id)
+    mt = run_store.mtime(out_dir, INDICE_FILE)
+    if mt is not None:
+        return run_cache.get(run_id, INDICE_FILE, mt, lambda: ler_indice(out_dir))
+
+    def _montar() -> IndiceDescricoes | None:
+        ev = _carregar_eventos(run_id)
+        return construir_indice(ev) if ev is not None else None
+
+    return run_cache.get(run_id, INDICE_FILE, run_store.mtime(out_dir, run_store.EVENTOS_FILE), _montar)
+
+
+def _montar_manifest_legado(run_id: str) -> dict | None:
+    """Run anterior ao manifest: monta uma vez das bases salvas e grava (só se o run já terminou)."""
+    out_dir = _pasta_run(run_id)
+    if not run_store.existe(out_dir, run_store.AGREGADA_FILE):
+        return None
+    agregada = run_store.ler_agregada(out_dir, columns=["DATA", "LINHA"])
+    eventos = run_store.ler_eventos(out_dir, columns=["TIPO"])
+    entradas = {p.stem: hash_arquivo(p) for p in sorted((INPUTS / run_id).glob("*.xlsx"))}
+    manifest = montar_manifest(run_id, eventos, _norm_cols(agregada), out_dir, inputs=entradas)
+    st = ler_status(out_dir)
+    if st is None or st.get("state") == DONE:
+        salvar_manifest(out_dir, manifest)
+    return manifest
+
+
+def _carregar_manifest(run_id: str) -> dict | None:
+    """manifest.json do run via cache (somente leitura)."""
+    out_dir = OUTPUTS / run_id
+    mt = run_store.mtime(out_dir, MANIFEST_FILE)
+    if mt is None:
+        return _montar_manifest_legado(run_id)
+    return run_cache.get(run_id, MANIFEST_FILE, mt, lambda: ler_manifest(out_dir))
+
+
+def _data_ancora_from_outputs(run_id: str) -> pd.Timestamp | None:
+    """Usa a ltima data disponível nos dados do run (lida do manifest)"""
+    try:
+        return ancora(_carregar_manifest(run_id))
+    except Exception:
+        return None
 
-def _filter_period(df: pd.DataFrame, col_data: str, start: pd.Timestamp | None, end: pd.Timestamp | None) -> pd.DataFrame:
-    if df is None or df.empty:
-        return df
-    if start is None and end is None:
-        return df
-    d = _to_dt(df[col_data])
-    m = pd.Series(True, index=df.index)
-    if start is not None:
-        m &= (d >= start)
-    if end is not None:
-        m &= (d <= end + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1))
-    return df[m].copy()
-
-
-def _normalize_0_100(series: pd.Series) -> pd.Series:
-    s = pd.to_numeric(series, errors="coerce").fillna(0)
-    mx = s.max()
-    if mx <= 0:
-        return pd.Series([0.0] * len(s), index=s.index)
-    return (s / mx) * 100.0
-
-
-def _classificar(score: float) -> str:
-    if score >= 80:
-        return "Crítico"
-    if score >= 55:
-        return "Atenção"
-    if score >= 30:
-        return "Médio"
-    return "Estável"
-
-
-def _nivel_simples(score: float) -> str:
-    """Rótulo simples Baixa/Média/Alta para leitura rápida do meu auditor."""
-    if score >= 70:
-        return "Alta"
-    if score >= 45:
-        return "Média"
-    return "Baixa"
 
 #puta merda que desgraça mecher nessa porra de run id ta slk eu att a pagina e saporra morre e nao armazaena inferno do caralho
-def save_upload(run_id: str, up: UploadFile, name: str) -> str:
+def save_upload(run_id: str, up: UploadFile, name: str) -> tuple[str, str]:
+    """Grava o upload e devolve (caminho, sha256) — o hash sai no mesmo passe da cópia."""
     run_dir = INPUTS / run_id
     run_dir.mkdir(parents=True, exist_ok=True)
     dest = run_dir / name
-    with dest.open("wb") as f:
-        shutil.copyfileobj(up.file, f)
-    return str(dest)
+    digest = copiar_com_hash(up.file, dest)
+    return str(dest), digest
 
 def make_outputs_dir(run_id: str) -> Path:
     out_dir = OUTPUTS / run_id
     out_dir.mkdir(parents=True, exist_ok=True)
     return out_dir
 
+
+def _salvar_uploads(run_id: str, reclamacoes: UploadFile, refugos: UploadFile, mapa_cc: UploadFile, auditoria_nc: UploadFile) -> tuple[dict[str, str], dict[str, str]]:
+    paths, digests = {}, {}
+    for nome, up in (("reclamacoes", reclamacoes), ("refugos", refugos), ("mapa_cc", mapa_cc), ("auditoria_nc", auditoria_nc)):
+        paths[nome], digests[nome] = save_upload(run_id, up, f"{nome}.xlsx")
+    return paths, digests
+
+
+def _run_reaproveitavel(run_id: str) -> bool:
+    # run com erro não serve; na fila / rodando serve (o cliente acompanha o mesmo job)
+    # só se ainda tem dono: future neste processo ou batida recente (órfão vira erro em ``conferir``)
+    if job_queue.future(run_id) is not None:
+        return True
+    st = conferir(OUTPUTS / run_id)
+    return st is not None and st.get("state") in (DONE, QUEUED, RUNNING)
+
+
+def _enfileirar_ou_reaproveitar(run_id: str, paths: dict[str, str], digests: dict[str, str], parent_run_id: str | None = None) -> str:
+    """Enfileira o run, ou devolve o run_id de um run anterior com as mesmas entradas e config."""
+    # run incremental: as mesmas planilhas sobre outro pai são outro run
+    chave = chave_run({**digests, "parent_run_id": parent_run_id} if parent_run_id else digests, config_pontuacao())
+    try:
+        dono = indice_entradas.reservar(
+            chave, run_id, _run_reaproveitavel,
+            lambda: job_queue.submit(run_id, make_outputs_dir(run_id), _executar_pipeline, run_id, paths, digests, parent_run_id),
+            inputs=digests, parent_run_id=parent_run_id,
+        )
+    except FilaCheia:
+        # nada foi enfileirado: uploads e a pasta de saída vazia não ficam para trás
+        shutil.rmtree(INPUTS / run_id, ignore_errors=True)
+        shutil.rmtree(OUTPUTS / run_id, ignore_errors=True)
+        raise
+    if dono != run_id:
+        shutil.rmtree(INPUTS / run_id, ignore_errors=True)
+    return dono
+
+
+async def _aguardar_run(run_id: str) -> dict:
+    """job.json final do run; antes disso, o atual se passar de ``JOBS_ESPERA_MAX_S``."""
+    limite = time.monotonic() + Settings().JOBS_ESPERA_MAX_S
+    fut = job_queue.future(run_id)
+    if fut is not None:
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(fut), timeout=Settings().JOBS_ESPERA_MAX_S)
+        except asyncio.CancelledError:
+            if not fut.cancelled():
+                raise  # a requisição foi cancelada, não o job
+        except Exception:
+            pass  # o erro já está no job.json (ou estourou o prazo, visto abaixo)
+    # job de outro worker do uvicorn: acompanha pelo job.json; dono morto vira erro em ``conferir``
+    st = conferir(OUTPUTS / run_id) or {}
+    while st.get("state") not in (DONE, ERROR) and time.monotonic() < limite:
+        await asyncio.sleep(0.5)
+        st = conferir(OUTPUTS / run_id) or {}
+    return st
+
+
+def _top_linhas_periodo(run_id: str, start_date: str | None, end_date: str | None) -> dict:
+    """Ranking do período pedido no upload (vazio quando o form não mandou datas)."""
+    if not (start_date or end_date):
+        return {}
+    return _top_linhas(run_id, start_date=start_date, end_date=end_date)
+
+
+def _fila_cheia(e: FilaCheia) -> RespostaRapida:
+    return RespostaRapida({"ok": False, "error": f"Fila de processamento cheia, tente de novo em instantes ({e})."}, status_code=503)
+
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
     return templates.TemplateResponse("index.html", {
@@ -173,6 +354,60 @@ def home(request: Request):
         "modelo": settings.MORITZ_MODEL
     })
 
+def _executar_pipeline(prog: ProgressoRun, run_id: str, paths: dict[str, str], digests: dict[str, str] | None = None, parent_run_id: str | None = None) -> dict:
+    """Roda o pipeline do run no worker da fila (nunca no event loop).
+
+    Com ``parent_run_id`` o run é incremental (ver processing/delta.py).
+    O retorno vai para o ``result`` do job.json:
+       links de download
+       TOP_LINHAS em JSON para a Matriz de Risco do front
+    """
+    opcoes = dict(
+        progresso=prog, export_workers=Settings().EXPORT_MAX_WORKERS,
+        digests=digests, cache_dir=INGEST_CACHE, ingest_workers=Settings().INGEST_MAX_WORKERS,
+    )
+    if parent_run_id:
+        run = DeltaRun(run_id, paths, make_outputs_dir(run_id), OUTPUTS / parent_run_id, **opcoes).executar()
+    else:
+        run = PipelineRun(run_id, paths, make_outputs_dir(run_id), **opcoes).executar()
+
+    # Serializa TOP_LINHAS para o front: o do v3.2 (run completo) e o do cubo
+    # (incremental) saem no mesmo contrato do /api/top_linhas
+    top_linhas_df = run["scoring"].get("top_linhas", pd.DataFrame())
+    if "Score_Linha" in top_linhas_df:
+        score = pd.to_numeric(top_linhas_df["Score_Linha"], errors="coerce").to_numpy(dtype=float)
+        if "Classe_Linha" not in top_linhas_df:
+            top_linhas_df = top_linhas_df.assign(Classe_Linha=classe_linha(score))
+        if "Nivel" not in top_linhas_df:
+            top_linhas_df = top_linhas_df.assign(Nivel=nivel_linha(score))
+    anchor = run["daily_cube"]["anchor"]
+
+    if parent_run_id:
+        # sem base mestra / v3.2 no incremental; as bases longas saem no primeiro download
+        files = {
+            "base_eventos": f"/download/{run_id}/BASE_EVENTOS_LONG.xlsx",
+            "base_agregada": f"/download/{run_id}/BASE_AGREGADA_DIA_LINHA_PN.xlsx",
+        }
+    else:
+        files = {
+            "base_v2": f"/download/{run_id}/BASE_MESTRA_AUDITORIA_V2.xlsx",
+            "resultado": f"/download/{run_id}/RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx",
+        }
+    resultado = {
+        "files": files,
+        # Garantir que NaN não vire 'NaN' no JSON pra n quebrar com a logica da leitura no front
+        "top_linhas": registros(top_linhas_df, TOP_LINHAS_COLUNAS),
+        "use_moritz": settings.USE_MORITZ,
+        "model": settings.MORITZ_MODEL,
+        "anchor_date": (pd.Timestamp(anchor).date().isoformat() if pd.notna(anchor) else None),
+        # tempo e pico de memória de cada xlsx gravado
+        "exports": run["export"],
+    }
+    if parent_run_id:
+        resultado.update(parent_run_id=parent_run_id, delta=run["manifest"]["delta"])
+    return resultado
+
+
 @app.post("/process", response_class=HTMLResponse)
 async def process(
     request: Request,
@@ -183,169 +418,38 @@ async def process(
     start_date: str | None = Form(None),
     end_date: str | None = Form(None),
 ):
-    run_id = str(uuid.uuid4())[:8]
-
-    path_recl = save_upload(run_id, reclamacoes, "reclamacoes.xlsx")
-    path_ref  = save_upload(run_id, refugos, "refugos.xlsx")
-    path_map  = save_upload(run_id, mapa_cc, "mapa_cc.xlsx")
-    path_nc = save_upload(run_id, auditoria_nc, "auditoria_nc.xlsx")
-    out_dir = make_outputs_dir(run_id)
-
-    # Importante o processamento pesado gera uma base completa não filtrada
-    # para permitir filtros por período depois sem reprocessar.
-    result_v2 = construir_base_mestra_v2(
-        arquivo_refugo=path_ref,
-        arquivo_reclamacoes=path_recl,
-        arquivo_mapa_cc=path_map,
-        codigos_excluir=settings.CODIGOS_EXCLUIR,
-        start_date=None,
-        end_date=None
-    )
-
-
-    # Auditoria NC   também sem filtro aqui filtro posterior em cima da base
-
-    nc_pack = None
     try:
-        nc_pack = processar_nc_auditoria(path_nc, start_date=None, end_date=None)
-        # Enriquecer a base mestre por meio de LINHA mesma NC para todos PNs daquela linha
-        if "nc_linhas" in nc_pack and not nc_pack["nc_linhas"].empty:
-            mestre = result_v2["mestre"].merge(nc_pack["nc_linhas"], on="LINHA", how="left")
-            result_v2["mestre"] = mestre
-    except Exception as e:
-        # não quebra o fluxo se a planilha vier diferente
-        nc_pack = {"erro": str(e)}
-
-    base_v2_path = out_dir / "BASE_MESTRA_AUDITORIA_V2.xlsx"
-    rastreio_path = out_dir / "PN_RASTREIO_ORIGINAL_LIMPO.xlsx"
-    colisoes_path = out_dir / "PN_COLISOES.xlsx"
-
-    result_v2["mestre"].to_excel(base_v2_path, index=False)
-    result_v2["rastreio"].to_excel(rastreio_path, index=False)
-    result_v2["colisoes"].to_excel(colisoes_path, index=False)
-
-    #  Saídas analíticas para filtros posteriores por data/período
-    # Base de eventos unificada totalmente
-    eventos = result_v2.get("eventos", pd.DataFrame()).copy()
-    # Acoplar NC como eventos se existir
-    if isinstance(nc_pack, dict) and "nc_raw" in nc_pack and isinstance(nc_pack["nc_raw"], pd.DataFrame) and not nc_pack["nc_raw"].empty:
-        nc_raw = nc_pack["nc_raw"].copy()
-        nc_ev = pd.DataFrame({
-            "TIPO": "NC_AUDITORIA",
-            "DATA_EVENTO": pd.to_datetime(nc_raw.get("Created"), errors="coerce"),
-            "LINHA_ORIGINAL": nc_raw.get("LINHA_ORIGINAL", ""),
-            "LINHA": nc_raw.get("LINHA", "SEM_LINHA"),
-            "PN_ORIGINAL": "",
-            "PN_LIMPO": "",
-            "DESCRICAO": nc_raw.get("Description", ""),
-            "QTD": 0,
-            "FREQ": 1,
-            "STATUS": nc_raw.get("Status", ""),
-            "DUE_DATE": pd.to_datetime(nc_raw.get("Due date"), errors="coerce"),
-            "CLOSING_DATE": pd.to_datetime(nc_raw.get("Closing date"), errors="coerce"),
-            "Q14": nc_raw.get("14Q", ""),
-        })
-        eventos = pd.concat([eventos, nc_ev], ignore_index=True)
-
-    eventos["DATA_EVENTO"] = pd.to_datetime(eventos.get("DATA_EVENTO"), errors="coerce")
-    eventos["FLAG_RISCO_OCULTO"] = ((eventos.get("LINHA", "SEM_LINHA") == "SEM_LINHA") | (eventos.get("PN_LIMPO", "") == "DESCONHECIDO") | (eventos.get("PN_LIMPO", "") == "")).astype(int)
-
-    base_eventos_path = out_dir / "BASE_EVENTOS_LONG.xlsx"
-    risco_oculto_path = out_dir / "RISCO_OCULTO.xlsx"
-    base_diaria_path  = out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx"
-    colisoes_linha_path = out_dir / "COLISOES_LINHA.xlsx"
-
-    # Base agregada por dia/linha/pn para  filtros rápidos
-    base_diaria = eventos.copy()
-    base_diaria["DATA"] = base_diaria["DATA_EVENTO"].dt.date
-    # normaliza PN vazio pra n cagar no final
-    base_diaria["PN_LIMPO"] = base_diaria.get("PN_LIMPO", "").fillna("")
-    base_diaria["LINHA"] = base_diaria.get("LINHA", "SEM_LINHA").fillna("SEM_LINHA")
-
-    def _cnt(mask):
-        return mask.astype(int)
-
-    base_diaria["REF_QTD"] = pd.to_numeric(base_diaria.get("QTD", 0), errors="coerce").fillna(0)
-    base_diaria["REF_FREQ"] = _cnt(base_diaria["TIPO"] == "REFUGO")
-    base_diaria["REC_FORMAL"] = _cnt(base_diaria["TIPO"] == "RECLAMACAO_FORMAL")
-    base_diaria["REC_INFORMAL"] = _cnt(base_diaria["TIPO"] == "RECLAMACAO_INFORMAL")
-    base_diaria["NC_TOTAL"] = _cnt(base_diaria["TIPO"] == "NC_AUDITORIA")
-    base_diaria["NC_ABERTA"] = _cnt((base_diaria["TIPO"] == "NC_AUDITORIA") & (base_diaria.get("CLOSING_DATE").isna()))
-    # vencida due existe, aberta, e due < hoje requisito pedido no ultimo feedback com a ana 
-    hoje = pd.Timestamp.now().normalize().date()
-    due_dt = pd.to_datetime(base_diaria.get("DUE_DATE"), errors="coerce").dt.date
-    base_diaria["NC_VENCIDA"] = _cnt((base_diaria["TIPO"] == "NC_AUDITORIA") & (base_diaria.get("CLOSING_DATE").isna()) & (due_dt.notna()) & (due_dt < hoje))
-
-    base_diaria_agg = base_diaria.groupby(["DATA","LINHA","PN_LIMPO"], dropna=False).agg(
-        REF_QTD_SUM=("REF_QTD","sum"),
-        REF_FREQ_SUM=("REF_FREQ","sum"),
-        REC_FORMAL_SUM=("REC_FORMAL","sum"),
-        REC_INFORMAL_SUM=("REC_INFORMAL","sum"),
-        NC_TOTAL_SUM=("NC_TOTAL","sum"),
-        NC_ABERTA_SUM=("NC_ABERTA","sum"),
-        NC_VENCIDA_SUM=("NC_VENCIDA","sum"),
-    ).reset_index()
-
-    # Colisõesvariações de linha para auditoria do dado
-    col_lin = eventos.copy()
-    col_lin["LINHA_ORIGINAL"] = col_lin.get("LINHA_ORIGINAL", "").fillna("").astype(str)
-    col_lin = col_lin[col_lin["LINHA_ORIGINAL"].str.strip() != ""].groupby("LINHA")["LINHA_ORIGINAL"].apply(lambda s: " | ".join(sorted(set(s))[:30])).reset_index(name="EXEMPLOS_LINHA_ORIGINAL")
-    col_lin["QTD_VARIACOES"] = col_lin["EXEMPLOS_LINHA_ORIGINAL"].apply(lambda x: len([p for p in str(x).split("|") if p.strip()]))
-
-    # Exportações normais
-    risco_oculto = eventos[eventos["FLAG_RISCO_OCULTO"] == 1].copy()
-    with pd.ExcelWriter(base_eventos_path, engine="openpyxl") as w:
-        eventos.to_excel(w, sheet_name="EVENTOS", index=False)
-    with pd.ExcelWriter(risco_oculto_path, engine="openpyxl") as w:
-        risco_oculto.to_excel(w, sheet_name="RISCO_OCULTO", index=False)
-    with pd.ExcelWriter(base_diaria_path, engine="openpyxl") as w:
-        base_diaria_agg.to_excel(w, sheet_name="AGREGADA_DIA_LINHA_PN", index=False)
-    with pd.ExcelWriter(colisoes_linha_path, engine="openpyxl") as w:
-        col_lin.to_excel(w, sheet_name="COLISOES_LINHA", index=False)
-
-    pesos = {
-        "PESO_FORMAL": settings.PESO_FORMAL,
-        "PESO_INFORMAL": settings.PESO_INFORMAL,
-        "PESO_REF_QTD": settings.PESO_REF_QTD,
-        "PESO_REF_FREQ": settings.PESO_REF_FREQ,
-        "PESO_IA_TEXTO": settings.PESO_IA_TEXTO,
-    }
-
-    plan = gerar_planilha_v3_2(
-        mestre=result_v2["mestre"],
-        pesos=pesos,
-        moritz_model=settings.MORITZ_MODEL,
-        use_moritz=settings.USE_MORITZ,
-        nc_linhas=(nc_pack.get("nc_linhas") if isinstance(nc_pack, dict) and "nc_linhas" in nc_pack else None)
-    )
-
-    ia_path = out_dir / "RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx"
-    with pd.ExcelWriter(ia_path, engine="openpyxl") as w:
-        plan["reativo"].to_excel(w, sheet_name="RANKING_REATIVO", index=False)
-        plan["preventivo"].to_excel(w, sheet_name="RANKING_PREVENTIVO", index=False)
-        plan["top_linhas"].to_excel(w, sheet_name="TOP_LINHAS", index=False)
+        datas_explicitas(start_date, end_date)
+    except PeriodoInvalido as e:
+        return HTMLResponse(f"<h3>Período inválido.</h3><p>{e}</p>", status_code=422)
 
+    run_id = str(uuid.uuid4())[:8]
+    paths, digests = _salvar_uploads(run_id, reclamacoes, refugos, mapa_cc, auditoria_nc)
 
-    # Export extra resumo Auditoria NC 
-    if isinstance(nc_pack, dict) and "nc_linhas" in nc_pack:
-        nc_path_out = out_dir / "RESUMO_AUDITORIA_NC.xlsx"
-        with pd.ExcelWriter(nc_path_out, engine="openpyxl") as w:
-            nc_pack["nc_linhas"].to_excel(w, sheet_name="NC_LINHAS", index=False)
-            nc_pack["nc_raw"].to_excel(w, sheet_name="NC_RAW", index=False)
+    try:
+        run_id = _enfileirar_ou_reaproveitar(run_id, paths, digests)
+    except FilaCheia as e:
+        return HTMLResponse(f"<h3>Fila de processamento cheia.</h3><p>{e}</p>", status_code=503)
+    # a página de resultado precisa do run pronto: espera o job sem travar o event loop
+    st = await _aguardar_run(run_id)
+    if st.get("state") == ERROR:
+        return HTMLResponse(f"<h3>Falha no processamento.</h3><p>{st.get('error')}</p>", status_code=500)
+    if st.get("state") != DONE:
+        return HTMLResponse(
+            f"<h3>O processamento ainda não terminou.</h3><p>Acompanhe em /api/jobs/{run_id}.</p>", status_code=504
+        )
+
+    # o run é sempre completo; o período pedido no form vale para o ranking da página
+    periodo = _top_linhas_periodo(run_id, start_date, end_date)
 
     return templates.TemplateResponse("result.html", {
         "request": request,
         "run_id": run_id,
+        "period_label": periodo.get("period_label"),
+        "top_linhas": periodo.get("top_linhas", []),
         "files": [
-            ("Base organizada (V2)", f"/download/{run_id}/BASE_MESTRA_AUDITORIA_V2.xlsx"),
-            ("IA trabalhada (V3.2 Moritz)", f"/download/{run_id}/RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx"),
-            ("Rastreio PN", f"/download/{run_id}/PN_RASTREIO_ORIGINAL_LIMPO.xlsx"),
-            ("Colisões PN", f"/download/{run_id}/PN_COLISOES.xlsx"),
-            ("Resumo Auditoria/NC", f"/download/{run_id}/RESUMO_AUDITORIA_NC.xlsx"),
-            ("Base de Eventos (para filtros por período)", f"/download/{run_id}/BASE_EVENTOS_LONG.xlsx"),
-            ("Base agregada Dia/Linha/PN", f"/download/{run_id}/BASE_AGREGADA_DIA_LINHA_PN.xlsx"),
-            ("Risco Oculto", f"/download/{run_id}/RISCO_OCULTO.xlsx"),
-            ("Colisões de Linha", f"/download/{run_id}/COLISOES_LINHA.xlsx"),
+            *((rotulo, f"/download/{run_id}/{nome}") for rotulo, nome in ENTREGAVEIS),
+            ("Tudo em um zip", f"/download/{run_id}/{BUNDLE_FILE}"),
         ]
     })
 
@@ -360,261 +464,468 @@ async def api_process(
     start_date: str | None = Form(None),
     end_date: str | None = Form(None),
 ):
-    """Mesmo pipeline do process mas retornando JSON pra leitura.
+    """Salva os uploads, enfileira o pipeline e responde na hora.
 
-    Retorna o seguinte JSON:
-       run_id
-       links de download
-       TOP_LINHAS em JSON para a Matriz de Risco do front
+    O front acompanha em /api/jobs/{run_id}; quando ``state == "done"`` o
+    ``result`` traz os links de download e o TOP_LINHAS da Matriz de Risco.
     """
+    try:
+        datas_explicitas(start_date, end_date)
+    except PeriodoInvalido as e:
+        return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
 
-    run_id = str(uuid.uuid4())[:8]
+    novo_id = str(uuid.uuid4())[:8]
+    paths, digests = _salvar_uploads(novo_id, reclamacoes, refugos, mapa_cc, auditoria_nc)
+    try:
+        run_id = _enfileirar_ou_reaproveitar(novo_id, paths, digests)
+    except FilaCheia as e:
+        return _fila_cheia(e)
 
-    path_recl = save_upload(run_id, reclamacoes, "reclamacoes.xlsx")
-    path_ref  = save_upload(run_id, refugos, "refugos.xlsx")
-    path_map  = save_upload(run_id, mapa_cc, "mapa_cc.xlsx")
-    path_nc   = save_upload(run_id, auditoria_nc, "auditoria_nc.xlsx")
-    out_dir = make_outputs_dir(run_id)
-
-    result_v2 = construir_base_mestra_v2(
-        arquivo_refugo=path_ref,
-        arquivo_reclamacoes=path_recl,
-        arquivo_mapa_cc=path_map,
-        codigos_excluir=settings.CODIGOS_EXCLUIR,
-        start_date=None,
-        end_date=None
+    # entradas idênticas a um run anterior: devolve o mesmo run (já pronto ou em andamento)
+    st = ler_status(OUTPUTS / run_id) or {}
+    resposta = {
+        "ok": True,
+        "run_id": run_id,
+        "reused": run_id != novo_id,
+        "state": st.get("state"),
+        "status_url": f"/api/jobs/{run_id}",
+        "result": st.get("result"),
+    }
+    if start_date or end_date:
+        # o processamento não filtra; o período pedido é aplicado na leitura
+        qs = urlencode({k: v for k, v in (("start_date", start_date), ("end_date", end_date)) if v})
+        resposta["top_linhas_url"] = f"/api/top_linhas/{run_id}?{qs}"
+        if st.get("state") == DONE:
+            resposta["top_linhas_periodo"] = _top_linhas_periodo(run_id, start_date, end_date)
+    return RespostaRapida(
+        resposta,
+        status_code=(200 if st.get("state") == DONE else 202),
     )
 
-    nc_pack = None
+
+@app.post("/api/runs/{parent_run_id}/delta")
+async def api_process_delta(
+    parent_run_id: str,
+    reclamacoes: UploadFile = File(...),
+    refugos: UploadFile = File(...),
+    mapa_cc: UploadFile | None = File(None),
+    auditoria_nc: UploadFile | None = File(None),
+):
+    """Run incremental: só as linhas novas de reclamações/refugos, somadas ao run pai.
+
+    ``mapa_cc`` e ``auditoria_nc`` são opcionais (sem upload vale a do pai);
+    a auditoria NC enviada substitui a do pai inteira. Eventos repetidos
+    (já presentes no pai) são descartados. Acompanhamento igual ao
+    /api/process, em /api/jobs/{run_id}.
+    """
+    st_pai = ler_status(OUTPUTS / parent_run_id)
+    # o filho lê as bases e as planilhas do pai: pai arquivado volta para o disco
+    if st_pai is None and not run_store.existe(_pasta_run(parent_run_id), run_store.AGREGADA_FILE):
+        return RespostaRapida({"ok": False, "error": "parent_run_id não encontrado"}, status_code=404)
+    if st_pai is not None and st_pai.get("state") != DONE:
+        return RespostaRapida({"ok": False, "error": f"run pai ainda não concluído (state={st_pai.get('state')})"}, status_code=409)
+    _pasta_run(parent_run_id)
+
+    novo_id = str(uuid.uuid4())[:8]
+    paths, digests = {}, {}
+    for nome, up in (("reclamacoes", reclamacoes), ("refugos", refugos), ("mapa_cc", mapa_cc), ("auditoria_nc", auditoria_nc)):
+        if up is not None:
+            paths[nome], digests[nome] = save_upload(novo_id, up, f"{nome}.xlsx")
+            continue
+        # sem upload: a planilha do pai (copiada, para o filho também servir de pai depois)
+        origem = INPUTS / parent_run_id / f"{nome}.xlsx"
+        if not origem.exists():
+            shutil.rmtree(INPUTS / novo_id, ignore_errors=True)
+            return RespostaRapida({"ok": False, "error": f"{nome} não enviado e ausente no run pai"}, status_code=400)
+        dest = INPUTS / novo_id / origem.name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(origem, dest)
+        paths[nome], digests[nome] = str(dest), hash_arquivo(dest)
+
     try:
-        nc_pack = processar_nc_auditoria(path_nc, start_date=None, end_date=None)
-        if "nc_linhas" in nc_pack and not nc_pack["nc_linhas"].empty:
-            mestre = result_v2["mestre"].merge(nc_pack["nc_linhas"], on="LINHA", how="left")
-            result_v2["mestre"] = mestre
-    except Exception as e:
-        nc_pack = {"erro": str(e)}
-
-    # Exportações principais
-    base_v2_path = out_dir / "BASE_MESTRA_AUDITORIA_V2.xlsx"
-    result_v2["mestre"].to_excel(base_v2_path, index=False)
-
-    # Saídas analíticas para filtros posteriores por data
-    # Base de eventos unificada V2 já retorna um "eventos" longo
-    eventos = result_v2.get("eventos", pd.DataFrame()).copy()
-
-    # Acoplar NC como eventos se existir
-    if isinstance(nc_pack, dict) and "nc_raw" in nc_pack and isinstance(nc_pack["nc_raw"], pd.DataFrame) and not nc_pack["nc_raw"].empty:
-        nc_raw = nc_pack["nc_raw"].copy()
-        nc_ev = pd.DataFrame({
-            "TIPO": "NC_AUDITORIA",
-            "DATA_EVENTO": pd.to_datetime(nc_raw.get("Created"), errors="coerce"),
-            "LINHA_ORIGINAL": nc_raw.get("LINHA_ORIGINAL", ""),
-            "LINHA": nc_raw.get("LINHA", "SEM_LINHA"),
-            "PN_ORIGINAL": "",
-            "PN_LIMPO": "",
-            "DESCRICAO": nc_raw.get("Description", ""),
-            "QTD": 0,
-            "FREQ": 1,
-            "STATUS": nc_raw.get("Status", ""),
-            "DUE_DATE": pd.to_datetime(nc_raw.get("Due date"), errors="coerce"),
-            "CLOSING_DATE": pd.to_datetime(nc_raw.get("Closing date"), errors="coerce"),
-            "Q14": nc_raw.get("14Q", ""),
-        })
-        eventos = pd.concat([eventos, nc_ev], ignore_index=True)
-
-    eventos["DATA_EVENTO"] = pd.to_datetime(eventos.get("DATA_EVENTO"), errors="coerce")
-    eventos["LINHA"] = eventos.get("LINHA", "SEM_LINHA").fillna("SEM_LINHA")
-    eventos["PN_LIMPO"] = eventos.get("PN_LIMPO", "").fillna("")
-    eventos["DESCRICAO"] = eventos.get("DESCRICAO", "").fillna("")
-
-    eventos["FLAG_RISCO_OCULTO"] = (
-        (eventos.get("LINHA", "SEM_LINHA") == "SEM_LINHA")
-        | (eventos.get("PN_LIMPO", "") == "DESCONHECIDO")
-        | (eventos.get("PN_LIMPO", "") == "")
-    ).astype(int)
-
-    base_eventos_path = out_dir / "BASE_EVENTOS_LONG.xlsx"
-    base_diaria_path = out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx"
-
-    # Base agregada por dia/linha/pn  para filtros 
-    base_diaria = eventos.copy()
-    base_diaria["DATA"] = base_diaria["DATA_EVENTO"].dt.normalize()
-
-    def _cnt(mask: pd.Series) -> pd.Series:
-        return mask.astype(int)
-
-    base_diaria["REF_QTD"] = pd.to_numeric(base_diaria.get("QTD", 0), errors="coerce").fillna(0)
-    base_diaria["REF_FREQ"] = _cnt(base_diaria["TIPO"] == "REFUGO")
-    base_diaria["REC_FORMAL"] = _cnt(base_diaria["TIPO"] == "RECLAMACAO_FORMAL")
-    base_diaria["REC_INFORMAL"] = _cnt(base_diaria["TIPO"] == "RECLAMACAO_INFORMAL")
-    base_diaria["NC_TOTAL"] = _cnt(base_diaria["TIPO"] == "NC_AUDITORIA")
-    base_diaria["NC_ABERTA"] = _cnt((base_diaria["TIPO"] == "NC_AUDITORIA") & (base_diaria.get("CLOSING_DATE").isna()))
-
-    # Usa data âncora  nos dados evita filtro vazio
-    anchor_tmp = base_diaria["DATA"].dropna().max()
-    anchor_tmp = pd.Timestamp(anchor_tmp).normalize() if pd.notna(anchor_tmp) else pd.Timestamp.now().normalize()
-    due_dt = pd.to_datetime(base_diaria.get("DUE_DATE"), errors="coerce").dt.normalize()
-    base_diaria["NC_VENCIDA"] = _cnt(
-        (base_diaria["TIPO"] == "NC_AUDITORIA")
-        & (base_diaria.get("CLOSING_DATE").isna())
-        & (due_dt.notna())
-        & (due_dt < anchor_tmp)
+        run_id = _enfileirar_ou_reaproveitar(novo_id, paths, digests, parent_run_id)
+    except FilaCheia as e:
+        return _fila_cheia(e)
+
+    st = ler_status(OUTPUTS / run_id) or {}
+    return RespostaRapida(
+        {
+            "ok": True,
+            "run_id": run_id,
+            "parent_run_id": parent_run_id,
+            "reused": run_id != novo_id,
+            "state": st.get("state"),
+            "status_url": f"/api/jobs/{run_id}",
+            "result": st.get("result"),
+        },
+        status_code=(200 if st.get("state") == DONE else 202),
     )
 
-    base_diaria_agg = base_diaria.groupby(["DATA", "LINHA", "PN_LIMPO"], dropna=False).agg(
-        REF_QTD_SUM=("REF_QTD", "sum"),
-        REF_FREQ_SUM=("REF_FREQ", "sum"),
-        REC_FORMAL_SUM=("REC_FORMAL", "sum"),
-        REC_INFORMAL_SUM=("REC_INFORMAL", "sum"),
-        NC_TOTAL_SUM=("NC_TOTAL", "sum"),
-        NC_ABERTA_SUM=("NC_ABERTA", "sum"),
-        NC_VENCIDA_SUM=("NC_VENCIDA", "sum"),
-    ).reset_index()
-
-    with pd.ExcelWriter(base_eventos_path, engine="openpyxl") as w:
-        eventos.to_excel(w, sheet_name="EVENTOS", index=False)
-    with pd.ExcelWriter(base_diaria_path, engine="openpyxl") as w:
-        base_diaria_agg.to_excel(w, sheet_name="AGREGADA_DIA_LINHA_PN", index=False)
-
-    pesos = {
-        "PESO_FORMAL": settings.PESO_FORMAL,
-        "PESO_INFORMAL": settings.PESO_INFORMAL,
-        "PESO_REF_QTD": settings.PESO_REF_QTD,
-        "PESO_REF_FREQ": settings.PESO_REF_FREQ,
-        "PESO_IA_TEXTO": settings.PESO_IA_TEXTO,
-    }
 
-    plan = gerar_planilha_v3_2(
-        mestre=result_v2["mestre"],
-        pesos=pesos,
-        moritz_model=settings.MORITZ_MODEL,
-        use_moritz=settings.USE_MORITZ,
-        nc_linhas=(nc_pack.get("nc_linhas") if isinstance(nc_pack, dict) and "nc_linhas" in nc_pack else None)
-    )
+@app.get("/api/jobs/{run_id}")
+def api_job(run_id: str):
+    """Estado do processamento: state, etapa atual e tempo de cada etapa já concluída."""
+    st = conferir(OUTPUTS / run_id)
+    if st is None:
+        if run_store.existe(OUTPUTS / run_id, run_store.AGREGADA_FILE) or arquivado(OUTPUTS / run_id):
+            # run processado antes da fila existir
+            return {"ok": True, "run_id": run_id, "state": "done", "stage": None, "stages": []}
+        return RespostaRapida({"ok": False, "error": "run_id não encontrado"}, status_code=404)
+    return RespostaRapida({"ok": True, **st, "queue_pending": job_queue.pendentes()})
+
+
+def _etag_runs(request: Request, *run_ids: str) -> str | None:
+    """ETag de uma leitura dos runs (ver processing/http_cache.py); None se algum não tem manifest."""
+    versoes = []
+    for run_id in run_ids:
+        mt = run_store.mtime(OUTPUTS / run_id, MANIFEST_FILE)
+        if mt is None:
+            return None
+        versoes.append(f"{run_id}:{mt}")
+    return etag_leitura(request, *versoes)
 
-    ia_path = out_dir / "RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx"
-    with pd.ExcelWriter(ia_path, engine="openpyxl") as w:
-        plan["reativo"].to_excel(w, sheet_name="RANKING_REATIVO", index=False)
-        plan["preventivo"].to_excel(w, sheet_name="RANKING_PREVENTIVO", index=False)
-        plan["top_linhas"].to_excel(w, sheet_name="TOP_LINHAS", index=False)
 
-    # Serializa TOP_LINHAS para o front
-    top_linhas_df = plan.get("top_linhas", pd.DataFrame()).copy()
-    # Garantir que NaN não vire 'NaN' no JSON pra n quebrar com a logica da leitura no front
-    top_linhas_df = top_linhas_df.where(pd.notnull(top_linhas_df), None)
+def _nao_modificado_runs(etag: str, *run_ids: str):
+    """304 de uma leitura dos runs; conta como acesso para a retenção, como a leitura completa."""
+    for run_id in run_ids:
+        tocar(OUTPUTS / run_id)
+    return nao_modificado(etag, REVALIDAR)
 
-    files = {
-        "base_v2": f"/download/{run_id}/BASE_MESTRA_AUDITORIA_V2.xlsx",
-        "resultado": f"/download/{run_id}/RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx",
-    }
+
+@app.get("/api/context/{run_id}")
+def api_context(run_id: str, request: Request):
+    """Metadados do run (datas disponíveis, âncora, linhas, contagens por TIPO...), só do manifest."""
+    etag = _etag_runs(request, run_id)
+    if etag and combina(request, etag):
+        return _nao_modificado_runs(etag, run_id)
+    manifest = _carregar_manifest(run_id)
+    if manifest is None:
+        return {"ok": False, "error": "run_id não encontrado"}
+    resposta = RespostaRapida({"ok": True, **manifest})
+    return com_cache(resposta, etag, REVALIDAR) if etag else resposta
+
+
+@app.get("/api/runs")
+def api_runs(limit: int = 100, offset: int = 0):
+    """Runs concluídos, mais recentes primeiro: um resumo do manifest.json de cada um.
+
+    Ordena pelo mtime dos manifests e só abre os da página pedida. Run antigo
+    (sem manifest) passa a aparecer depois do primeiro ``/api/context``.
+    """
+    limit = max(1, min(int(limit), 1000))
+    offset = max(0, int(offset))
+    encontrados = []
+    with os.scandir(OUTPUTS) as it:
+        for d in it:
+            try:
+                encontrados.append((os.stat(os.path.join(d.path, MANIFEST_FILE)).st_mtime_ns, d.path))
+            except OSError:
+                continue
+    encontrados.sort(reverse=True)
+    runs = []
+    for _, path in encontrados[offset:offset + limit]:
+        manifest = ler_manifest(Path(path))
+        if manifest is not None:
+            runs.append({**resumo(manifest), "archived": arquivado(Path(path)) is not None, "pinned": fixado(Path(path)) is not None})
+    return {"ok": True, "total": len(encontrados), "offset": offset, "limit": limit, "runs": runs}
+
+
+def _pasta_existente(run_id: str) -> Path | None:
+    out_dir = OUTPUTS / run_id
+    return out_dir if not run_id.startswith(".") and out_dir.is_dir() else None
+
+
+@app.post("/api/runs/{run_id}/pin")
+def api_pin(run_id: str, reason: str | None = None):
+    """Fixa o run: a retenção nunca arquiva nem apaga (ex.: run de referência de uma auditoria)."""
+    out_dir = _pasta_existente(run_id)
+    if out_dir is None:
+        return RespostaRapida({"ok": False, "error": "run_id não encontrado"}, status_code=404)
+    return {"ok": True, "run_id": run_id, "pinned": fixar(out_dir, reason)}
+
+
+@app.delete("/api/runs/{run_id}/pin")
+def api_unpin(run_id: str):
+    out_dir = _pasta_existente(run_id)
+    if out_dir is None:
+        return RespostaRapida({"ok": False, "error": "run_id não encontrado"}, status_code=404)
+    return {"ok": True, "run_id": run_id, "removed": desafixar(out_dir)}
+
+
+@app.get("/api/storage")
+def api_storage():
+    """Ocupação do storage por run (outputs + inputs), política de retenção e última varredura."""
+    runs = estado_runs(OUTPUTS, INPUTS)
+    politica = _politica_retencao()
     return {
         "ok": True,
-        "run_id": run_id,
-        "files": files,
-        "top_linhas": top_linhas_df.to_dict(orient="records"),
-        "use_moritz": settings.USE_MORITZ,
-        "model": settings.MORITZ_MODEL,
-        "anchor_date": (pd.Timestamp(anchor_tmp).date().isoformat() if 'anchor_tmp' in locals() and pd.notna(anchor_tmp) else None),
+        "bytes": sum(r["bytes"] for r in runs),
+        "runs": len(runs),
+        "archived": sum(r["arquivado"] for r in runs),
+        "pinned": sum(r["fixado"] for r in runs),
+        "running": sum(r["em_andamento"] for r in runs),
+        "policy": {
+            "archive_after_days": politica.arquivar_apos_s / 86400,
+            "delete_after_days": politica.apagar_apos_s / 86400,
+            "max_bytes": politica.max_bytes,
+            "sweep_interval_s": varredor.intervalo_s,
+        },
+        "last_sweep": varredor.ultimo,
     }
 
 
-@app.get("/api/context/{run_id}")
-def api_context(run_id: str):
-    """Metadados do run (principalmente datas disponíveis)."""
-    out_dir = OUTPUTS / run_id
-    p = out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx"
-    if not p.exists():
+@app.post("/api/storage/sweep")
+def api_storage_sweep():
+    """Roda a retenção agora (a mesma varredura da thread de fundo)."""
+    resultado = varredor.rodar()
+    if resultado is None:
+        return RespostaRapida({"ok": False, "error": "varredura em andamento em outro processo"}, status_code=409)
+    return {"ok": True, **resultado}
+
+
+@app.get("/api/top_linhas/{run_id}")
+def api_top_linhas(request: Request, run_id: str, preset: str | None = None, limit: int = 15, start_date: str | None = None, end_date: str | None = None):
+    """Ranking de linhas por período sem reprocessar (usa base agregada salva no run).
+
+    Período: ``start_date``/``end_date`` (ISO) ou ``preset`` (hoje, 7d, 90d,
+    ultimos_N_dias, semana_atual, mes_anterior, trimestre_atual, ...).
+    O preset é resolvido na âncora do run, então a resposta tem ETag e o
+    polling com ``If-None-Match`` recebe 304.
+    """
+    etag = _etag_runs(request, run_id)
+    if etag and combina(request, etag):
+        return _nao_modificado_runs(etag, run_id)
+    try:
+        corpo = _top_linhas(run_id, preset, limit, start_date, end_date)
+    except PeriodoInvalido as e:
+        return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
+    resposta = RespostaRapida(corpo)
+    return com_cache(resposta, etag, REVALIDAR) if etag and corpo.get("ok") else resposta
+
+
+def _top_linhas(run_id: str, preset: str | None = None, limit: int = 15, start_date: str | None = None, end_date: str | None = None) -> dict:
+    if not run_store.existe(_pasta_run(run_id), run_store.AGREGADA_FILE):
         return {"ok": False, "error": "run_id não encontrado"}
-    df = pd.read_excel(p, sheet_name="AGREGADA_DIA_LINHA_PN")
-    df = _norm_cols(df)
-    df["DATA"] = _to_dt(df.get("DATA"))
-    mn = df["DATA"].min()
-    mx = df["DATA"].max()
-    anchor = pd.Timestamp(mx).normalize() if pd.notna(mx) else None
+
+    anchor = _data_ancora_from_outputs(run_id)
+    # PeriodoInvalido sobe: quem chama responde 422 (ou já validou o período)
+    start, end, label = resolver_periodo(preset, anchor, start_date, end_date)
+
+    cubo = _carregar_cubo(run_id)
+    # uma subtração por linha no cubo acumulado + argpartition (sem filtrar a agregada)
+    g = ranking(cubo, cubo.totais(start, end), limit)
+    score = g["Score_Linha"].to_numpy()
+    colunas = {**g, "Classe_Linha": classe_linha(score), "Nivel": nivel_linha(score)}
+
     return {
         "ok": True,
         "run_id": run_id,
-        "min_date": (pd.Timestamp(mn).date().isoformat() if pd.notna(mn) else None),
-        "max_date": (pd.Timestamp(mx).date().isoformat() if pd.notna(mx) else None),
+        "period_label": label,
         "anchor_date": (anchor.date().isoformat() if anchor is not None else None),
+        "top_linhas": registros(colunas, TOP_LINHAS_COLUNAS),
     }
 
 
-@app.get("/api/top_linhas/{run_id}")
-def api_top_linhas(run_id: str, preset: str | None = None, limit: int = 15):
-    """Ranking de linhas por período sem reprocessar (usa base agregada salva no run)."""
-    out_dir = OUTPUTS / run_id
-    p = out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx"
-    if not p.exists():
-        return {"ok": False, "error": "run_id não encontrado"}
+@app.get("/api/compare")
+def api_compare(request: Request, base: str, target: str, preset: str | None = None, start_date: str | None = None, end_date: str | None = None, limit: int = 100):
+    """Quem mudou no ranking de linhas entre dois runs (ex.: semana passada x esta).
+
+    O período é resolvido em cada run com a âncora dele (``preset=30d`` = os
+    últimos 30 dias de cada um); datas ISO valem igual para os dois. Linhas
+    ordenadas pelo maior |Delta_Score|, até ``limit``.
+    """
+    etag = _etag_runs(request, base, target)
+    if etag and combina(request, etag):
+        return _nao_modificado_runs(etag, base, target)
+    rankings = {}
+    for run_id in (base, target):
+        if not run_store.existe(_pasta_run(run_id), run_store.AGREGADA_FILE):
+            return RespostaRapida({"ok": False, "error": f"run_id não encontrado: {run_id}"}, status_code=404)
+        try:
+            start, end, label = resolver_periodo(preset, _data_ancora_from_outputs(run_id), start_date, end_date)
+        except PeriodoInvalido as e:
+            return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
+        rankings[run_id] = (ranking_completo(_carregar_cubo(run_id), start, end), label)
+
+    (rank_base, label_base), (rank_alvo, label_alvo) = rankings[base], rankings[target]
+    comp = comparar(rank_base, rank_alvo)
+    status = comp["STATUS"].value_counts()
+    resposta = RespostaRapida({
+        "ok": True,
+        "base": {"run_id": base, "period_label": label_base, "linhas": len(rank_base)},
+        "target": {"run_id": target, "period_label": label_alvo, "linhas": len(rank_alvo)},
+        "resumo": {
+            "novas": int(status.get("nova", 0)),
+            "sairam": int(status.get("saiu", 0)),
+            "mudaram_classe": int(comp["MUDOU_CLASSE"].sum()),
+        },
+        "transicoes": transicoes(comp),
+        "linhas": registros(comp.head(max(0, limit)), COMPARE_COLUNAS),
+    })
+    return com_cache(resposta, etag, REVALIDAR) if etag else resposta
+
 
-    df = pd.read_excel(p, sheet_name="AGREGADA_DIA_LINHA_PN")
-    df = _norm_cols(df)
-    df["DATA"] = _to_dt(df.get("DATA"))
+@app.post("/api/scenarios/{run_id}")
+def api_scenarios(run_id: str, payload: dict):
+    """E se os pesos fossem outros? N vetores de pesos -> N rankings de linhas numa chamada.
 
+    Corpo: ``scenarios`` (lista de ``{"name", "weights": {componente: peso}}``),
+    ``preset``/``start_date``/``end_date`` como no /api/top_linhas e ``limit``.
+    A matriz normalizada sai uma vez do cubo e todos os cenários são pontuados
+    num único produto de matrizes (ver scenarios.py).
+    """
+    if not run_store.existe(_pasta_run(run_id), run_store.AGREGADA_FILE):
+        return RespostaRapida({"ok": False, "error": "run_id não encontrado"}, status_code=404)
     anchor = _data_ancora_from_outputs(run_id)
-    if anchor is None and df["DATA"].notna().any():
-        anchor = pd.Timestamp(df["DATA"].max()).normalize()
-    start, end, label = _periodo_range(preset, anchor)
-    dfp = _filter_period(df, "DATA", start, end)
+    try:
+        limit = int(payload.get("limit") or 15)
+    except (TypeError, ValueError):
+        return RespostaRapida({"ok": False, "error": "limit deve ser inteiro"}, status_code=422)
+    for campo in ("preset", "start_date", "end_date"):
+        if payload.get(campo) is not None and not isinstance(payload[campo], str):
+            return RespostaRapida({"ok": False, "error": f"{campo} deve ser texto"}, status_code=422)
+    try:
+        w, nomes = matriz_pesos(payload.get("scenarios") if payload.get("scenarios") is not None else [])
+        start, end, label = resolver_periodo(payload.get("preset"), anchor, payload.get("start_date"), payload.get("end_date"))
+    except (CenarioInvalido, PeriodoInvalido) as e:
+        return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
+
+    cubo = _carregar_cubo(run_id)
+    tot = cubo.totais(start, end)
+    presentes, top, score = pontuar(tot, w, limit)
+    colunas = {
+        "LINHA": cubo.linhas[presentes[top]],
+        "Score_Linha": score,
+        "Classe_Linha": classe_linha(score),
+        "Nivel": nivel_linha(score),
+    }
+    return RespostaRapida({
+        "ok": True,
+        "run_id": run_id,
+        "period_label": label,
+        "anchor_date": (anchor.date().isoformat() if anchor is not None else None),
+        "componentes": list(COMPONENTES),
+        "scenarios": [
+            {
+                "name": nome,
+                "weights": {c: round(float(p), 6) for c, p in zip(COMPONENTES, w[:, j]) if p > 0},
+                "top_linhas": registros({c: v[:, j] for c, v in colunas.items()}, CENARIO_COLUNAS),
+            }
+            for j, nome in enumerate(nomes)
+        ],
+        "linhas": registros(linhas_do_top(cubo, tot, presentes, top), TOP_LINHAS_COLUNAS),
+    })
 
-    if dfp is None or dfp.empty:
-        return {
-            "ok": True,
-            "run_id": run_id,
-            "period_label": label,
-            "anchor_date": (anchor.date().isoformat() if anchor is not None else None),
-            "top_linhas": [],
-        }
 
-    g = dfp.groupby("LINHA", dropna=False).agg(
-        REF_QTD=("REF_QTD_SUM", "sum"),
-        REF_FREQ=("REF_FREQ_SUM", "sum"),
-        REC_FORMAL=("REC_FORMAL_SUM", "sum"),
-        REC_INFORMAL=("REC_INFORMAL_SUM", "sum"),
-        NC_TOTAL=("NC_TOTAL_SUM", "sum"),
-        NC_ABERTA=("NC_ABERTA_SUM", "sum"),
-        NC_VENCIDA=("NC_VENCIDA_SUM", "sum"),
-    ).reset_index()
-
-    g["TOTAL_RECLAMACOES"] = g["REC_FORMAL"] + g["REC_INFORMAL"]
-
-    # Score simples  de 0 ao100
-    s_rec = _normalize_0_100(g["TOTAL_RECLAMACOES"])
-    s_nc = _normalize_0_100(g["NC_TOTAL"])
-    s_refq = _normalize_0_100(g["REF_QTD"])
-    s_reff = _normalize_0_100(g["REF_FREQ"])
-
-    score = (0.40 * s_rec) + (0.30 * s_nc) + (0.20 * s_refq) + (0.10 * s_reff)
-    g["Score_Linha"] = score.round(2)
-    g["Classe_Linha"] = g["Score_Linha"].apply(_classificar)
-
-    g = g.sort_values("Score_Linha", ascending=False).head(max(1, int(limit)))
-
-    out = []
-    for _, r in g.iterrows():
-        out.append({
-            "LINHA": r.get("LINHA", "SEM_LINHA"),
-            "Score_Linha": float(r.get("Score_Linha", 0) or 0),
-            "Classe_Linha": r.get("Classe_Linha", "Médio"),
-            "Nivel": _nivel_simples(float(r.get("Score_Linha", 0) or 0)),
-            "Total_Reclamacoes": int(r.get("TOTAL_RECLAMACOES", 0) or 0),
-            "Reclamacoes_Formais": int(r.get("REC_FORMAL", 0) or 0),
-            "Reclamacoes_Informais": int(r.get("REC_INFORMAL", 0) or 0),
-            "NC_Total": int(r.get("NC_TOTAL", 0) or 0),
-            "NC_Aberta": int(r.get("NC_ABERTA", 0) or 0),
-            "NC_Vencida": int(r.get("NC_VENCIDA", 0) or 0),
-            "Refugo_Qtd": float(r.get("REF_QTD", 0) or 0),
-            "Refugo_Freq": int(r.get("REF_FREQ", 0) or 0),
-        })
+def _run_concluido(out_dir: Path) -> bool:
+    st = ler_status(out_dir)
+    # sem job.json = run antigo, feito antes da fila
+    return (st is None or st.get("state") == DONE) and run_store.existe(out_dir, run_store.EVENTOS_FILE)
 
-    return {
+
+def _periodo_historico(preset: str | None, start_date: str | None, end_date: str | None):
+    """Resolve o período na âncora do histórico (só leitura: quem escreve é o fim do job e o varredor)."""
+    anchor = historico.ancora()
+    return (*resolver_periodo(preset, anchor, start_date, end_date), anchor)
+
+
+@app.get("/api/history/top_linhas")
+def api_history_top_linhas(preset: str | None = None, limit: int = 15, start_date: str | None = None, end_date: str | None = None):
+    """Ranking de linhas sobre o histórico de todos os runs (lê só os meses do período)."""
+    try:
+        start, end, label, anchor = _periodo_historico(preset, start_date, end_date)
+    except PeriodoInvalido as e:
+        return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
+
+    eventos, meses = historico.ler(start, end, columns=COLUNAS_AGREGAR)
+    cubo = cubo_periodo(eventos, anchor)
+    g = ranking(cubo, cubo.totais(start, end), limit)
+    score = g["Score_Linha"].to_numpy()
+    return RespostaRapida({
         "ok": True,
-        "run_id": run_id,
         "period_label": label,
         "anchor_date": (anchor.date().isoformat() if anchor is not None else None),
-        "top_linhas": out,
-    }
+        "meses_lidos": meses,
+        "eventos": len(eventos),
+        "top_linhas": registros({**g, "Classe_Linha": classe_linha(score), "Nivel": nivel_linha(score)}, TOP_LINHAS_COLUNAS),
+    })
+
+
+@app.get("/api/history/trend/{linha}")
+def api_history_trend(linha: str, preset: str | None = None, start_date: str | None = None, end_date: str | None = None):
+    """Série mensal de uma LINHA (sem diferenciar maiúsculas) no histórico de todos os runs."""
+    try:
+        start, end, label, anchor = _periodo_historico(preset, start_date, end_date)
+    except PeriodoInvalido as e:
+        return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
+
+    eventos, meses = historico.ler(start, end, linha=linha, columns=COLUNAS_AGREGAR)
+    if eventos.empty:
+        return RespostaRapida({"ok": False, "error": f"linha sem eventos no histórico: {linha}"}, status_code=404)
+    return RespostaRapida({
+        "ok": True,
+        "linha": str(eventos["LINHA"].iloc[0]),
+        "period_label": label,
+        "anchor_date": (anchor.date().isoformat() if anchor is not None else None),
+        "meses_lidos": meses,
+        "meses": registros(tendencia_mensal(eventos, anchor, meses), TENDENCIA_COLUNAS),
+    })
+
+
+@app.get("/api/events/{run_id}")
+def api_events(
+    run_id: str,
+    format: str = "ndjson",
+    preset: str | None = None,
+    start_date: str | None = None,
+    end_date: str | None = None,
+    linha: list[str] | None = Query(None),
+    tipo: list[str] | None = Query(None),
+    flag_risco_oculto: int | None = None,
+    columns: str | None = None,
+    cursor: str | None = None,
+    limit: int = LIMITE_PADRAO,
+):
+    """Eventos do run para BI, paginados por cursor, em NDJSON ou Arrow IPC (stream).
+
+    Filtros: período (preset ou datas ISO), ``linha`` e ``tipo`` (repetíveis,
+    sem diferenciar maiúsculas) e ``flag_risco_oculto``. ``columns`` é uma lista
+    separada por vírgula. A próxima página vem no header ``X-Next-Cursor``
+    (ausente na última).
+    """
+    if format not in FORMATOS:
+        return RespostaRapida({"ok": False, "error": f"format deve ser um de: {', '.join(FORMATOS)}"}, status_code=400)
+    path = run_store.caminho_parquet(_pasta_run(run_id), run_store.EVENTOS_FILE)
+    if path is None:
+        return RespostaRapida({"ok": False, "error": "run_id não encontrado"}, status_code=404)
+
+    try:
+        start, end, label = resolver_periodo(preset, _data_ancora_from_outputs(run_id) if preset else None, start_date, end_date)
+    except PeriodoInvalido as e:
+        return RespostaRapida({"ok": False, "error": str(e)}, status_code=422)
+
+    cols = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    if cols:
+        desconhecidas = sorted(set(cols) - set(pq.read_schema(path).names))
+        if desconhecidas:
+            return RespostaRapida({"ok": False, "error": f"colunas inexistentes: {', '.join(desconhecidas)}"}, status_code=400)
+
+    filtro = FiltroEventos(
+        start=start, end=end,
+        linhas=tuple(linha or ()), tipos=tuple(tipo or ()),
+        risco_oculto=flag_risco_oculto,
+    )
+    try:
+        # primeira passada (só colunas de filtro): define a página antes de começar a enviar
+        pagina = paginar(path, filtro, cursor, limit)
+    except (CursorInvalido, KeyError) as e:
+        return RespostaRapida({"ok": False, "error": e.args[0]}, status_code=400)
+
+    headers = {"X-Page-Rows": str(pagina.linhas), "X-Period-Label": quote(label)}
+    if pagina.proximo:
+        headers["X-Next-Cursor"] = pagina.proximo
+    gerar = stream_arrow if format == "arrow" else stream_ndjson
+    return StreamingResponse(gerar(path, pagina, cols), media_type=FORMATOS[format], headers=headers)
 
 
 @app.post("/api/chat")
@@ -623,6 +934,8 @@ async def api_chat(payload: dict):
     run_id = str(payload.get("run_id") or "").strip()
     msg = str(payload.get("message") or "").strip()
     preset = payload.get("preset")
+    start_date = payload.get("start_date")
+    end_date = payload.get("end_date")
     if not run_id:
         return {"ok": False, "reply": "Nenhum run_id encontrado. Processe as planilhas primeiro na Matriz de Risco."}
     if not msg:
@@ -631,22 +944,14 @@ async def api_chat(payload: dict):
     anchor = _data_ancora_from_outputs(run_id)
 
     # Carrega base agregada e eventos
-    out_dir = OUTPUTS / run_id
-    p_base = out_dir / "BASE_AGREGADA_DIA_LINHA_PN.xlsx"
-    p_ev = out_dir / "BASE_EVENTOS_LONG.xlsx"
-    if not p_base.exists() or not p_ev.exists():
+    out_dir = _pasta_run(run_id)
+    if not run_store.existe(out_dir, run_store.AGREGADA_FILE) or not run_store.existe(out_dir, run_store.EVENTOS_FILE):
         return {"ok": False, "reply": "Não encontrei as bases do run. Reprocesse as planilhas."}
 
-    df = pd.read_excel(p_base, sheet_name="AGREGADA_DIA_LINHA_PN")
-    df = _norm_cols(df)
-    df["DATA"] = _to_dt(df.get("DATA"))
-
-    ev = pd.read_excel(p_ev, sheet_name="EVENTOS")
-    ev = _norm_cols(ev)
-    ev["DATA_EVENTO"] = _to_dt(ev.get("DATA_EVENTO"))
-
     # Se não há âncora formal usar a última data real disponível nos dados pra pelo menos ter uma base çegal
     if anchor is None:
+        df = _carregar_agregada(run_id)
+        ev = _carregar_eventos(run_id)
         cands = []
         if df["DATA"].notna().any():
             cands.append(pd.Timestamp(df["DATA"].max()).normalize())
@@ -654,16 +959,34 @@ async def api_chat(payload: dict):
             cands.append(pd.Timestamp(ev["DATA_EVENTO"].max()).normalize())
         anchor = max(cands) if cands else None
 
-    start, end, label = _periodo_range(preset, anchor)
-
-    dfp = _filter_period(df, "DATA", start, end)
-    evp = _filter_period(ev, "DATA_EVENTO", start, end)
+    try:
+        start, end, label = resolver_periodo(preset, anchor, start_date, end_date)
+    except PeriodoInvalido as e:
+        return {"ok": False, "reply": str(e)}
 
     low = msg.lower()
 
+    # busca por palavra-chave nas descrições (índice invertido do run)
+    termo = termo_busca(msg)
+    if termo:
+        achado = _carregar_indice(run_id).buscar(termo, start, end, k=5)
+        if not achado["total"]:
+            return {"ok": True, "reply": f"Não encontrei **{termo}** nas descrições do período **{label}**."}
+        txt = [
+            f"**{termo}** aparece em **{achado['total']}** eventos de **{achado['n_linhas']}** linha(s) — **{label}**"
+            + (f" (de {achado['primeira'].date()} a {achado['ultima'].date()})" if achado["primeira"] is not None else "") + ".",
+            "\nLinhas com mais ocorrências:",
+        ]
+        for i, (lin, n) in enumerate(achado["linhas"], start=1):
+            txt.append(f"{i}. {lin} — {n}")
+        txt.append("\nDescrições encontradas:")
+        for desc, n in achado["descricoes"]:
+            txt.append(f"- {desc[:120]} ({n})")
+        return {"ok": True, "reply": "\n".join(txt)}
+
     # intents simples 
     if "top" in low and "linha" in low:
-        top = api_top_linhas(run_id, preset=preset, limit=5)
+        top = _top_linhas(run_id, preset=preset, limit=5, start_date=start_date, end_date=end_date)
         linhas = top.get("top_linhas", [])
         if not linhas:
             return {"ok": True, "reply": f"Não encontrei eventos no período **{label}**.\n\nDica: use *Desde sempre* para validar se há histórico."}
@@ -683,30 +1006,18 @@ async def api_chat(payload: dict):
             return {"ok": True, "reply": "Para eu gerar a descrição técnica, mande algo como: **descrição técnica da linha 2**."}
         linha = f"LINHA {m.group(1)}"
 
-        # agrega métricas gerais 
-        g = dfp.groupby("LINHA", dropna=False).agg(
-            REF_QTD=("REF_QTD_SUM", "sum"),
-            REF_FREQ=("REF_FREQ_SUM", "sum"),
-            REC_FORMAL=("REC_FORMAL_SUM", "sum"),
-            REC_INFORMAL=("REC_INFORMAL_SUM", "sum"),
-            NC_TOTAL=("NC_TOTAL_SUM", "sum"),
-            NC_ABERTA=("NC_ABERTA_SUM", "sum"),
-            NC_VENCIDA=("NC_VENCIDA_SUM", "sum"),
-        ).reset_index()
-        row = g[g["LINHA"].astype(str).str.upper() == linha.upper()]
-        if row.empty:
+        # métricas da linha no período direto do cubo
+        cubo = _carregar_cubo(run_id)
+        idx = np.flatnonzero(np.char.upper(cubo.linhas.astype(str)) == linha.upper())
+        tot = cubo.totais(start, end)
+        if idx.size == 0 or tot[idx[0], C["N_REGISTROS"]] == 0:
             return {"ok": True, "reply": f"Não encontrei dados para **{linha}** no período **{label}**."}
-        r = row.iloc[0]
+        t = tot[idx[0]]
+        r = {m.removesuffix("_SUM"): t[C[m]] for m in METRICAS}
         total_rec = int((r.get("REC_FORMAL", 0) or 0) + (r.get("REC_INFORMAL", 0) or 0))
 
-        # top descrições
-        ev_line = evp[evp.get("LINHA", "SEM_LINHA").astype(str).str.upper() == linha.upper()].copy()
-        motivos = []
-        if not ev_line.empty and "DESCRICAO" in ev_line.columns:
-            vc = ev_line["DESCRICAO"].fillna("").astype(str)
-            vc = vc[vc.str.strip() != ""]
-            if not vc.empty:
-                motivos = vc.value_counts().head(5).index.tolist()
+        # top descrições: postings da linha no período (índice do run)
+        motivos = [d for d, _ in _carregar_indice(run_id).top_descricoes(linha, start, end, k=5)]
 
         partes = [
             f"**Descrição técnica — {linha} ({label})**",
@@ -732,17 +1043,52 @@ async def api_chat(payload: dict):
             "Eu consigo responder com base nas planilhas deste run. Tente comandos prontos:\n"
             "- **top 5 linhas críticas**\n"
             "- **descrição técnica da linha 2**\n"
-            "- **hoje / últimos 7 dias / último mês / desde sempre** (use no seletor de período no chat)"
+            "- **onde aparece \"vazamento\"?**\n"
+            "- **hoje / últimos 7 dias / último mês / desde sempre** (use no seletor de período no chat)\n"
+            "- período livre: envie *start_date* / *end_date* (AAAA-MM-DD) ou presets como *90d*, *semana_anterior*, *trimestre_atual*"
         ),
     }
 
+@app.get("/api/cache/stats")
+def api_cache_stats():
+    """Contadores do cache de bases (hit/miss/evictions) para acompanhar o polling do dashboard."""
+    return {"ok": True, **run_cache.stats()}
+
+
+@app.get(f"/download/{{run_id}}/{BUNDLE_FILE}")
+def download_bundle(run_id: str, files: list[str] | None = Query(None)):
+    """Todas as entregas do run num zip, em streaming (``files`` repetível = só essas).
+
+    Cada arquivo entra no zip assim que fica pronto; as exportações sob demanda
+    são montadas na vez delas (ver processing/bundle.py).
+    """
+    out_dir = _pasta_run(run_id)
+    if _carregar_manifest(run_id) is None:
+        return RespostaRapida({"ok": False, "error": "run_id não encontrado"}, status_code=404)
+    nomes = list(dict.fromkeys(files)) if files else list(NOMES)
+    desconhecidos = [n for n in nomes if n not in NOMES]
+    if desconhecidos:
+        return RespostaRapida({"ok": False, "error": f"arquivos fora do bundle: {', '.join(desconhecidos)}"}, status_code=400)
+    nome_zip = f"{run_id}.zip" if not files else f"{run_id}_parcial.zip"
+    return StreamingResponse(
+        stream_zip(out_dir, nomes, materializar),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nome_zip}"'},
+    )
+
+
 @app.get("/download/{run_id}/{filename}")
-def download(run_id: str, filename: str):
-    out_dir = OUTPUTS / run_id
-    path = out_dir / filename
-    if not path.exists():
-        return HTMLResponse(f"<h3>Arquivo não encontrado.</h3><p>{path}</p>", status_code=404)
-    return FileResponse(path, filename=filename)
+def download(request: Request, run_id: str, filename: str):
+    out_dir = _pasta_run(run_id)
+    # exportações secundárias são montadas aqui no primeiro download (rota sync = threadpool)
+    path = materializar(out_dir, filename)
+    if path is None:
+        return HTMLResponse(f"<h3>Arquivo não encontrado.</h3><p>{out_dir / filename}</p>", status_code=404)
+    # arquivo do run não muda: ETag forte + immutable; Range/If-Range ficam com o FileResponse
+    etag = etag_arquivo(path)
+    if combina(request, etag):
+        return nao_modificado(etag, IMUTAVEL)
+    return FileResponse(path, filename=path.name, headers={"ETag": etag, "Cache-Control": IMUTAVEL})
 
 @app.get("/health")
 def health():
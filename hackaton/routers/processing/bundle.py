@@ -0,0 +1,84 @@
+"""bundle.zip: todas as entregas do run num único download, em streaming.
+
+O zip é escrito direto na resposta, arquivo a arquivo, em blocos de
+``BLOCO``: sem arquivo temporário e sem o zip inteiro em memória (o
+``zipfile`` aceita saída sem seek e grava os tamanhos depois de cada
+arquivo, no data descriptor). Exportação sob demanda que ainda não existe é
+montada na hora em que chega a vez dela no zip.
+
+xlsx e csv.gz já são comprimidos e entram sem recomprimir.
+"""
+import io
+import zipfile
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
+from .excel_export import alternativa_csv
+
+BUNDLE_FILE = "bundle.zip"
+BLOCO = 1024 * 1024
+
+# (rótulo, arquivo) na ordem da página de resultado
+ENTREGAVEIS = (
+    ("Base organizada (V2)", "BASE_MESTRA_AUDITORIA_V2.xlsx"),
+    ("IA trabalhada (V3.2 Moritz)", "RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx"),
+    ("Rastreio PN", "PN_RASTREIO_ORIGINAL_LIMPO.xlsx"),
+    ("Colisões PN", "PN_COLISOES.xlsx"),
+    ("Resumo Auditoria/NC", "RESUMO_AUDITORIA_NC.xlsx"),
+    ("Base de Eventos (para filtros por período)", "BASE_EVENTOS_LONG.xlsx"),
+    ("Base agregada Dia/Linha/PN", "BASE_AGREGADA_DIA_LINHA_PN.xlsx"),
+    ("Risco Oculto", "RISCO_OCULTO.xlsx"),
+    ("Colisões de Linha", "COLISOES_LINHA.xlsx"),
+)
+NOMES = tuple(nome for _, nome in ENTREGAVEIS)
+
+_JA_COMPRIMIDOS = (".xlsx", ".gz", ".zip", ".parquet")
+
+
+class _Saida(io.RawIOBase):
+    """Destino do ``zipfile``: acumula o que foi escrito até o gerador entregar."""
+
+    def __init__(self):
+        self._partes: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._partes.append(bytes(b))
+        return len(b)
+
+    def drenar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def arquivos_da_entrega(out_dir: Path, path: Path) -> list[Path]:
+    """O xlsx e as abas que saíram em csv.gz por passar do limite do Excel."""
+    irmaos = sorted(Path(out_dir).glob(f"{Path(path).stem.removesuffix('.csv')}__*.csv.gz"))
+    unico = alternativa_csv(path)
+    return [p for p in dict.fromkeys([Path(path), unico, *irmaos]) if p.exists()]
+
+
+def stream_zip(out_dir: Path, nomes: list[str], obter: Callable[[Path, str], Path | None]) -> Iterator[bytes]:
+    """Blocos do zip com as entregas ``nomes``; ``obter`` garante o arquivo (None = run sem ele)."""
+    saida = _Saida()
+    with zipfile.ZipFile(saida, "w") as z:
+        for nome in nomes:
+            path = obter(out_dir, nome)
+            if path is None:
+                continue
+            for p in arquivos_da_entrega(out_dir, path):
+                info = zipfile.ZipInfo.from_file(p, p.name)
+                info.compress_type = zipfile.ZIP_STORED if p.name.endswith(_JA_COMPRIMIDOS) else zipfile.ZIP_DEFLATED
+                with p.open("rb") as src, z.open(info, "w") as dst:
+                    while bloco := src.read(BLOCO):
+                        dst.write(bloco)
+                        if dados := saida.drenar():
+                            yield dados
+                # data descriptor do arquivo
+                if dados := saida.drenar():
+                    yield dados
+    # diretório central
+    yield saida.drenar()
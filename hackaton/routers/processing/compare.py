@@ -0,0 +1,58 @@
+"""Comparação entre dois runs: quais linhas subiram/desceram no ranking.
+
+Cada run entra com o ranking de todas as linhas do período, tirado do cubo
+LINHA × dia que já fica em cache (o mesmo do /api/top_linhas), sem reabrir
+xlsx. Um único merge outer por LINHA alinha os dois lados; posições, deltas
+de score e das métricas e a transição de classe saem coluna a coluna.
+
+Linha que só aparece num dos runs no período fica com o outro lado vazio
+(``STATUS`` = ``nova`` / ``saiu``) e as métricas do lado vazio contam como 0
+no delta.
+"""
+import numpy as np
+import pandas as pd
+
+from .line_cube import METRICAS, CuboLinhaDia, ranking
+from .respostas import classe_linha
+
+# métricas do ranking que ganham delta (Score_Linha à parte)
+METRICAS_COMPARADAS = ("TOTAL_RECLAMACOES", *(m.removesuffix("_SUM") for m in METRICAS))
+
+_STATUS = {"both": "mantida", "left_only": "saiu", "right_only": "nova"}
+
+
+def ranking_completo(cubo: CuboLinhaDia, start: pd.Timestamp | None, end: pd.Timestamp | None) -> pd.DataFrame:
+    """Todas as linhas com registro no período, com POSICAO (1 = maior score) e Classe_Linha."""
+    g = ranking(cubo, cubo.totais(start, end), len(cubo.linhas))
+    g.insert(0, "POSICAO", np.arange(1, len(g) + 1))
+    g["Classe_Linha"] = classe_linha(g["Score_Linha"].to_numpy())
+    return g
+
+
+def comparar(base: pd.DataFrame, alvo: pd.DataFrame) -> pd.DataFrame:
+    """Junta dois ``ranking_completo`` por LINHA; ordenado pelo maior |ΔScore|."""
+    colunas = ["LINHA", "POSICAO", "Score_Linha", "Classe_Linha", *METRICAS_COMPARADAS]
+    m = base[colunas].merge(alvo[colunas], on="LINHA", how="outer", suffixes=("_BASE", "_ALVO"), indicator=True)
+
+    m["STATUS"] = m.pop("_merge").astype(str).map(_STATUS)
+    for lado in ("_BASE", "_ALVO"):
+        m["POSICAO" + lado] = m["POSICAO" + lado].astype("Int64")
+    # positivo = subiu no ranking; só existe quando a linha está nos dois
+    m["DELTA_POSICAO"] = m["POSICAO_BASE"] - m["POSICAO_ALVO"]
+    # posições: inteiro ou vazio (object, senão o to_numpy devolve float com NaN)
+    for c in ("POSICAO_BASE", "POSICAO_ALVO", "DELTA_POSICAO"):
+        m[c] = m[c].astype(object)
+    for c in ("Score_Linha", *METRICAS_COMPARADAS):
+        m["DELTA_" + c] = m[c + "_ALVO"].fillna(0) - m[c + "_BASE"].fillna(0)
+    m["DELTA_Score_Linha"] = m["DELTA_Score_Linha"].round(2)
+    m["MUDOU_CLASSE"] = m["Classe_Linha_BASE"].ne(m["Classe_Linha_ALVO"]) & (m["STATUS"] == "mantida")
+
+    ordem = np.lexsort((m["LINHA"].to_numpy(dtype=str), -m["DELTA_Score_Linha"].abs().to_numpy()))
+    return m.iloc[ordem].reset_index(drop=True)
+
+
+def transicoes(comparacao: pd.DataFrame) -> list[dict]:
+    """Contagem de linhas por mudança de classe (só as que estão nos dois runs)."""
+    mudou = comparacao[comparacao["MUDOU_CLASSE"]]
+    n = mudou.groupby(["Classe_Linha_BASE", "Classe_Linha_ALVO"], sort=False).size().sort_values(ascending=False, kind="stable")
+    return [{"de": de, "para": para, "linhas": int(q)} for (de, para), q in n.items()]
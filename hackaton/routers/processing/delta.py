@@ -0,0 +1,352 @@
+"""Run incremental: planilhas só com as linhas novas, somadas a um run anterior.
+
+Refugos e reclamações só ganham linhas dia a dia; refazer eventos, agregada e
+ranking sobre o histórico inteiro a cada upload custa o tamanho do histórico.
+O run incremental (``DeltaRun``) parte do run pai e calcula só sobre o delta
+(eventos novos + NCs):
+
+- ``merge_events``: eventos novos cuja chave (``CHAVE_EVENTO``) já está no pai
+  são descartados. As chaves do pai ficam ordenadas em disco e são lidas por
+  ``mmap``: a busca é binária e só toca as páginas que precisa. A auditoria NC
+  é um retrato (status, datas de fechamento mudam), então os eventos NC do pai
+  são trocados pelos do upload; os do pai são lidos com o filtro no leitor
+  Parquet (as NCs ficam no fim do arquivo e as estatísticas dos row groups
+  pulam o resto);
+- ``daily_cube``: a agregada é soma por célula, então só as células
+  (DATA, LINHA, PN_LIMPO) tocadas pelos novos eventos e pelas NCs são
+  recalculadas: ``pai + novos + NC nova - NC do pai``;
+- cubo, índice de descrições, variações de LINHA e contagens do manifest saem
+  dos do pai somados ao delta (``atualizar_cubo``, ``atualizar_indice``,
+  ``somar_variacoes``, ``rows.por_tipo`` do manifest do pai), sem reler os
+  eventos do histórico.
+
+Continua O(histórico), por escolha: o ``eventos.parquet`` do filho é o do pai
+copiado um row group por vez (sem passar pelo pandas) mais os novos, para o run
+ser autocontido (streaming, exports e arquivamento não dependem do pai); o
+arquivo de chaves (8 bytes por evento, intercalação de dois vetores ordenados);
+e a agregada, regravada inteira (custa o número de células, não de eventos).
+Pai antigo sem algum desses artefatos (chaves, índice, variações sem NC, cubo)
+tem o artefato calculado uma vez a partir dos eventos.
+
+A base mestra por PN e o RESULTADO_AUDITORIA (v3.2) dependem do histórico
+inteiro das planilhas e não são gerados aqui; as bases longas em xlsx saem
+sob demanda no primeiro download (ver lazy_exports).
+"""
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from . import run_store
+from .line_collisions import COLUNAS_EVENTOS, somar_variacoes, variacoes_linha
+from .line_cube import atualizar_cubo, construir_cubo, ler_cubo, ranking, salvar_cubo
+from .manifest import ler_manifest, montar_manifest, salvar_manifest
+from .pipeline import (
+    CHAVES_AGREGADA, ETAPAS, SOMAS_AGREGADA, Etapa, PipelineRun, agregar_eventos, ancora_dos_dados, config_pontuacao,
+)
+from .respostas import classe_linha, nivel_linha
+from .text_index import atualizar_indice, construir_indice, ler_indice, salvar_indice
+
+# hash das chaves dos eventos (sem NC) do run, ordenado
+CHAVES_FILE = "eventos_chaves_ord.npy"
+# formato antigo: na ordem do eventos.parquet
+CHAVES_LEGADO_FILE = "eventos_chaves.npy"
+# variações de LINHA só dos refugos/reclamações: a base para somar o delta quando a NC é trocada
+VARIACOES_SEM_NC_FILE = "linha_variacoes_sem_nc.parquet"
+# o que identifica um evento de refugo/reclamação vindo das planilhas
+CHAVE_EVENTO = ("TIPO", "DATA_EVENTO", "LINHA_ORIGINAL", "PN_ORIGINAL", "DESCRICAO", "QTD")
+NC = "NC_AUDITORIA"
+# colunas que ``agregar_eventos`` usa
+_COLUNAS_AGREGAR = ["TIPO", "DATA_EVENTO", "LINHA", "PN_LIMPO", "QTD", "CLOSING_DATE", "DUE_DATE"]
+# e as que o índice de descrições e as variações de LINHA usam
+_COLUNAS_NC = _COLUNAS_AGREGAR + ["LINHA_ORIGINAL", "DESCRICAO"]
+
+
+def chaves_eventos(eventos: pd.DataFrame) -> np.ndarray:
+    """uint64 por evento; mesmo valor para o mesmo evento lido do Excel ou do Parquet."""
+    partes = {}
+    for c in CHAVE_EVENTO:
+        s = eventos[c] if c in eventos else pd.Series("", index=eventos.index)
+        if c == "DATA_EVENTO":
+            partes[c] = pd.to_datetime(s, errors="coerce").astype("datetime64[ns]")
+        elif c == "QTD":
+            partes[c] = pd.to_numeric(s, errors="coerce").fillna(0).astype(np.float64)
+        else:
+            partes[c] = s.astype(object).where(s.notna(), "").astype(str).str.strip()
+    return pd.util.hash_pandas_object(pd.DataFrame(partes, index=eventos.index), index=False).to_numpy()
+
+
+def salvar_chaves(out_dir: Path, chaves: np.ndarray) -> Path:
+    """Grava as chaves; ``chaves`` já vem ordenado."""
+    path = Path(out_dir) / CHAVES_FILE
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        np.save(f, chaves.astype(np.uint64, copy=False))
+    os.replace(tmp, path)
+    return path
+
+
+def ler_chaves(out_dir: Path) -> np.ndarray:
+    """Chaves ordenadas dos eventos do run, mapeadas do disco (``mmap``).
+
+    Run sem o .npy (completo ou antigo) tem as chaves calculadas e gravadas uma vez.
+    """
+    path = Path(out_dir) / CHAVES_FILE
+    if not path.exists():
+        legado = Path(out_dir) / CHAVES_LEGADO_FILE
+        if legado.exists():
+            chaves = np.load(legado, allow_pickle=False)
+        else:
+            ev = run_store.ler_eventos(out_dir, columns=list(CHAVE_EVENTO))
+            chaves = np.array([], dtype=np.uint64) if ev is None or ev.empty else chaves_eventos(ev[ev["TIPO"] != NC])
+        salvar_chaves(out_dir, np.sort(chaves))
+    return np.load(path, mmap_mode="r", allow_pickle=False)
+
+
+def _contidas(chaves: np.ndarray, ordenadas: np.ndarray) -> np.ndarray:
+    """Máscara de ``chaves`` presentes em ``ordenadas`` (busca binária: só lê as páginas tocadas)."""
+    if len(ordenadas) == 0:
+        return np.zeros(len(chaves), dtype=bool)
+    pos = np.minimum(np.searchsorted(ordenadas, chaves), len(ordenadas) - 1)
+    return np.asarray(ordenadas[pos]) == chaves
+
+
+def _eventos_nc(out_dir: Path) -> pd.DataFrame:
+    """Eventos NC do run (o filtro vai para o leitor Parquet: só as NCs chegam no pandas)."""
+    p = run_store.caminho_parquet(out_dir, run_store.EVENTOS_FILE)
+    dataset = ds.dataset(p)
+    cols = [c for c in _COLUNAS_NC if c in dataset.schema.names]
+    ev = dataset.to_table(columns=cols, filter=ds.field("TIPO") == NC).to_pandas()
+    ev["DATA_EVENTO"] = pd.to_datetime(ev["DATA_EVENTO"], errors="coerce")
+    return ev
+
+
+def variacoes_sem_nc(out_dir: Path) -> pd.DataFrame:
+    """Variações de LINHA do run sem as NCs; run sem o arquivo tem elas calculadas e gravadas uma vez."""
+    v = run_store.ler_tabela(out_dir, VARIACOES_SEM_NC_FILE)
+    if v is not None:
+        return v
+    p = run_store.caminho_parquet(out_dir, run_store.EVENTOS_FILE)
+    dataset = ds.dataset(p)
+    cols = [c for c in COLUNAS_EVENTOS if c in dataset.schema.names]
+    ev = dataset.to_table(columns=cols, filter=(ds.field("TIPO") != NC) | ds.field("TIPO").is_null()).to_pandas()
+    v = variacoes_linha(ev)
+    run_store.salvar_tabela(Path(out_dir) / VARIACOES_SEM_NC_FILE, v)
+    return v
+
+
+def _chave_celula(agregada: pd.DataFrame) -> np.ndarray:
+    return pd.util.hash_pandas_object(pd.DataFrame({
+        "DATA": pd.to_datetime(agregada["DATA"], errors="coerce").astype("datetime64[ns]"),
+        "LINHA": agregada["LINHA"].astype(str),
+        "PN_LIMPO": agregada["PN_LIMPO"].astype(str),
+    }), index=False).to_numpy()
+
+
+def atualizar_agregada(
+    agregada: pd.DataFrame, somar: list[pd.DataFrame], subtrair: list[pd.DataFrame],
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Soma/subtrai agregadas parciais só nas células que elas tocam.
+
+    Devolve a agregada nova e as células tocadas como eram e como ficaram
+    (o que o cubo precisa para se atualizar sem a agregada inteira). Célula
+    que zera em todas as somas ficou sem evento e sai (o groupby do run
+    completo não a teria criado).
+    """
+    negativas = []
+    for d in subtrair:
+        d = d.copy()
+        d[SOMAS_AGREGADA] = -d[SOMAS_AGREGADA]
+        negativas.append(d)
+    partes = [d for d in somar + negativas if not d.empty]
+    if not partes:
+        return agregada, agregada.iloc[:0], agregada.iloc[:0]
+    delta = pd.concat(partes, ignore_index=True)
+    delta["DATA"] = pd.to_datetime(delta["DATA"], errors="coerce").astype(agregada["DATA"].dtype)
+
+    afetadas = np.isin(_chave_celula(agregada), _chave_celula(delta))
+    antes = agregada[afetadas]
+    celulas = (
+        pd.concat([antes, delta], ignore_index=True)
+        .groupby(CHAVES_AGREGADA, dropna=False, sort=False)[SOMAS_AGREGADA]
+        .sum()
+        .reset_index()
+    )
+    celulas = celulas[(celulas[SOMAS_AGREGADA] != 0).any(axis=1)]
+    nova = (
+        pd.concat([agregada[~afetadas], celulas], ignore_index=True)
+        .sort_values(CHAVES_AGREGADA, kind="stable", na_position="last", ignore_index=True)
+    )
+    return nova, antes, celulas
+
+
+class DeltaRun(PipelineRun):
+    """Run incremental sobre ``parent_dir`` (a pasta de saída do run pai)."""
+
+    def __init__(self, run_id: str, paths: dict[str, str], out_dir: Path, parent_dir: Path, **kwargs):
+        super().__init__(run_id, paths, out_dir, **kwargs)
+        self.parent_dir = Path(parent_dir)
+
+
+# Etapas (as que não aparecem aqui são as mesmas do run completo)
+
+def _merge_events(run: DeltaRun) -> dict:
+    """Descarta eventos já presentes no pai e grava o eventos.parquet do filho (pai + novos)."""
+    ev = run["events"]
+    e_nc = (ev["TIPO"] == NC).to_numpy()
+    novos, nc = ev[~e_nc], ev[e_nc]
+
+    antigas = ler_chaves(run.parent_dir)
+    chaves = chaves_eventos(novos)
+    repetido = _contidas(chaves, antigas)
+    novos, chaves = novos[~repetido], np.sort(chaves[~repetido])
+
+    # NC do pai sai: a planilha NC do upload é o retrato atual (se ela não pôde ser lida, fica a do pai)
+    troca_nc = "nc_raw" in run["nc_enrich"]["nc_pack"]
+    origem = run_store.caminho_parquet(run.parent_dir, run_store.EVENTOS_FILE)
+    run_store.anexar_tabela(
+        origem, run.out_dir / run_store.EVENTOS_FILE, pd.concat([novos, nc], ignore_index=True),
+        manter=(lambda t: pc.fill_null(pc.not_equal(t.column("TIPO"), NC), True)) if troca_nc else None,
+    )
+    # intercalação das duas listas ordenadas (não reordena o histórico)
+    salvar_chaves(run.out_dir, np.insert(antigas, np.searchsorted(antigas, chaves), chaves))
+    return {
+        "novos": novos, "nc": nc, "nc_pai": _eventos_nc(run.parent_dir),
+        "troca_nc": troca_nc, "duplicados": int(repetido.sum()),
+    }
+
+
+def _delta_daily_cube(run: DeltaRun) -> dict:
+    """Agregada do pai + novos + NC nova - NC do pai, só nas células tocadas."""
+    m = run["merge_events"]
+    agregada = run_store.ler_agregada(run.parent_dir)
+    agregada.columns = [str(c).strip() for c in agregada.columns]
+    agregada["DATA"] = pd.to_datetime(agregada["DATA"], errors="coerce")
+    nc_pai = m["nc_pai"]
+
+    anchor_pai = ancora_dos_dados(agregada["DATA"])
+    datas = pd.concat([agregada["DATA"], m["novos"]["DATA_EVENTO"].dt.normalize(), m["nc"]["DATA_EVENTO"].dt.normalize()])
+    anchor = ancora_dos_dados(datas)
+
+    # NC_VENCIDA depende da âncora: a NC do pai sai com a âncora do pai e a atual
+    # (a do upload, ou a mesma do pai) entra com a nova
+    nc_atual = m["nc"] if m["troca_nc"] else nc_pai
+    somar = [agregar_eventos(d, anchor) for d in (m["novos"], nc_atual) if not d.empty]
+    subtrair = [agregar_eventos(nc_pai, anchor_pai)] if not nc_pai.empty else []
+    nova, antes, depois = atualizar_agregada(agregada, somar, subtrair)
+    return {"agregada": nova, "anchor": anchor, "antes": antes, "depois": depois}
+
+
+def _delta_line_cube(run: DeltaRun):
+    """Cubo do pai + (células tocadas como ficaram - como eram)."""
+    d = run["daily_cube"]
+    cubo = ler_cubo(run.parent_dir)
+    if cubo is None:
+        # pai antigo, sem cubo gravado
+        return construir_cubo(d["agregada"])
+    return atualizar_cubo(cubo, d["depois"], d["antes"])
+
+
+def _delta_text_index(run: DeltaRun):
+    """Índice do pai + descrições dos eventos novos (e troca das NCs)."""
+    m = run["merge_events"]
+    idx = ler_indice(run.parent_dir)
+    if idx is None:
+        # pai antigo, sem índice gravado: monta dos eventos do filho
+        ev = run_store.ler_eventos(run.out_dir, columns=["DATA_EVENTO", "LINHA", "DESCRICAO"])
+        ev["DATA_EVENTO"] = pd.to_datetime(ev["DATA_EVENTO"], errors="coerce")
+        return construir_indice(ev)
+    if not m["troca_nc"]:
+        return atualizar_indice(idx, m["novos"])
+    return atualizar_indice(idx, pd.concat([m["novos"], m["nc"]], ignore_index=True), m["nc_pai"])
+
+
+def _delta_line_collisions(run: DeltaRun) -> dict:
+    """Variações do pai sem NC + as dos novos (gravadas para o próximo delta) + as da NC atual."""
+    m = run["merge_events"]
+    sem_nc = somar_variacoes(variacoes_sem_nc(run.parent_dir), variacoes_linha(m["novos"]))
+    nc_atual = m["nc"] if m["troca_nc"] else m["nc_pai"]
+    return {"variacoes": somar_variacoes(sem_nc, variacoes_linha(nc_atual)), "sem_nc": sem_nc}
+
+
+def _delta_scoring(run: DeltaRun) -> dict:
+    """Score de todas as linhas no histórico somado (o mesmo ranking do /api/top_linhas)."""
+    cubo = run["line_cube"]
+    g = ranking(cubo, cubo.totais(), len(cubo.linhas))
+    score = g["Score_Linha"].to_numpy()
+    return {"top_linhas": g.assign(Classe_Linha=classe_linha(score), Nivel=nivel_linha(score))}
+
+
+def _delta_export(run: DeltaRun) -> list[dict]:
+    """Persiste o que mudou; o resto do pai é herdado (os xlsx longos saem sob demanda)."""
+    out_dir, pai = run.out_dir, run.parent_dir
+    run_store.salvar_tabela(out_dir / run_store.AGREGADA_FILE, run["daily_cube"]["agregada"])
+    salvar_cubo(out_dir, run["line_cube"])
+    salvar_indice(out_dir, run["text_index"])
+    run_store.salvar_tabela(out_dir / run_store.LINHA_VARIACOES_FILE, run["line_collisions"]["variacoes"])
+    run_store.salvar_tabela(out_dir / VARIACOES_SEM_NC_FILE, run["line_collisions"]["sem_nc"])
+
+    # rastreio e colisões de PN: as do pai + as que as planilhas do delta trouxeram
+    for nome, chave in ((run_store.RASTREIO_FILE, "rastreio"), (run_store.PN_COLISOES_FILE, "colisoes")):
+        antes = run_store.ler_tabela(pai, nome)
+        novos = run["build_master"][chave]
+        tabela = novos if antes is None else pd.concat([antes, novos], ignore_index=True).drop_duplicates(ignore_index=True)
+        run_store.salvar_tabela(out_dir / nome, tabela)
+
+    nc_pack = run["nc_enrich"]["nc_pack"]
+    herdados = []
+    if "nc_linhas" in nc_pack:
+        run_store.salvar_tabela(out_dir / run_store.NC_LINHAS_FILE, nc_pack["nc_linhas"])
+        run_store.salvar_tabela(out_dir / run_store.NC_RAW_FILE, nc_pack["nc_raw"])
+    else:
+        herdados += [run_store.NC_LINHAS_FILE, run_store.NC_RAW_FILE]
+    for nome in herdados:
+        if (pai / nome).exists():
+            shutil.copyfile(pai / nome, out_dir / nome)
+    return []
+
+
+def _por_tipo(run: DeltaRun) -> dict[str, int]:
+    """Eventos por TIPO: os do manifest do pai + os novos, com a NC do upload no lugar da do pai."""
+    m = run["merge_events"]
+    por_tipo = ((ler_manifest(run.parent_dir) or {}).get("rows") or {}).get("por_tipo")
+    if por_tipo is None:
+        # pai antigo, sem manifest: conta uma vez no Parquet
+        tipos = run_store.ler_eventos(run.parent_dir, columns=["TIPO"])["TIPO"]
+        por_tipo = {str(k): int(v) for k, v in tipos.value_counts(dropna=False).items()}
+    por_tipo = dict(por_tipo)
+    for k, v in m["novos"]["TIPO"].astype(str).value_counts().items():
+        por_tipo[k] = por_tipo.get(k, 0) + int(v)
+    if m["troca_nc"]:
+        por_tipo[NC] = len(m["nc"])
+    return {k: v for k, v in por_tipo.items() if v}
+
+
+def _delta_manifest(run: DeltaRun) -> dict:
+    m = run["merge_events"]
+    manifest = montar_manifest(
+        run.run_id, None, run["daily_cube"]["agregada"], run.out_dir,
+        inputs=run["ingest"]["digests"], config=config_pontuacao(), etapas=dict(run.tempos),
+        por_tipo=_por_tipo(run),
+    )
+    manifest["parent_run_id"] = run.parent_dir.name
+    manifest["delta"] = {"eventos_novos": len(m["novos"]), "duplicados": m["duplicados"], "nc": len(m["nc"])}
+    salvar_manifest(run.out_dir, manifest)
+    return manifest
+
+
+ETAPAS_DELTA: dict[str, Etapa] = {**ETAPAS, **{e.nome: e for e in (
+    Etapa("merge_events", _merge_events, ("events",)),
+    Etapa("daily_cube", _delta_daily_cube, ("merge_events",)),
+    Etapa("line_cube", _delta_line_cube, ("daily_cube",)),
+    Etapa("text_index", _delta_text_index, ("merge_events",)),
+    Etapa("line_collisions", _delta_line_collisions, ("merge_events",)),
+    Etapa("scoring", _delta_scoring, ("line_cube",)),
+    Etapa("export", _delta_export, ("build_master", "nc_enrich", "daily_cube", "line_cube", "text_index", "line_collisions", "scoring")),
+    Etapa("manifest", _delta_manifest, ("export",)),
+)}}
+DeltaRun.etapas = ETAPAS_DELTA
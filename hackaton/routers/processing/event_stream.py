@@ -0,0 +1,206 @@
+"""Leitura paginada dos eventos do run, em NDJSON ou Arrow IPC (stream).
+
+Duas passadas sobre o ``eventos.parquet``, sempre um row group por vez:
+
+1. só as colunas de filtro (DATA_EVENTO, LINHA, TIPO, FLAG_RISCO_OCULTO):
+   acha as posições da página e o cursor da próxima. Row groups cujas
+   estatísticas de DATA_EVENTO caem fora do período nem são lidos;
+2. as colunas pedidas, só dos row groups da página, em lotes: cada lote é
+   convertido e enviado antes do próximo ser lido.
+
+A memória fica limitada ao tamanho do row group + ``limit`` posições, não ao
+tamanho do resultado. O cursor é opaco para o cliente (row group + posição da
+próxima linha) e só vale para o mesmo arquivo.
+"""
+import base64
+import io
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+FORMATOS = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+LIMITE_PADRAO = 10_000
+LIMITE_MAX = 500_000
+# linhas convertidas/enviadas por vez na segunda passada
+LOTE = 10_000
+
+
+class CursorInvalido(ValueError):
+    """Cursor mal formado ou de outro arquivo."""
+
+
+@dataclass(frozen=True)
+class FiltroEventos:
+    start: pd.Timestamp | None = None
+    end: pd.Timestamp | None = None
+    linhas: tuple[str, ...] = ()
+    tipos: tuple[str, ...] = ()
+    risco_oculto: int | None = None
+
+    def colunas(self) -> list[str]:
+        cols = []
+        if self.start is not None or self.end is not None:
+            cols.append("DATA_EVENTO")
+        if self.linhas:
+            cols.append("LINHA")
+        if self.tipos:
+            cols.append("TIPO")
+        if self.risco_oculto is not None:
+            cols.append("FLAG_RISCO_OCULTO")
+        return cols
+
+
+@dataclass
+class Pagina:
+    partes: list[tuple[int, np.ndarray]]   # (row group, posições dentro dele)
+    linhas: int
+    proximo: str | None
+
+
+def codificar_cursor(rg: int, pos: int) -> str:
+    return base64.urlsafe_b64encode(f"{rg}.{pos}".encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str | None) -> tuple[int, int]:
+    if not cursor:
+        return 0, 0
+    try:
+        rg, pos = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(".")
+        rg, pos = int(rg), int(pos)
+    except ValueError:
+        raise CursorInvalido(f"cursor inválido: {cursor!r}") from None
+    if rg < 0 or pos < 0:
+        raise CursorInvalido(f"cursor inválido: {cursor!r}")
+    return rg, pos
+
+
+def _limite(valor: pd.Timestamp, tipo: pa.DataType) -> pa.Scalar:
+    ts = pd.Timestamp(valor)
+    if getattr(tipo, "tz", None) and ts.tzinfo is None:
+        ts = ts.tz_localize(tipo.tz)
+    return pa.scalar(ts, type=tipo)
+
+
+def _fora_do_periodo(meta: pq.RowGroupMetaData, idx_data: int | None, f: FiltroEventos) -> bool:
+    """Estatísticas do row group dizem que nenhuma DATA_EVENTO cai no período."""
+    if idx_data is None or (f.start is None and f.end is None):
+        return False
+    st = meta.column(idx_data).statistics
+    # nulos não entram em período nenhum: só min/max importam
+    if st is None or not st.has_min_max:
+        return False
+    try:
+        mn, mx = pd.Timestamp(st.min).tz_localize(None), pd.Timestamp(st.max).tz_localize(None)
+    except (TypeError, ValueError):
+        return False
+    if f.start is not None and mx < f.start:
+        return True
+    return f.end is not None and mn >= f.end + pd.Timedelta(days=1)
+
+
+def _mascara(t: pa.Table, f: FiltroEventos) -> np.ndarray:
+    m = pa.array(np.ones(t.num_rows, dtype=bool))
+    if f.start is not None or f.end is not None:
+        col = t.column("DATA_EVENTO")
+        if f.start is not None:
+            m = pc.and_(m, pc.greater_equal(col, _limite(f.start, col.type)))
+        if f.end is not None:
+            m = pc.and_(m, pc.less(col, _limite(f.end + pd.Timedelta(days=1), col.type)))
+    for nome, valores in (("LINHA", f.linhas), ("TIPO", f.tipos)):
+        if valores:
+            col = pc.utf8_upper(pc.cast(t.column(nome), pa.string()))
+            m = pc.and_(m, pc.is_in(col, value_set=pa.array([v.upper() for v in valores])))
+    if f.risco_oculto is not None:
+        m = pc.and_(m, pc.equal(pc.cast(t.column("FLAG_RISCO_OCULTO"), pa.int64()), f.risco_oculto))
+    return np.asarray(pc.fill_null(m, False).to_numpy(zero_copy_only=False), dtype=bool)
+
+
+def paginar(path: Path, f: FiltroEventos, cursor: str | None, limit: int) -> Pagina:
+    """Primeira passada: posições da página a partir do cursor + cursor da próxima."""
+    pf = pq.ParquetFile(path)
+    nomes = pf.schema_arrow.names
+    faltando = [c for c in f.colunas() if c not in nomes]
+    if faltando:
+        raise KeyError(f"colunas ausentes na base de eventos: {', '.join(faltando)}")
+    idx_data = nomes.index("DATA_EVENTO") if "DATA_EVENTO" in nomes else None
+
+    rg, pos = decodificar_cursor(cursor)
+    n_rg = pf.metadata.num_row_groups
+    if rg > n_rg:
+        raise CursorInvalido(f"cursor inválido: {cursor!r}")
+    limit = max(1, min(int(limit), LIMITE_MAX))
+    partes, total = [], 0
+
+    while rg < n_rg:
+        meta = pf.metadata.row_group(rg)
+        if pos >= meta.num_rows or _fora_do_periodo(meta, idx_data, f):
+            rg, pos = rg + 1, 0
+            continue
+        cols = f.colunas()
+        if cols:
+            sel = np.flatnonzero(_mascara(pf.read_row_group(rg, columns=cols), f)[pos:]) + pos
+        else:
+            sel = np.arange(pos, meta.num_rows)
+        falta = limit - total
+        if len(sel) > falta:
+            sel = sel[:falta]
+            partes.append((rg, sel))
+            total += len(sel)
+            prox = int(sel[-1]) + 1
+            return Pagina(partes, total, codificar_cursor(*((rg, prox) if prox < meta.num_rows else (rg + 1, 0))))
+        if len(sel):
+            partes.append((rg, sel))
+            total += len(sel)
+        rg, pos = rg + 1, 0
+        if total == limit:
+            # página cheia exatamente no fim do row group: só há próxima se sobrar row group
+            return Pagina(partes, total, codificar_cursor(rg, 0) if rg < n_rg else None)
+    return Pagina(partes, total, None)
+
+
+def _lotes(path: Path, pagina: Pagina, columns: list[str] | None) -> Iterator[pa.Table]:
+    pf = pq.ParquetFile(path)
+    for rg, sel in pagina.partes:
+        t = pf.read_row_group(rg, columns=columns)
+        for i in range(0, len(sel), LOTE):
+            yield t.take(pa.array(sel[i:i + LOTE]))
+        del t
+
+
+def stream_ndjson(path: Path, pagina: Pagina, columns: list[str] | None = None) -> Iterator[bytes]:
+    for t in _lotes(path, pagina, columns):
+        # pandas escreve JSON em C; datas em ISO, nulos como null
+        txt = t.to_pandas().to_json(orient="records", lines=True, date_format="iso", force_ascii=False)
+        # pandas antigo não termina a última linha com \n
+        yield (txt if txt.endswith("\n") else txt + "\n").encode("utf-8")
+
+
+def stream_arrow(path: Path, pagina: Pagina, columns: list[str] | None = None) -> Iterator[bytes]:
+    schema = pq.read_schema(path)
+    if columns:
+        schema = pa.schema([schema.field(c) for c in columns])
+    # sem metadados do pandas: o leitor recebe só o schema Arrow
+    schema = schema.remove_metadata()
+    buf = io.BytesIO()
+    with pa.ipc.new_stream(buf, schema) as w:
+        yield _drenar(buf)
+        for t in _lotes(path, pagina, columns):
+            w.write_table(t.replace_schema_metadata(None))
+            yield _drenar(buf)
+    yield _drenar(buf)
+
+
+def _drenar(buf: io.BytesIO) -> bytes:
+    dados = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return dados
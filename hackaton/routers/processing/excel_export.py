@@ -0,0 +1,188 @@
+"""Escrita dos entregáveis .xlsx do run.
+
+- openpyxl em modo write-only: as linhas vão direto para o arquivo, a memória
+  não cresce com o tamanho da aba;
+- a fonte de uma aba pode ser um DataFrame ou o caminho de um .parquet do run
+  (lido em lotes, sem carregar a base inteira);
+- aba acima do limite de linhas do Excel vira .csv.gz automaticamente;
+- pastas de trabalho independentes são gravadas em paralelo num pool de processos
+  (openpyxl é Python puro, thread não ajudaria por causa do GIL).
+
+Cada arquivo gravado gera um relatório com tempo e, quando ele foi escrito
+num processo do pool (o único caso em que o pico do processo é o do arquivo),
+pico de memória.
+"""
+import gzip
+import io
+import multiprocessing as mp
+import os
+import time
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+try:
+    import resource
+except ImportError:  # Windows: sem pico de memória no relatório
+    resource = None
+
+# 1.048.576 linhas por aba, menos o cabeçalho
+EXCEL_MAX_LINHAS = 1_048_575
+LOTE = 50_000
+# abaixo disso subir processo custa mais que escrever em sequência
+LINHAS_MIN_PARALELO = 200_000
+
+Fonte = pd.DataFrame | Path
+
+
+def _n_linhas(fonte: Fonte) -> int:
+    if isinstance(fonte, pd.DataFrame):
+        return len(fonte)
+    return pq.ParquetFile(fonte).metadata.num_rows
+
+
+def _colunas(fonte: Fonte) -> list[str]:
+    if isinstance(fonte, pd.DataFrame):
+        return [str(c) for c in fonte.columns]
+    return list(pq.read_schema(fonte).names)
+
+
+def _lotes(fonte: Fonte) -> Iterator[pd.DataFrame]:
+    if isinstance(fonte, pd.DataFrame):
+        for i in range(0, len(fonte), LOTE):
+            yield fonte.iloc[i:i + LOTE]
+        return
+    for b in pq.ParquetFile(fonte).iter_batches(batch_size=LOTE):
+        yield b.to_pandas()
+
+
+def _celulas(lote: pd.DataFrame) -> Iterator[tuple]:
+    lote = lote.copy()
+    for c in lote.columns:
+        # openpyxl não aceita datetime com fuso
+        if isinstance(lote[c].dtype, pd.DatetimeTZDtype):
+            lote[c] = lote[c].dt.tz_localize(None)
+    lote = lote.astype(object).where(lote.notna(), None)
+    return lote.itertuples(index=False, name=None)
+
+
+def alternativa_csv(path: Path, aba: str | None = None) -> Path:
+    """BASE.xlsx -> BASE.csv.gz (ou BASE__ABA.csv.gz quando a pasta tem outras abas)."""
+    path = Path(path)
+    sufixo = f"__{aba}" if aba else ""
+    return path.with_name(f"{path.stem}{sufixo}.csv.gz")
+
+
+def _escrever_csv_gz(path: Path, fonte: Fonte) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        # sem nome nem hora no cabeçalho gzip: regerado do mesmo Parquet, sai com os mesmos bytes (e a mesma ETag)
+        with tmp.open("wb") as raw, gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as gz, \
+                io.TextIOWrapper(gz, encoding="utf-8", newline="") as f:
+            primeiro = True
+            for lote in _lotes(fonte):
+                lote.to_csv(f, index=False, header=primeiro)
+                primeiro = False
+            if primeiro:
+                f.write(",".join(_colunas(fonte)) + "\n")
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _resetar_pico_rss() -> bool:
+    # Linux: "5" em clear_refs zera o VmHWM do processo (pico por arquivo, não por worker).
+    # Só no worker do pool: no servidor/worker da fila zeraria o pico do processo inteiro
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def _status_mb(campo: str) -> float | None:
+    try:
+        for linha in Path("/proc/self/status").read_text().splitlines():
+            if linha.startswith(campo + ":"):
+                return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _pico_rss_mb() -> float | None:
+    pico = _status_mb("VmHWM")
+    if pico is None and resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return pico
+
+
+def escrever_xlsx(path: Path, abas: dict[str, Fonte], medir_pico: bool = False) -> dict:
+    """Grava uma pasta de trabalho com uma aba por fonte, de forma atômica.
+
+    O arquivo final só aparece completo: download concorrente nunca pega xlsx pela metade.
+    Devolve o relatório da escrita (arquivos gerados, linhas, segundos e, com
+    ``medir_pico`` — processo dedicado do pool —, pico de RSS; senão None).
+    """
+    path = Path(path)
+    medir_pico = medir_pico and _resetar_pico_rss()
+    rss_inicio = _status_mb("VmRSS") if medir_pico else None
+    t0 = time.perf_counter()
+
+    linhas = {aba: _n_linhas(fonte) for aba, fonte in abas.items()}
+    grandes = {aba for aba, n in linhas.items() if n > EXCEL_MAX_LINHAS}
+    arquivos: list[Path] = []
+
+    for aba in grandes:
+        destino = alternativa_csv(path, aba if len(abas) > 1 else None)
+        _escrever_csv_gz(destino, abas[aba])
+        arquivos.append(destino)
+
+    if len(grandes) < len(abas):
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            wb = Workbook(write_only=True)
+            for aba, fonte in abas.items():
+                if aba in grandes:
+                    continue
+                ws = wb.create_sheet(title=aba)
+                ws.append(_colunas(fonte))
+                for lote in _lotes(fonte):
+                    for row in _celulas(lote):
+                        ws.append(row)
+            wb.save(tmp)
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        arquivos.insert(0, path)
+
+    pico = _pico_rss_mb() if medir_pico else None
+    return {
+        "arquivo": path.name,
+        "arquivos": [p.name for p in arquivos],
+        "formato": "xlsx" if not grandes else ("csv.gz" if len(grandes) == len(abas) else "xlsx+csv.gz"),
+        "linhas": sum(linhas.values()),
+        "segundos": round(time.perf_counter() - t0, 3),
+        "pico_rss_mb": (round(pico, 1) if pico is not None else None),
+        # quanto a escrita em si somou ao processo (o worker já tem as bases em memória)
+        "rss_extra_mb": (round(pico - rss_inicio, 1) if pico is not None and rss_inicio is not None else None),
+    }
+
+
+def escrever_em_paralelo(out_dir: Path, arquivos: dict[str, dict[str, Fonte]], max_workers: int) -> list[dict]:
+    """Grava várias pastas de trabalho independentes ao mesmo tempo; devolve um relatório por arquivo."""
+    out_dir = Path(out_dir)
+    total = sum(_n_linhas(f) for abas in arquivos.values() for f in abas.values())
+    if max_workers <= 1 or len(arquivos) <= 1 or total < LINHAS_MIN_PARALELO:
+        return [escrever_xlsx(out_dir / nome, abas) for nome, abas in arquivos.items()]
+
+    # spawn: este código roda dentro do worker da fila, que já tem threads do pyarrow
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(arquivos)), mp_context=mp.get_context("spawn")) as pool:
+        # maiores primeiro: o arquivo mais pesado define o tempo total
+        ordem = sorted(arquivos, key=lambda n: -sum(_n_linhas(f) for f in arquivos[n].values()))
+        futs = [pool.submit(escrever_xlsx, out_dir / nome, arquivos[nome], True) for nome in ordem]
+        return [f.result() for f in futs]
@@ -0,0 +1,280 @@
+"""Histórico consolidado dos eventos de todos os runs, particionado por mês.
+
+Cada run vive no seu ``outputs/<run_id>``; pergunta de vários meses/anos
+exigiria reprocessar as planilhas todas juntas. Aqui os eventos dos runs
+concluídos são copiados (só as colunas do ranking) para
+
+    history/eventos/MES=AAAA-MM/<fonte>.parquet
+
+onde ``fonte`` é o hash dos digests das planilhas do run: o mesmo upload
+nunca entra duas vezes. Entre fontes diferentes (a planilha da semana que
+repete as semanas anteriores, um run incremental sobre o pai) o evento é
+identificado pela mesma chave do run incremental (``delta.chaves_eventos``);
+as chaves já vistas de cada mês ficam em ``history/chaves/AAAA-MM.npy`` e
+evento repetido é descartado (repetição dentro da mesma fonte é evento
+legítimo e fica, como no delta).
+
+Escritas (``incorporar``/``sincronizar``) leem e regravam as chaves do mês e
+o ``fontes.json``: ficam serializadas por um ``flock`` em ``history/.lock``,
+que vale entre os workers do uvicorn, e não só entre threads. Quem escreve é o
+fim de cada job e o varredor; as consultas só leem.
+
+Consulta por período lista só as pastas dos meses do intervalo e lê só os
+arquivos delas. NC é retrato: a versão que fica é a da primeira fonte em que
+ela apareceu (NC_ABERTA/NC_VENCIDA do histórico são desse retrato; o score
+não usa essas duas).
+"""
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows: fica só o lock do processo
+    fcntl = None
+
+from . import run_store
+from .delta import CHAVE_EVENTO, chaves_eventos
+from .line_cube import CuboLinhaDia, construir_cubo
+from .manifest import ler_manifest
+from .pipeline import SOMAS_AGREGADA, agregar_eventos
+
+INDICE_FILE = "fontes.json"
+TRAVA_FILE = ".lock"
+COMPRESSION = run_store.COMPRESSION
+
+SCHEMA = pa.schema([
+    ("TIPO", pa.string()),
+    ("DATA_EVENTO", pa.timestamp("ns")),
+    ("LINHA", pa.string()),
+    ("PN_LIMPO", pa.string()),
+    ("QTD", pa.float64()),
+    ("DUE_DATE", pa.timestamp("ns")),
+    ("CLOSING_DATE", pa.timestamp("ns")),
+    ("CHAVE", pa.uint64()),
+])
+_TEXTO = ("TIPO", "LINHA", "PN_LIMPO")
+_DATAS = ("DATA_EVENTO", "DUE_DATE", "CLOSING_DATE")
+# o que agregar_eventos usa
+COLUNAS_AGREGAR = ["TIPO", "DATA_EVENTO", "LINHA", "PN_LIMPO", "QTD", "DUE_DATE", "CLOSING_DATE"]
+# o que é lido do eventos.parquet do run
+COLUNAS_RUN = sorted(set(SCHEMA.names[:-1]) | set(CHAVE_EVENTO))
+
+
+def chave_fonte(run_id: str, inputs: dict[str, str] | None) -> str:
+    """Hash dos digests das planilhas do run (run sem digests: o próprio run_id)."""
+    payload = json.dumps(inputs, sort_keys=True) if inputs else f"run:{run_id}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _mes(ts: pd.Timestamp) -> str:
+    return f"{ts.year:04d}-{ts.month:02d}"
+
+
+def _meses(start: pd.Timestamp | None, end: pd.Timestamp | None, existentes: list[str]) -> list[str]:
+    ini = _mes(start) if start is not None else ""
+    fim = _mes(end) if end is not None else "9999-99"
+    return [m for m in existentes if ini <= m <= fim]
+
+
+def _para_tabela(eventos: pd.DataFrame, chaves: np.ndarray) -> pa.Table:
+    idx = eventos.index
+    cols = {}
+    for c in _TEXTO:
+        s = eventos[c] if c in eventos else pd.Series(None, index=idx, dtype=object)
+        cols[c] = s.astype("string")
+    for c in _DATAS:
+        s = eventos[c] if c in eventos else pd.Series(pd.NaT, index=idx)
+        cols[c] = pd.to_datetime(s, errors="coerce").astype("datetime64[ns]")
+    cols["QTD"] = pd.to_numeric(eventos["QTD"], errors="coerce").fillna(0).astype(np.float64) if "QTD" in eventos else 0.0
+    cols["CHAVE"] = chaves
+    return pa.Table.from_pandas(pd.DataFrame(cols, index=idx)[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+
+
+class HistoricoEventos:
+    """Store ``history/`` (ver docstring do módulo). Escritas serializadas entre threads e processos."""
+
+    def __init__(self, raiz: Path):
+        self.raiz = Path(raiz)
+        self.dir_eventos = self.raiz / "eventos"
+        self.dir_chaves = self.raiz / "chaves"
+        self.dir_eventos.mkdir(parents=True, exist_ok=True)
+        self.dir_chaves.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _travado(self) -> Iterator[None]:
+        with self._lock, (self.raiz / TRAVA_FILE).open("a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # índice: fontes incorporadas, runs já vistos e intervalo de datas
+
+    def indice(self) -> dict:
+        try:
+            return json.loads((self.raiz / INDICE_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {"fontes": {}, "runs": {}, "min_date": None, "max_date": None}
+
+    def _salvar_indice(self, indice: dict) -> None:
+        p = self.raiz / INDICE_FILE
+        tmp = p.with_name(p.name + f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(indice, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, p)
+
+    def ancora(self) -> pd.Timestamp | None:
+        max_date = self.indice().get("max_date")
+        return pd.Timestamp(max_date) if max_date else None
+
+    def meses(self) -> list[str]:
+        return sorted(p.name.removeprefix("MES=") for p in self.dir_eventos.glob("MES=*") if any(p.glob("*.parquet")))
+
+    def _chaves_mes(self, mes: str) -> np.ndarray:
+        try:
+            return np.load(self.dir_chaves / f"{mes}.npy", allow_pickle=False)
+        except (OSError, ValueError):
+            return np.empty(0, dtype=np.uint64)
+
+    # escrita
+
+    def incorporar(self, run_id: str, fonte: str, eventos: pd.DataFrame) -> dict:
+        """Acrescenta os eventos de uma fonte; os já vistos em outra fonte são descartados.
+
+        Ordem das gravações: parte do mês, chaves do mês, índice. Se cair no
+        meio, a fonte não está no índice e entra de novo: a parte regravada tem
+        o mesmo nome, e mês cujas chaves já foram gravadas é pulado.
+        """
+        with self._travado():
+            return self._incorporar(run_id, fonte, eventos)
+
+    def _incorporar(self, run_id: str, fonte: str, eventos: pd.DataFrame) -> dict:
+        indice = self.indice()
+        if fonte in indice["fontes"]:
+            indice["runs"][run_id] = fonte
+            self._salvar_indice(indice)
+            return {"fonte": fonte, "novos": 0, "reaproveitado": True}
+
+        datas = pd.to_datetime(eventos["DATA_EVENTO"], errors="coerce")
+        com_data = datas.notna().to_numpy()
+        eventos, datas = eventos[com_data], datas[com_data]
+        chaves = chaves_eventos(eventos)
+        mes = (datas.dt.year * 100 + datas.dt.month).to_numpy()
+
+        novos, meses = 0, []
+        for m in np.unique(mes):
+            no_mes = mes == m
+            nome = f"{m // 100:04d}-{m % 100:02d}"
+            antigas = self._chaves_mes(nome)
+            manter = no_mes.copy()
+            manter[no_mes] = ~np.isin(chaves[no_mes], antigas)
+            if not manter.any():
+                continue
+            pasta = self.dir_eventos / f"MES={nome}"
+            pasta.mkdir(exist_ok=True)
+            destino = pasta / f"{fonte}.parquet"
+            tmp = destino.with_name(destino.name + ".tmp")
+            pq.write_table(_para_tabela(eventos[manter], chaves[manter]), tmp, compression=COMPRESSION)
+            os.replace(tmp, destino)
+            p_chaves = self.dir_chaves / f"{nome}.npy"
+            tmp = p_chaves.with_name(f".{p_chaves.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp, np.union1d(antigas, chaves[manter]))
+            os.replace(tmp, p_chaves)
+            novos += int(manter.sum())
+            meses.append(nome)
+
+        if len(datas):
+            lo, hi = datas.min().normalize(), datas.max().normalize()
+            if indice["min_date"]:
+                lo = min(lo, pd.Timestamp(indice["min_date"]))
+                hi = max(hi, pd.Timestamp(indice["max_date"]))
+            indice["min_date"], indice["max_date"] = lo.date().isoformat(), hi.date().isoformat()
+        indice["fontes"][fonte] = {
+            "run_id": run_id,
+            "ingerido_em": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "eventos": int(len(eventos)),
+            "novos": novos,
+            "meses": meses,
+        }
+        indice["runs"][run_id] = fonte
+        self._salvar_indice(indice)
+        return {"fonte": fonte, "novos": novos, "reaproveitado": False}
+
+    def sincronizar(self, outputs: Path, concluido: Callable[[Path], bool]) -> list[str]:
+        """Incorpora os runs de ``outputs`` que ainda não estão no histórico; devolve os run_ids novos."""
+        novos = []
+        with self._travado():
+            vistos = self.indice()["runs"]
+            with os.scandir(outputs) as it:
+                pendentes = sorted(e.name for e in it if e.is_dir() and e.name not in vistos)
+            for run_id in pendentes:
+                out_dir = Path(outputs) / run_id
+                if not concluido(out_dir):
+                    continue
+                eventos = run_store.ler_eventos(out_dir, columns=COLUNAS_RUN)
+                if eventos is None:
+                    continue
+                eventos.columns = [str(c).strip() for c in eventos.columns]
+                manifest = ler_manifest(out_dir) or {}
+                self._incorporar(run_id, chave_fonte(run_id, manifest.get("inputs")), eventos)
+                novos.append(run_id)
+        return novos
+
+    # leitura
+
+    def ler(self, start: pd.Timestamp | None, end: pd.Timestamp | None, linha: str | None = None,
+            columns: list[str] | None = None) -> tuple[pd.DataFrame, list[str]]:
+        """Eventos de ``[start, end]`` (e da LINHA, sem diferenciar maiúsculas) + os meses lidos.
+
+        Só os arquivos das partições do intervalo entram no dataset.
+        """
+        meses = _meses(start, end, self.meses())
+        arquivos = [str(p) for m in meses for p in sorted((self.dir_eventos / f"MES={m}").glob("*.parquet"))]
+        columns = columns or SCHEMA.names
+        if not arquivos:
+            return SCHEMA.empty_table().select(columns).to_pandas(), meses
+        partes = []
+        if start is not None:
+            partes.append(ds.field("DATA_EVENTO") >= pa.scalar(pd.Timestamp(start).normalize(), pa.timestamp("ns")))
+        if end is not None:
+            fim = pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+            partes.append(ds.field("DATA_EVENTO") < pa.scalar(fim, pa.timestamp("ns")))
+        if linha:
+            partes.append(pc.utf8_upper(ds.field("LINHA")) == linha.upper())
+        filtro = None
+        for p in partes:
+            filtro = p if filtro is None else filtro & p
+        t = ds.dataset(arquivos, schema=SCHEMA, format="parquet").to_table(columns=columns, filter=filtro)
+        return t.to_pandas(), meses
+
+
+def cubo_periodo(eventos: pd.DataFrame, anchor: pd.Timestamp | None) -> CuboLinhaDia:
+    """Cubo LINHA × dia só dos eventos lidos (mesmo ranking do /api/top_linhas)."""
+    return construir_cubo(agregar_eventos(eventos, anchor))
+
+
+def tendencia_mensal(eventos: pd.DataFrame, anchor: pd.Timestamp | None, meses: list[str]) -> pd.DataFrame:
+    """Somas por mês (MES = AAAA-MM), com os meses sem evento no intervalo zerados."""
+    ag = agregar_eventos(eventos, anchor)
+    t = ag[SOMAS_AGREGADA].groupby(ag["DATA"].dt.strftime("%Y-%m")).sum()
+    if meses:
+        t = t.reindex(pd.period_range(meses[0], meses[-1], freq="M").strftime("%Y-%m"), fill_value=0)
+    t.columns = [c.removesuffix("_SUM") for c in t.columns]
+    t.insert(0, "TOTAL_RECLAMACOES", t["REC_FORMAL"] + t["REC_INFORMAL"])
+    return t.rename_axis("MES").reset_index()
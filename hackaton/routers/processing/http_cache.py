@@ -0,0 +1,103 @@
+"""Cache HTTP das saídas dos runs: ETag, 304 e Cache-Control.
+
+Nada de um run muda depois de gravado (run incremental é outro run_id), então:
+
+- arquivos de download: ETag forte do conteúdo (blake2b dos bytes) e
+  ``Cache-Control: immutable``. O digest é calculado no primeiro download e
+  guardado em ``.digests.json`` na pasta do run, junto com tamanho e mtime do
+  arquivo: enquanto eles não mudam, não se relê o arquivo. Run restaurado do
+  arquivamento volta com mtime novo, o digest é refeito uma vez e dá a mesma
+  ETag (mesmos bytes). Exportação sob demanda apagada pelo arquivamento e
+  montada de novo é outro arquivo: o openpyxl grava a hora no xlsx, então a
+  ETag muda, como deve para o ``If-Range``. O ``Range``/``If-Range`` fica
+  com o ``FileResponse``, que compara com esta mesma ETag;
+- leituras JSON (top_linhas, context): ETag do manifest do run + rota +
+  parâmetros da query + ``VERSAO``; ``no-cache`` = o cliente guarda e
+  revalida, e a revalidação responde 304 antes de abrir cubo/agregada.
+
+Run sem manifest (antigo, ainda não aberto) fica sem ETag.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from fastapi import Request, Response
+
+# sobe quando o formato de alguma resposta JSON com ETag muda
+VERSAO = 1
+
+IMUTAVEL = "public, max-age=31536000, immutable"
+REVALIDAR = "no-cache"
+
+# parâmetros que não mudam o corpo da resposta
+_IGNORADOS = {"profile"}
+
+# arquivo -> digest do conteúdo, por pasta de run
+DIGESTS_FILE = ".digests.json"
+_BLOCO = 1024 * 1024
+
+
+def _hash(texto: str) -> str:
+    return f'"{hashlib.blake2b(texto.encode("utf-8"), digest_size=16).hexdigest()}"'
+
+
+def _digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with Path(path).open("rb") as f:
+        while bloco := f.read(_BLOCO):
+            h.update(bloco)
+    return f'"{h.hexdigest()}"'
+
+
+def etag_arquivo(path: Path) -> str:
+    """ETag forte pelo conteúdo; relê o arquivo só quando tamanho ou mtime mudam."""
+    path = Path(path)
+    st = path.stat()
+    marca = f"{st.st_size}:{st.st_mtime_ns}"
+    p_digests = path.parent / DIGESTS_FILE
+    try:
+        digests = json.loads(p_digests.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        digests = {}
+    e = digests.get(path.name)
+    if isinstance(e, dict) and e.get("marca") == marca:
+        return e["etag"]
+    etag = _digest(path)
+    digests[path.name] = {"marca": marca, "etag": etag}
+    # duas gravações ao mesmo tempo perdem no máximo uma entrada, que é recalculada depois
+    tmp = p_digests.with_name(f"{p_digests.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp.write_text(json.dumps(digests), encoding="utf-8")
+        os.replace(tmp, p_digests)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+    return etag
+
+
+def etag_leitura(request: Request, *versoes: object) -> str:
+    """ETag de uma leitura: versões dos runs envolvidos + rota + query (ordem dos parâmetros não importa)."""
+    params = sorted((k, v) for k, v in request.query_params.multi_items() if k not in _IGNORADOS)
+    return _hash(json.dumps([VERSAO, request.url.path, params, [str(v) for v in versoes]]))
+
+
+def combina(request: Request, etag: str) -> bool:
+    """``If-None-Match`` do pedido casa com ``etag`` (comparação fraca, como manda o RFC 9110)."""
+    cabecalho = request.headers.get("if-none-match")
+    if not cabecalho:
+        return False
+    if cabecalho.strip() == "*":
+        return True
+    alvo = etag.removeprefix("W/")
+    return any(t.strip().removeprefix("W/") == alvo for t in cabecalho.split(","))
+
+
+def nao_modificado(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def com_cache(resposta: Response, etag: str, cache_control: str) -> Response:
+    resposta.headers["ETag"] = etag
+    resposta.headers["Cache-Control"] = cache_control
+    return resposta
@@ -0,0 +1,145 @@
+"""Leitura das planilhas de entrada: em paralelo e com cache por digest.
+
+``construir_base_mestra_v2`` (refugos + reclamações + mapa CC) e
+``processar_nc_auditoria`` (auditoria NC) recebem caminhos e fazem o parse do
+Excel por dentro, então a unidade paralelizável é a chamada de cada um: os
+dois rodam ao mesmo tempo em processos separados. O teto é 2x e, na prática,
+o tempo do v2, que lê as suas três planilhas em sequência: dividir essa
+leitura exige que o builder aceite DataFrames em vez de caminhos
+(``INGEST_MAX_WORKERS`` acima de 2 não muda nada). O resultado de cada um fica
+em cache no disco, chaveado pelo sha256 dos arquivos que ele lê; subir só uma
+auditoria NC nova não reprocessa refugos/reclamações.
+"""
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+from .input_cache import hash_arquivo
+from .nc_auditoria import processar_nc_auditoria
+from .v2_builder import construir_base_mestra_v2
+
+V2_INPUTS = ("refugos", "reclamacoes", "mapa_cc")
+NC_INPUTS = ("auditoria_nc",)
+# planilhas menores que isso (somadas) são lidas em sequência: subir processo custa mais
+BYTES_MIN_PARALELO = 2 * 1024 * 1024
+
+
+def construir_v2(paths: dict[str, str], codigos_excluir: Any) -> dict:
+    # Importante o processamento pesado gera uma base completa não filtrada
+    # para permitir filtros por período depois sem reprocessar.
+    return construir_base_mestra_v2(
+        arquivo_refugo=paths["refugos"],
+        arquivo_reclamacoes=paths["reclamacoes"],
+        arquivo_mapa_cc=paths["mapa_cc"],
+        codigos_excluir=codigos_excluir,
+        start_date=None,
+        end_date=None
+    )
+
+
+def construir_nc(paths: dict[str, str]) -> dict:
+    try:
+        return processar_nc_auditoria(paths["auditoria_nc"], start_date=None, end_date=None)
+    except Exception as e:
+        # não quebra o fluxo se a planilha vier diferente
+        return {"erro": str(e)}
+
+
+class CacheIngest:
+    """Resultados dos builders em pickle, um arquivo por chave (sha256).
+
+    Cada leitura renova o mtime da entrada; a varredura de retenção apaga as
+    sem uso há mais tempo (``retention.limpar_pasta``).
+    """
+
+    def __init__(self, cache_dir: Path | None):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def ler(self, chave: str) -> Any | None:
+        if not self.cache_dir:
+            return None
+        p = self.cache_dir / f"{chave}.pkl"
+        try:
+            with p.open("rb") as f:
+                valor = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        # a retenção apaga pelo mtime: entrada usada fica
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+        return valor
+
+    def gravar(self, chave: str, valor: Any) -> None:
+        if not self.cache_dir:
+            return
+        p = self.cache_dir / f"{chave}.pkl"
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            pickle.dump(valor, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, p)
+
+
+def _chave(nomes: tuple[str, ...], digests: dict[str, str], extra: dict) -> str:
+    payload = {
+        "inputs": {n: digests[n] for n in nomes},
+        # pickle de DataFrame não é garantido entre versões do pandas
+        "pandas": pd.__version__,
+        **extra,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def ler_entradas(
+    paths: dict[str, str],
+    digests: dict[str, str],
+    codigos_excluir: Any,
+    versao: int,
+    cache_dir: Path | None = None,
+    max_workers: int = 2,
+) -> dict:
+    """Roda os dois builders (em paralelo quando os dois precisam rodar) e devolve
+    ``{"v2": ..., "nc_pack": ..., "digests": {...}, "cache_hits": [...]}``."""
+    cache = CacheIngest(cache_dir)
+    # run sem digest (chamada direta, fora do upload): calcula aqui
+    digests = {n: digests.get(n) or hash_arquivo(paths[n]) for n in V2_INPUTS + NC_INPUTS}
+    tarefas = {
+        "v2": (_chave(V2_INPUTS, digests, {"CODIGOS_EXCLUIR": codigos_excluir, "v": versao}), construir_v2, (paths, codigos_excluir)),
+        "nc_pack": (_chave(NC_INPUTS, digests, {"v": versao}), construir_nc, (paths,)),
+    }
+
+    saida: dict[str, Any] = {"digests": digests, "cache_hits": []}
+    faltando = {}
+    for nome, (chave, fn, args) in tarefas.items():
+        valor = cache.ler(chave)
+        if valor is None:
+            faltando[nome] = (chave, fn, args)
+        else:
+            saida[nome] = valor
+            saida["cache_hits"].append(nome)
+
+    tamanho = sum(Path(paths[n]).stat().st_size for n in V2_INPUTS + NC_INPUTS)
+    if len(faltando) > 1 and max_workers > 1 and tamanho >= BYTES_MIN_PARALELO:
+        # spawn: o worker da fila já tem threads (pyarrow), fork não é seguro
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(faltando)), mp_context=mp.get_context("spawn")) as pool:
+            futs = {nome: pool.submit(fn, *args) for nome, (_, fn, args) in faltando.items()}
+            calculados = {nome: f.result() for nome, f in futs.items()}
+    else:
+        calculados = {nome: fn(*args) for nome, (_, fn, args) in faltando.items()}
+
+    for nome, valor in calculados.items():
+        saida[nome] = valor
+        # erro de leitura da NC não vai para o cache: a próxima tentativa relê
+        if not (isinstance(valor, dict) and "erro" in valor):
+            cache.gravar(faltando[nome][0], valor)
+    return saida
@@ -0,0 +1,125 @@
+"""Cache endereçado por conteúdo das entradas de um run.
+
+Os uploads são hasheados (sha256) enquanto vão para o disco. A chave do run é
+o hash das quatro planilhas + configuração de pontuação; se a mesma chave já
+tem um run válido, o servidor devolve esse ``run_id`` em vez de reprocessar.
+
+A chave é reservada (``reservar``) antes de o run entrar na fila, sob uma
+trava do índice que vale entre os workers do uvicorn: dois uploads iguais ao
+mesmo tempo viram um run só.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # Windows: a trava vale só entre as threads do processo
+    fcntl = None
+
+CHUNK = 1024 * 1024
+TRAVA_FILE = ".lock"
+
+
+def copiar_com_hash(src: BinaryIO, dest: Path) -> str:
+    """Copia o stream para ``dest`` em blocos e devolve o sha256 do conteúdo."""
+    h = hashlib.sha256()
+    with Path(dest).open("wb") as f:
+        while True:
+            bloco = src.read(CHUNK)
+            if not bloco:
+                break
+            h.update(bloco)
+            f.write(bloco)
+    return h.hexdigest()
+
+
+def hash_arquivo(path: str | Path) -> str:
+    """sha256 de um arquivo já gravado, lido em blocos."""
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        while bloco := f.read(CHUNK):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def chave_run(digests: dict[str, str], config: dict) -> str:
+    payload = json.dumps({"inputs": digests, "config": config}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IndiceEntradas:
+    """chave do run -> run_id, um json por chave em ``index_dir``."""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _travado(self) -> Iterator[None]:
+        with self._lock, (self.index_dir / TRAVA_FILE).open("a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _path(self, chave: str) -> Path:
+        return self.index_dir / f"{chave}.json"
+
+    def buscar(self, chave: str, valido: Callable[[str], bool]) -> str | None:
+        """run_id já associado à chave, se ``valido(run_id)`` ainda confirmar que ele serve."""
+        try:
+            entrada = json.loads(self._path(chave).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        run_id = entrada.get("run_id")
+        if not run_id or not valido(run_id):
+            return None
+        return run_id
+
+    def registrar(self, chave: str, run_id: str, **extra) -> None:
+        p = self._path(chave)
+        tmp = p.with_name(p.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"run_id": run_id, **extra}, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, p)
+
+    def limpar(self, existe: Callable[[str], bool]) -> list[str]:
+        """Apaga as entradas cujo run não existe mais (``existe(run_id)`` falso); devolve as chaves."""
+        apagadas = []
+        with self._travado():
+            for p in self.index_dir.glob("*.json"):
+                try:
+                    run_id = json.loads(p.read_text(encoding="utf-8")).get("run_id")
+                except (OSError, ValueError):
+                    run_id = None
+                if not run_id or not existe(run_id):
+                    p.unlink(missing_ok=True)
+                    apagadas.append(p.stem)
+        return apagadas
+
+    def reservar(self, chave: str, run_id: str, valido: Callable[[str], bool], enfileirar: Callable[[], object], **extra) -> str:
+        """Run dono da chave: o já registrado (se ``valido``) ou ``run_id``, que é registrado e enfileirado.
+
+        Busca, registro e ``enfileirar`` acontecem sob a trava do índice. Se
+        ``enfileirar`` falhar (fila cheia) a chave é liberada e o erro sobe.
+        """
+        with self._travado():
+            existente = self.buscar(chave, valido)
+            if existente:
+                return existente
+            self.registrar(chave, run_id, **extra)
+            try:
+                enfileirar()
+            except BaseException:
+                self._path(chave).unlink(missing_ok=True)
+                raise
+            return run_id
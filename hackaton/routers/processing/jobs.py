@@ -0,0 +1,251 @@
+"""Fila de processamento dos runs: o pipeline pesado roda num pool de processos.
+
+O endpoint só salva os uploads, enfileira e devolve o ``run_id``. O andamento
+fica num ``job.json`` dentro da pasta de saída do run, escrito pelo próprio
+worker a cada etapa; assim qualquer worker do uvicorn consegue responder o
+polling, não só o que enfileirou.
+
+Enquanto o run está pendente, o processo que o enfileirou toca
+``.heartbeat`` na pasta do run a cada ``HEARTBEAT_S``. Run na fila ou
+rodando sem batida recente ficou órfão (servidor caiu ou desligou com ele
+na fila): ``conferir`` o marca como erro, e ele deixa de segurar a
+retenção, o reaproveitamento de upload e quem espera por ele.
+"""
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+from zoneinfo import ZoneInfo
+
+STATUS_FILE = "job.json"
+HEARTBEAT_FILE = ".heartbeat"
+
+HEARTBEAT_S = 30
+# sem batida há mais que isso: ninguém mais cuida do run
+HEARTBEAT_PRAZO_S = 5 * HEARTBEAT_S
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+
+class FilaCheia(Exception):
+    """Já tem run demais esperando; o cliente deve tentar de novo depois."""
+
+
+def _agora() -> str:
+    return datetime.now(tz=ZoneInfo("UTC")).isoformat(timespec="seconds")
+
+
+def ler_status(out_dir: Path) -> dict | None:
+    p = Path(out_dir) / STATUS_FILE
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar_status(out_dir: Path, status: dict) -> None:
+    p = Path(out_dir) / STATUS_FILE
+    tmp = p.with_name(p.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(status, ensure_ascii=False, default=str), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def _bater(out_dir: Path) -> None:
+    try:
+        (Path(out_dir) / HEARTBEAT_FILE).touch()
+    except OSError:
+        pass
+
+
+def ativo(out_dir: Path, status: dict | None = None) -> bool:
+    """Run na fila ou rodando cujo processo dono ainda bate (``.heartbeat`` recente)."""
+    st = status if status is not None else ler_status(out_dir) or {}
+    if st.get("state") not in (QUEUED, RUNNING):
+        return False
+    try:
+        idade = time.time() - (Path(out_dir) / HEARTBEAT_FILE).stat().st_mtime
+    except OSError:
+        # job.json de antes da batida: o servidor que o enfileirou já reiniciou
+        return False
+    return idade <= HEARTBEAT_PRAZO_S
+
+
+def conferir(out_dir: Path) -> dict | None:
+    """job.json do run; na fila ou rodando sem dono vivo vira erro antes de voltar."""
+    st = ler_status(out_dir)
+    if st is None or st.get("state") not in (QUEUED, RUNNING) or ativo(out_dir, st):
+        return st
+    prog = ProgressoRun(out_dir, st.get("run_id", Path(out_dir).name))
+    prog.falhar("abandonado: o processo que cuidava do run parou")
+    return prog.status
+
+
+class ProgressoRun:
+    """Registra estado, etapa atual e tempo de cada etapa no job.json do run."""
+
+    def __init__(self, out_dir: Path, run_id: str):
+        self.out_dir = Path(out_dir)
+        self.status = ler_status(self.out_dir) or {"run_id": run_id, "created_at": _agora()}
+        self.status.setdefault("stages", [])
+        self._t0: float | None = None
+        self._linhas: int | None = None
+
+    def _salvar(self) -> None:
+        _gravar_status(self.out_dir, self.status)
+
+    def enfileirar(self) -> None:
+        self.status.update({"state": QUEUED, "stage": None})
+        self._salvar()
+
+    def iniciar(self) -> None:
+        self.status.update({"state": RUNNING, "started_at": _agora(), "pid": os.getpid()})
+        self._salvar()
+
+    def etapa(self, nome: str) -> None:
+        """Fecha a etapa anterior (se houver) e marca o início de ``nome``."""
+        self._fechar_etapa()
+        self.status["stage"] = nome
+        self._t0 = time.perf_counter()
+        self._salvar()
+
+    def contar(self, linhas: int | None) -> None:
+        """Linhas produzidas pela etapa atual (vão junto no registro da etapa)."""
+        self._linhas = linhas
+
+    def _fechar_etapa(self) -> None:
+        nome = self.status.get("stage")
+        if nome and self._t0 is not None:
+            registro = {"name": nome, "seconds": round(time.perf_counter() - self._t0, 3)}
+            if self._linhas is not None:
+                registro["rows"] = int(self._linhas)
+            self.status["stages"].append(registro)
+        self._t0 = None
+        self._linhas = None
+
+    def concluir(self, resultado: dict | None = None) -> None:
+        self._fechar_etapa()
+        self.status.update({"state": DONE, "stage": None, "finished_at": _agora(), "result": resultado})
+        self._salvar()
+
+    def falhar(self, erro: str) -> None:
+        # mantém "stage" para mostrar onde parou
+        self._fechar_etapa()
+        self.status.update({"state": ERROR, "finished_at": _agora(), "error": erro})
+        self._salvar()
+
+
+def _rodar(out_dir: str, run_id: str, fn: Callable[..., dict], args: tuple) -> dict:
+    """Executa dentro do worker: chama ``fn(progresso, *args)`` e fecha o status."""
+    prog = ProgressoRun(Path(out_dir), run_id)
+    prog.iniciar()
+    try:
+        resultado = fn(prog, *args)
+    except Exception as e:
+        prog.falhar(f"{type(e).__name__}: {e}")
+        traceback.print_exc()
+        raise
+    prog.concluir(resultado)
+    return resultado
+
+
+class JobQueue:
+    """Pool de processos com limite de runs pendentes (em execução + na fila).
+
+    ``ao_terminar(status)`` é chamado neste processo com o job.json final de
+    cada run que ele enfileirou (métricas das etapas).
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, ao_terminar: Callable[[dict], None] | None = None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.ao_terminar = ao_terminar
+        self._pool: ProcessPoolExecutor | None = None
+        self._pendentes: dict[str, Future] = {}
+        self._pastas: dict[str, Path] = {}
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._batedor: threading.Thread | None = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: o servidor tem threads, fork aqui é pedir deadlock
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp.get_context("spawn"))
+        return self._pool
+
+    def _bater_pendentes(self) -> None:
+        while not self._parar.wait(HEARTBEAT_S):
+            with self._lock:
+                pastas = list(self._pastas.values())
+            for out_dir in pastas:
+                _bater(out_dir)
+
+    def _iniciar_batedor(self) -> None:
+        if self._batedor is None or not self._batedor.is_alive():
+            self._parar.clear()
+            self._batedor = threading.Thread(target=self._bater_pendentes, name="jobs-heartbeat", daemon=True)
+            self._batedor.start()
+
+    def submit(self, run_id: str, out_dir: Path, fn: Callable[..., dict], *args: Any) -> Future:
+        with self._lock:
+            if len(self._pendentes) >= self.max_pending:
+                raise FilaCheia(f"{len(self._pendentes)} runs pendentes (limite {self.max_pending})")
+            # batida antes do "queued": quem lê o job.json nunca vê o run sem dono
+            _bater(out_dir)
+            ProgressoRun(out_dir, run_id).enfileirar()
+            try:
+                fut = self._executor().submit(_rodar, str(out_dir), run_id, fn, args)
+            except BrokenProcessPool:
+                # um worker morreu antes e levou o pool junto: sobe outro
+                self._pool = None
+                fut = self._executor().submit(_rodar, str(out_dir), run_id, fn, args)
+            self._pendentes[run_id] = fut
+            self._pastas[run_id] = Path(out_dir)
+            self._iniciar_batedor()
+
+        def _fim(f: Future) -> None:
+            with self._lock:
+                self._pendentes.pop(run_id, None)
+                self._pastas.pop(run_id, None)
+            if f.cancelled():
+                # ainda na fila quando o servidor desligou (shutdown com cancel_futures)
+                ProgressoRun(out_dir, run_id).falhar("cancelado")
+            else:
+                exc = f.exception()
+                # worker morreu sem conseguir gravar o erro (OOM, kill...)
+                if exc is not None and (ler_status(out_dir) or {}).get("state") != ERROR:
+                    ProgressoRun(out_dir, run_id).falhar(f"{type(exc).__name__}: {exc}")
+            (Path(out_dir) / HEARTBEAT_FILE).unlink(missing_ok=True)
+            if self.ao_terminar is not None:
+                try:
+                    self.ao_terminar(ler_status(out_dir) or {})
+                except Exception:
+                    traceback.print_exc()
+
+        fut.add_done_callback(_fim)
+        return fut
+
+    def future(self, run_id: str) -> Future | None:
+        """Future do run se ele foi enfileirado por este processo e ainda não terminou."""
+        with self._lock:
+            return self._pendentes.get(run_id)
+
+    def pendentes(self) -> int:
+        with self._lock:
+            return len(self._pendentes)
+
+    def shutdown(self) -> None:
+        self._parar.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
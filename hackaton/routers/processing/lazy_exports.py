@@ -0,0 +1,125 @@
+"""Exportações secundárias geradas sob demanda.
+
+RISCO_OCULTO, COLISOES_LINHA, PN_RASTREIO, PN_COLISOES e RESUMO_AUDITORIA_NC
+quase nunca são baixadas e o openpyxl é a parte mais lenta do run. Então o
+pipeline só persiste os dados (Parquet) e o xlsx é montado no primeiro
+GET /download; depois fica em disco como qualquer outro arquivo do run.
+
+As bases longas (eventos e agregada) o run completo grava na hora; o run
+incremental (delta.py) também deixa para o primeiro download.
+"""
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from . import run_store
+from .excel_export import alternativa_csv, escrever_xlsx
+from .line_collisions import COLUNAS_EVENTOS, colisoes_linha, variacoes_linha
+
+
+def _risco_oculto(out_dir: Path) -> dict[str, pd.DataFrame] | None:
+    p = out_dir / run_store.EVENTOS_FILE
+    if not p.exists():
+        return None
+    # filtro empurrado para o leitor Parquet: só as linhas sinalizadas chegam no pandas
+    t = ds.dataset(p).to_table(filter=ds.field("FLAG_RISCO_OCULTO") == 1)
+    return {"RISCO_OCULTO": t.to_pandas()}
+
+
+def _colisoes_linha(out_dir: Path) -> dict[str, pd.DataFrame] | None:
+    v = run_store.ler_tabela(out_dir, run_store.LINHA_VARIACOES_FILE)
+    if v is None:
+        # run anterior à etapa line_collisions: calcula dos eventos
+        ev = run_store.ler_eventos(out_dir, columns=COLUNAS_EVENTOS)
+        if ev is None:
+            return None
+        v = variacoes_linha(ev)
+    return {"COLISOES_LINHA": colisoes_linha(v), "VARIACOES": v}
+
+
+def _parquet(name: str, aba: str) -> Callable[[Path], dict[str, Path] | None]:
+    # o escritor lê o Parquet em lotes, sem carregar a base inteira
+    def _build(out_dir: Path) -> dict[str, Path] | None:
+        p = out_dir / name
+        return {aba: p} if p.exists() else None
+    return _build
+
+
+def _tabela(name: str, aba: str) -> Callable[[Path], dict[str, pd.DataFrame] | None]:
+    def _build(out_dir: Path) -> dict[str, pd.DataFrame] | None:
+        df = run_store.ler_tabela(out_dir, name)
+        return None if df is None else {aba: df}
+    return _build
+
+
+def _resumo_nc(out_dir: Path) -> dict[str, pd.DataFrame] | None:
+    linhas = run_store.ler_tabela(out_dir, run_store.NC_LINHAS_FILE)
+    raw = run_store.ler_tabela(out_dir, run_store.NC_RAW_FILE)
+    if linhas is None or raw is None:
+        return None
+    return {"NC_LINHAS": linhas, "NC_RAW": raw}
+
+
+LAZY_EXPORTS: dict[str, Callable[[Path], dict[str, pd.DataFrame] | None]] = {
+    "RISCO_OCULTO.xlsx": _risco_oculto,
+    "COLISOES_LINHA.xlsx": _colisoes_linha,
+    "PN_RASTREIO_ORIGINAL_LIMPO.xlsx": _tabela(run_store.RASTREIO_FILE, "Sheet1"),
+    "PN_COLISOES.xlsx": _tabela(run_store.PN_COLISOES_FILE, "Sheet1"),
+    "RESUMO_AUDITORIA_NC.xlsx": _resumo_nc,
+    "BASE_EVENTOS_LONG.xlsx": _parquet(run_store.EVENTOS_FILE, "EVENTOS"),
+    "BASE_AGREGADA_DIA_LINHA_PN.xlsx": _parquet(run_store.AGREGADA_FILE, "AGREGADA_DIA_LINHA_PN"),
+}
+
+# Parquet(s) de que cada exportação sob demanda precisa: com eles no run o
+# xlsx pode ser apagado (retention.py) e volta no próximo download
+FONTES: dict[str, tuple[str, ...]] = {
+    "RISCO_OCULTO.xlsx": (run_store.EVENTOS_FILE,),
+    "COLISOES_LINHA.xlsx": (run_store.EVENTOS_FILE,),
+    "PN_RASTREIO_ORIGINAL_LIMPO.xlsx": (run_store.RASTREIO_FILE,),
+    "PN_COLISOES.xlsx": (run_store.PN_COLISOES_FILE,),
+    "RESUMO_AUDITORIA_NC.xlsx": (run_store.NC_LINHAS_FILE, run_store.NC_RAW_FILE),
+    "BASE_EVENTOS_LONG.xlsx": (run_store.EVENTOS_FILE,),
+    "BASE_AGREGADA_DIA_LINHA_PN.xlsx": (run_store.AGREGADA_FILE,),
+}
+
+
+def regeneravel(out_dir: Path, filename: str) -> bool:
+    """``filename`` (ou um .csv.gz dele) é exportação sob demanda e os dados dela estão no run."""
+    for nome, fontes in FONTES.items():
+        stem = nome.removesuffix(".xlsx")
+        if filename == nome or (filename.startswith(stem) and filename.endswith(".csv.gz")):
+            return all((Path(out_dir) / f).exists() for f in fontes)
+    return False
+
+
+_locks: dict[tuple[str, str], threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def materializar(out_dir: Path, filename: str) -> Path | None:
+    """Garante que ``filename`` exista em ``out_dir``; None se não é exportação sob demanda ou faltam dados."""
+    out_dir = Path(out_dir)
+    path = out_dir / filename
+    builder = LAZY_EXPORTS.get(filename)
+    if builder is None:
+        if path.exists():
+            return path
+        # aba grande demais para o Excel foi gravada como .csv.gz
+        csv = alternativa_csv(path)
+        return csv if path.suffix == ".xlsx" and csv.exists() else None
+
+    with _locks_guard:
+        lock = _locks.setdefault((str(out_dir), filename), threading.Lock())
+    # dois downloads simultâneos do mesmo arquivo: o segundo espera e reaproveita
+    with lock:
+        if path.exists():
+            return path
+        if alternativa_csv(path).exists():
+            return alternativa_csv(path)
+        abas = builder(out_dir)
+        if abas is None:
+            return None
+        return out_dir / escrever_xlsx(path, abas)["arquivos"][0]
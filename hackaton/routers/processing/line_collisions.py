@@ -0,0 +1,91 @@
+"""Colisões de linha: quais grafias das planilhas caíram em cada LINHA.
+
+Antes era um ``groupby("LINHA").apply`` que montava um ``set`` por linha em
+Python, juntava tudo num texto e depois partia o texto de novo para contar
+as variações. Agora:
+
+- ``variacoes_linha``: uma linha por (LINHA, LINHA_ORIGINAL) com quantos
+  eventos usaram a grafia, a fatia dela na LINHA e a primeira/última data.
+  Um groupby só, com chave inteira (códigos da LINHA e da grafia), e o
+  resto roda sobre os pares distintos, não sobre os eventos;
+- ``colisoes_linha``: o resumo por LINHA do COLISOES_LINHA.xlsx, com as
+  primeiras grafias (em ordem) escolhidas por ``cumcount`` e ``nunique``
+  para a quantidade.
+
+A etapa ``line_collisions`` grava as variações no run
+(``run_store.LINHA_VARIACOES_FILE``); o xlsx sai sob demanda (lazy_exports).
+Como as variações são somas/mínimos/máximos por par, o run incremental junta
+as do pai com as dos eventos novos (``somar_variacoes``).
+"""
+import numpy as np
+import pandas as pd
+
+# quantas grafias entram no texto de exemplos de cada LINHA
+MAX_EXEMPLOS = 30
+
+COLUNAS_EVENTOS = ["LINHA", "LINHA_ORIGINAL", "DATA_EVENTO"]
+
+
+def variacoes_linha(eventos: pd.DataFrame) -> pd.DataFrame:
+    """(LINHA, LINHA_ORIGINAL) -> QTD_EVENTOS, PCT_DA_LINHA, PRIMEIRA_DATA, ULTIMA_DATA.
+
+    Grafia vazia (ou só espaços) fica de fora. Ordenado por LINHA e grafia.
+    """
+    idx = eventos.index
+    original = eventos["LINHA_ORIGINAL"] if "LINHA_ORIGINAL" in eventos else pd.Series(None, index=idx, dtype=object)
+    datas = pd.to_datetime(eventos["DATA_EVENTO"], errors="coerce") if "DATA_EVENTO" in eventos else pd.Series(pd.NaT, index=idx)
+
+    # par (LINHA, grafia) vira um inteiro; category é fatorado pelos códigos, sem olhar o texto
+    cod_lin, linhas = pd.factorize(eventos["LINHA"])
+    cod_ori, grafias = pd.factorize(original)
+    ok = (cod_lin >= 0) & (cod_ori >= 0)
+    par = cod_lin[ok].astype(np.int64) * max(len(grafias), 1) + cod_ori[ok]
+    g = pd.Series(datas.to_numpy()[ok]).groupby(par, sort=False)
+    v = g.agg(QTD_EVENTOS="size", PRIMEIRA_DATA="min", ULTIMA_DATA="max")
+    i_lin, i_ori = np.divmod(v.index.to_numpy(), max(len(grafias), 1))
+    v = v.reset_index(drop=True)
+    v.insert(0, "LINHA", linhas.take(i_lin))
+    v.insert(1, "LINHA_ORIGINAL", grafias.take(i_ori))
+
+    # daqui em diante só as grafias distintas. Do Excel vem 12 e "12" misturados:
+    # como texto são a mesma grafia, então junta de novo depois do astype
+    for c in ("LINHA", "LINHA_ORIGINAL"):
+        v[c] = v[c].astype(object).astype(str)
+    return _consolidar(v[v["LINHA_ORIGINAL"].str.strip() != ""])
+
+
+def _consolidar(v: pd.DataFrame) -> pd.DataFrame:
+    """Junta pares repetidos (somas, menor/maior data) e recalcula PCT_DA_LINHA."""
+    v = v.groupby(["LINHA", "LINHA_ORIGINAL"], sort=True).agg(
+        QTD_EVENTOS=("QTD_EVENTOS", "sum"),
+        PRIMEIRA_DATA=("PRIMEIRA_DATA", "min"),
+        ULTIMA_DATA=("ULTIMA_DATA", "max"),
+    ).reset_index()
+    total = v.groupby("LINHA", sort=False)["QTD_EVENTOS"].transform("sum")
+    v.insert(3, "PCT_DA_LINHA", (v["QTD_EVENTOS"] / total * 100).round(2))
+    return v
+
+
+def somar_variacoes(*partes: pd.DataFrame | None) -> pd.DataFrame:
+    """Variações de bases de eventos disjuntas somadas, sem voltar aos eventos.
+
+    É o que o run incremental usa: as do pai + as dos eventos novos.
+    """
+    partes = [p.drop(columns="PCT_DA_LINHA", errors="ignore") for p in partes if p is not None and len(p)]
+    if not partes:
+        return variacoes_linha(pd.DataFrame(columns=COLUNAS_EVENTOS))
+    v = pd.concat(partes, ignore_index=True)
+    for c in ("LINHA", "LINHA_ORIGINAL"):
+        v[c] = v[c].astype(object).astype(str)
+    for c in ("PRIMEIRA_DATA", "ULTIMA_DATA"):
+        v[c] = pd.to_datetime(v[c], errors="coerce")
+    return _consolidar(v)
+
+
+def colisoes_linha(variacoes: pd.DataFrame) -> pd.DataFrame:
+    """Resumo por LINHA: as primeiras ``MAX_EXEMPLOS`` grafias e quantas existem."""
+    g = variacoes.groupby("LINHA", sort=True)
+    exemplos = variacoes[g.cumcount() < MAX_EXEMPLOS]
+    col_lin = exemplos.groupby("LINHA", sort=True)["LINHA_ORIGINAL"].agg(" | ".join).reset_index(name="EXEMPLOS_LINHA_ORIGINAL")
+    col_lin["QTD_VARIACOES"] = col_lin["LINHA"].map(g["LINHA_ORIGINAL"].nunique()).astype("int64")
+    return col_lin
@@ -0,0 +1,220 @@
+"""Cubo LINHA × dia com somas acumuladas, para ranking de qualquer período.
+
+A base agregada (DATA, LINHA, PN) é densificada numa matriz
+``dia × linha × métrica`` e acumulada ao longo dos dias. O total de um período
+[início, fim] vira ``acum[fim + 1] - acum[início]``: uma subtração por linha,
+sem máscara nem groupby por requisição. O cubo é gravado no run em ``.npz``.
+
+O eixo dos dias é só o dos dias que têm registro (``dias``, crescente; o
+período vira índices por ``searchsorted``), não o calendário de ponta a ponta:
+uma data fora da curva (o dia zero do Excel, 1899-12-30, é comum nas
+exportações da fábrica) acrescenta um dia ao cubo, não 125 anos.
+
+Canais: as sete métricas ``*_SUM`` da agregada + ``N_REGISTROS`` (quantas
+linhas da agregada caíram no período) — é ele que diz se a LINHA "aparece" no
+período, como acontecia no groupby sobre a base filtrada.
+
+O run incremental não refaz o cubo a partir da agregada inteira:
+``atualizar_cubo`` soma ao cubo do pai o cubo das células que mudaram (como
+ficaram menos como eram), alinhando os eixos por ``searchsorted``.
+"""
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CUBO_FILE = "cubo_linha_dia.npz"
+
+METRICAS = (
+    "REF_QTD_SUM",
+    "REF_FREQ_SUM",
+    "REC_FORMAL_SUM",
+    "REC_INFORMAL_SUM",
+    "NC_TOTAL_SUM",
+    "NC_ABERTA_SUM",
+    "NC_VENCIDA_SUM",
+)
+CANAIS = METRICAS + ("N_REGISTROS",)
+C = {nome: i for i, nome in enumerate(CANAIS)}
+
+# Score simples de 0 a 100 do ranking por período
+PESOS_RANKING = {
+    "TOTAL_RECLAMACOES": 0.40,
+    "NC_TOTAL": 0.30,
+    "REF_QTD": 0.20,
+    "REF_FREQ": 0.10,
+}
+
+
+def _dia(ts: pd.Timestamp) -> np.datetime64:
+    return np.datetime64(pd.Timestamp(ts).normalize().tz_localize(None), "D")
+
+
+@dataclass
+class CuboLinhaDia:
+    linhas: np.ndarray          # (n_linhas,) rótulos em ordem alfabética
+    dias: np.ndarray            # (n_dias,) datetime64[D] dos dias com registro, crescente
+    acum: np.ndarray            # (n_dias + 1, n_linhas, n_canais), acum[0] = 0
+    sem_data: np.ndarray        # (n_linhas, n_canais), registros sem DATA (só entram no "desde sempre")
+
+    @property
+    def n_dias(self) -> int:
+        return self.acum.shape[0] - 1
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.linhas.nbytes + self.dias.nbytes + self.acum.nbytes + self.sem_data.nbytes)
+
+    def totais(self, start: pd.Timestamp | None = None, end: pd.Timestamp | None = None) -> np.ndarray:
+        """Soma de cada canal por LINHA em [start, end] (datas inclusivas; None = sem limite)."""
+        if start is None and end is None:
+            return self.acum[-1] + self.sem_data
+        # acum[i] = soma dos dias[:i]
+        i = 0 if start is None else int(np.searchsorted(self.dias, _dia(start), side="left"))
+        j = self.n_dias if end is None else int(np.searchsorted(self.dias, _dia(end), side="right"))
+        if j <= i:
+            return np.zeros_like(self.sem_data)
+        return self.acum[j] - self.acum[i]
+
+
+def construir_cubo(agregada: pd.DataFrame) -> CuboLinhaDia:
+    linha = agregada["LINHA"].astype(object).where(agregada["LINHA"].notna(), "SEM_LINHA").astype(str)
+    cod, linhas = pd.factorize(linha, sort=True)
+    n_l, n_c = len(linhas), len(CANAIS)
+
+    vals = np.empty((len(agregada), n_c), dtype=np.float64)
+    for k, m in enumerate(METRICAS):
+        vals[:, k] = pd.to_numeric(agregada[m], errors="coerce").fillna(0).to_numpy(dtype=np.float64) if m in agregada else 0.0
+    vals[:, C["N_REGISTROS"]] = 1.0
+
+    dias = pd.to_datetime(agregada["DATA"], errors="coerce").dt.normalize()
+    ok = dias.notna().to_numpy()
+
+    sem_data = np.zeros((n_l, n_c))
+    if (~ok).any():
+        for k in range(n_c):
+            sem_data[:, k] = np.bincount(cod[~ok], weights=vals[~ok, k], minlength=n_l)
+
+    if not ok.any():
+        return CuboLinhaDia(np.asarray(linhas, dtype=str), np.array([], dtype="datetime64[D]"), np.zeros((1, n_l, n_c)), sem_data)
+
+    if dias.dt.tz is not None:
+        dias = dias.dt.tz_localize(None)
+    # só os dias que existem na base: o tamanho não depende da distância entre a menor e a maior data
+    udias, di = np.unique(dias[ok].to_numpy(dtype="datetime64[D]"), return_inverse=True)
+    n_d = len(udias)
+    # linha 0 fica zerada: acum[j] - acum[i] soma os dias i..j-1
+    plano = (di + 1) * n_l + cod[ok]
+    diario = np.empty((n_d + 1, n_l, n_c))
+    for k in range(n_c):
+        diario[:, :, k] = np.bincount(plano, weights=vals[ok, k], minlength=(n_d + 1) * n_l).reshape(n_d + 1, n_l)
+    np.cumsum(diario, axis=0, out=diario)
+    return CuboLinhaDia(np.asarray(linhas, dtype=str), udias, diario, sem_data)
+
+
+def _somar_alinhado(acum: np.ndarray, sem_data: np.ndarray, cubo: CuboLinhaDia, linhas: np.ndarray, dias: np.ndarray, sinal: float) -> None:
+    """Soma ``sinal * cubo`` em ``acum``/``sem_data``, que têm os eixos ``dias`` × ``linhas`` (superconjuntos dos do cubo)."""
+    pos_l = np.searchsorted(linhas, cubo.linhas)
+    sem_data[pos_l] += sinal * cubo.sem_data
+    if cubo.n_dias == 0:
+        return
+    # dia k do eixo novo acumula os dias do cubo <= dias[k]; antes do primeiro dia do cubo não há o que somar
+    k0 = int(np.searchsorted(dias, cubo.dias[0], side="left"))
+    idx = np.searchsorted(cubo.dias, dias[k0:], side="right")
+    acum[k0 + 1:, pos_l, :] += sinal * cubo.acum[idx]
+
+
+def atualizar_cubo(cubo: CuboLinhaDia, somar: pd.DataFrame, subtrair: pd.DataFrame | None = None) -> CuboLinhaDia:
+    """``cubo`` + o cubo das linhas de agregada ``somar`` - o de ``subtrair``.
+
+    O run incremental passa as células que mudaram como ficaram (``somar``) e
+    como eram no pai (``subtrair``), o que também acerta N_REGISTROS. Custa o
+    tamanho do cubo, não o da agregada.
+    """
+    partes = [(construir_cubo(somar), 1.0)]
+    if subtrair is not None and len(subtrair):
+        partes.append((construir_cubo(subtrair), -1.0))
+    linhas = np.unique(np.concatenate([cubo.linhas.astype(str)] + [p.linhas.astype(str) for p, _ in partes]))
+    dias = np.unique(np.concatenate([cubo.dias] + [p.dias for p, _ in partes]).astype("datetime64[D]"))
+    acum = np.zeros((len(dias) + 1, len(linhas), len(CANAIS)))
+    sem_data = np.zeros((len(linhas), len(CANAIS)))
+    for p, sinal in [(cubo, 1.0), *partes]:
+        _somar_alinhado(acum, sem_data, p, linhas, dias, sinal)
+    return CuboLinhaDia(linhas, dias, acum, sem_data)
+
+
+def componentes(t: np.ndarray) -> dict[str, np.ndarray]:
+    """Grandezas que podem entrar no score, por LINHA, a partir dos totais do período.
+
+    O ranking padrão usa as de ``PESOS_RANKING``; cenários (scenarios.py) podem pesar qualquer uma.
+    """
+    comp = {"TOTAL_RECLAMACOES": t[:, C["REC_FORMAL_SUM"]] + t[:, C["REC_INFORMAL_SUM"]]}
+    for m in METRICAS:
+        comp[m.removesuffix("_SUM")] = t[:, C[m]]
+    return comp
+
+
+def ranking(cubo: CuboLinhaDia, tot: np.ndarray, limit: int) -> pd.DataFrame:
+    """Top ``limit`` linhas do período a partir dos totais de ``cubo.totais``.
+
+    Só entram linhas com registro no período; cada componente é normalizado
+    0–100 pelo máximo entre elas.
+    """
+    presentes = np.flatnonzero(tot[:, C["N_REGISTROS"]] > 0)
+    colunas = ["LINHA", "Score_Linha", "TOTAL_RECLAMACOES", *(m.removesuffix("_SUM") for m in METRICAS)]
+    if presentes.size == 0:
+        return pd.DataFrame(columns=colunas)
+    t = tot[presentes]
+
+    comp = componentes(t)
+    score = np.zeros(len(presentes))
+    for nome, peso in PESOS_RANKING.items():
+        mx = comp[nome].max()
+        if mx > 0:
+            score += peso * (comp[nome] / mx) * 100.0
+    score = score.round(2)
+
+    k = min(max(1, int(limit)), len(presentes))
+    top = np.argpartition(-score, k - 1)[:k] if k < len(presentes) else np.arange(len(presentes))
+    # empate no score: ordem alfabética da LINHA (o cubo já está ordenado)
+    top = top[np.lexsort((top, -score[top]))]
+
+    return pd.DataFrame({
+        "LINHA": cubo.linhas[presentes[top]],
+        "Score_Linha": score[top],
+        "TOTAL_RECLAMACOES": comp["TOTAL_RECLAMACOES"][top],
+        **{m.removesuffix("_SUM"): t[top, C[m]] for m in METRICAS},
+    })
+
+
+def salvar_cubo(out_dir: Path, cubo: CuboLinhaDia) -> Path:
+    path = Path(out_dir) / CUBO_FILE
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with tmp.open("wb") as f:
+        np.savez(
+            f,
+            linhas=cubo.linhas,
+            dias=cubo.dias.astype("datetime64[D]").astype(np.int64),
+            acum=cubo.acum,
+            sem_data=cubo.sem_data,
+        )
+    os.replace(tmp, path)
+    return path
+
+
+def ler_cubo(out_dir: Path) -> CuboLinhaDia | None:
+    path = Path(out_dir) / CUBO_FILE
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as z:
+        acum = z["acum"]
+        if "dias" in z:
+            dias = z["dias"].astype("datetime64[D]")
+        elif z["dia0"].size:
+            # cubo antigo, calendário denso a partir de dia0
+            dias = np.datetime64(pd.Timestamp(int(z["dia0"][0])).normalize(), "D") + np.arange(acum.shape[0] - 1)
+        else:
+            dias = np.array([], dtype="datetime64[D]")
+        return CuboLinhaDia(z["linhas"], dias, acum, z["sem_data"])
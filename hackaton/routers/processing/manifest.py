@@ -0,0 +1,113 @@
+"""Manifest do run: metadados pequenos, gravados uma vez no fim do pipeline.
+
+O dashboard pergunta sempre as mesmas coisas (datas disponíveis, âncora dos
+períodos, linhas, quantos eventos de cada tipo) e antes respondia abrindo a
+base agregada inteira a cada carregamento. O ``manifest.json`` guarda isso já
+calculado, junto com os digests das entradas, a configuração usada, o tempo
+de cada etapa e o tamanho de cada artefato. ``/api/context``, a âncora e o
+``/api/runs`` leem só ele.
+"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+MANIFEST_FILE = "manifest.json"
+# sobe quando o formato muda
+MANIFEST_VERSION = 1
+
+# arquivos de controle: não contam como artefato do run
+_FORA_DOS_ARTEFATOS = {MANIFEST_FILE, "job.json"}
+
+
+def _data_iso(ts: Any) -> str | None:
+    return pd.Timestamp(ts).date().isoformat() if pd.notna(ts) else None
+
+
+def artefatos(out_dir: Path) -> dict[str, int]:
+    """Arquivo -> bytes de tudo que o run gravou em ``out_dir``."""
+    tamanhos = {}
+    for p in sorted(Path(out_dir).iterdir()):
+        # arquivos com ponto (.acesso, .digests.json) são controle do servidor, não do run
+        if p.is_file() and p.name not in _FORA_DOS_ARTEFATOS and not p.name.startswith(".") and not p.name.endswith(".tmp"):
+            tamanhos[p.name] = p.stat().st_size
+    return tamanhos
+
+
+def montar_manifest(
+    run_id: str,
+    eventos: pd.DataFrame | None,
+    agregada: pd.DataFrame | None,
+    out_dir: Path,
+    inputs: dict[str, str] | None = None,
+    config: dict | None = None,
+    etapas: dict[str, float] | None = None,
+    por_tipo: dict[str, int] | None = None,
+) -> dict:
+    """Resumo do run a partir das bases já prontas (eventos: TIPO; agregada: DATA, LINHA).
+
+    ``por_tipo`` já contado (o run incremental soma o do pai e o do delta) dispensa ``eventos``.
+    """
+    datas = pd.to_datetime(agregada["DATA"], errors="coerce") if agregada is not None and "DATA" in agregada else pd.Series(dtype="datetime64[ns]")
+    mn, mx = datas.min(), datas.max()
+    linhas = []
+    if agregada is not None and "LINHA" in agregada:
+        linhas = sorted(agregada["LINHA"].dropna().astype(str).unique().tolist())
+    if por_tipo is not None:
+        por_tipo = {str(k): int(v) for k, v in sorted(por_tipo.items())}
+    elif eventos is not None and "TIPO" in eventos:
+        por_tipo = {str(k): int(v) for k, v in eventos["TIPO"].value_counts(dropna=False).sort_index().items()}
+    else:
+        por_tipo = {}
+    return {
+        "version": MANIFEST_VERSION,
+        "run_id": run_id,
+        "created_at": datetime.now(tz=ZoneInfo("UTC")).isoformat(timespec="seconds"),
+        "min_date": _data_iso(mn),
+        "max_date": _data_iso(mx),
+        # âncora dos presets = última data dos dados (mesma regra do daily_cube)
+        "anchor_date": _data_iso(pd.Timestamp(mx).normalize() if pd.notna(mx) else mx),
+        "rows": {
+            "eventos": int(len(eventos)) if eventos is not None else sum(por_tipo.values()),
+            "agregada": int(len(agregada)) if agregada is not None else 0,
+            "por_tipo": por_tipo,
+        },
+        "linhas": linhas,
+        "inputs": inputs or {},
+        "config": config or {},
+        "stages": etapas or {},
+        "artifacts": artefatos(out_dir),
+    }
+
+
+def salvar_manifest(out_dir: Path, manifest: dict) -> Path:
+    p = Path(out_dir) / MANIFEST_FILE
+    tmp = p.with_name(p.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, default=str), encoding="utf-8")
+    os.replace(tmp, p)
+    return p
+
+
+def ler_manifest(out_dir: Path) -> dict | None:
+    try:
+        return json.loads((Path(out_dir) / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def resumo(manifest: dict) -> dict:
+    """Entrada da listagem de runs: o manifest sem a lista de linhas e os detalhes por arquivo."""
+    r = {k: v for k, v in manifest.items() if k not in ("linhas", "artifacts", "config")}
+    r["n_linhas"] = len(manifest.get("linhas") or [])
+    r["bytes"] = sum((manifest.get("artifacts") or {}).values())
+    return r
+
+
+def ancora(manifest: dict | None) -> pd.Timestamp | None:
+    if not manifest or not manifest.get("anchor_date"):
+        return None
+    return pd.Timestamp(manifest["anchor_date"])
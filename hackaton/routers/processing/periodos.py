@@ -0,0 +1,135 @@
+"""Períodos de consulta: presets do front, janelas móveis, calendário e datas ISO.
+
+Tudo é ancorado na última data dos dados do run (não em "hoje"), igual aos
+filtros que já existiam. Datas explícitas (``start_date``/``end_date`` em
+ISO ``AAAA-MM-DD``) têm prioridade sobre o preset.
+"""
+import re
+from datetime import date
+
+import pandas as pd
+
+DESDE_SEMPRE = "Desde sempre"
+
+_SEMPRE = {"all", "desde", "desde_sempre", "desde sempre", "sempre", "since"}
+_HOJE = {"hoje", "today"}
+_MES_ATUAL = {"este_mes", "mtd", "month_to_date", "mes_atual", "mês atual", "mês_atual"}
+_MES_ANTERIOR = {"mes_anterior", "mês_anterior", "last_month", "previous_month"}
+_SEMANA_ATUAL = {"esta_semana", "semana_atual", "wtd", "week_to_date"}
+_SEMANA_ANTERIOR = {"semana_anterior", "last_week", "previous_week"}
+_TRIMESTRE_ATUAL = {"este_trimestre", "trimestre_atual", "qtd", "quarter_to_date"}
+_TRIMESTRE_ANTERIOR = {"trimestre_anterior", "last_quarter", "previous_quarter"}
+_ANO_ATUAL = {"este_ano", "ano_atual", "ytd", "year_to_date"}
+
+# sinônimos antigos do front para as janelas de 7 e 30 dias
+_ALIAS_DIAS = {
+    "ultimos 7 dias": 7, "últimos 7 dias": 7, "last7": 7,
+    "ultimos 30 dias": 30, "últimos 30 dias": 30, "ultimo_mes": 30, "último mês": 30, "último_mês": 30, "last30": 30,
+}
+# 7d, 90d, ultimos_15_dias, últimos_45_dias, last_60_days
+_RE_DIAS = re.compile(r"^(?:(\d+)d|[uú]ltimos_(\d+)_dias|last_?(\d+)(?:_days)?)$")
+# só AAAA-MM-DD: o fromisoformat do 3.11 também aceita 20240101 e semana ISO
+_RE_ISO = re.compile(r"^[0-9]{4}-[0-9]{2}-[0-9]{2}$")
+# janela móvel máxima (100 anos); acima disso o Timedelta do pandas estoura
+MAX_DIAS = 36_500
+
+
+class PeriodoInvalido(ValueError):
+    """Data ISO mal formada, início depois do fim ou janela de dias grande demais."""
+
+
+def _data_iso(valor: str | None, campo: str) -> pd.Timestamp | None:
+    if valor is None or not str(valor).strip():
+        return None
+    texto = str(valor).strip()
+    # nada de pd.Timestamp(texto): aceita "now", "12/01/2024" (mês primeiro) e data com fuso
+    try:
+        dia = date.fromisoformat(texto) if _RE_ISO.match(texto) else None
+    except ValueError:
+        dia = None
+    if dia is None:
+        raise PeriodoInvalido(f"{campo} inválida: {valor!r} (use AAAA-MM-DD)")
+    return pd.Timestamp(dia)
+
+
+def _fmt(start: pd.Timestamp, end: pd.Timestamp) -> str:
+    return f"{start.date()}–{end.date()}"
+
+
+def datas_explicitas(start_date: str | None, end_date: str | None) -> tuple[pd.Timestamp | None, pd.Timestamp | None]:
+    """Valida o par de datas ISO (qualquer uma pode faltar)."""
+    start = _data_iso(start_date, "start_date")
+    end = _data_iso(end_date, "end_date")
+    if start is not None and end is not None and start > end:
+        raise PeriodoInvalido(f"start_date ({start.date()}) depois de end_date ({end.date()})")
+    return start, end
+
+
+def resolver_periodo(
+    preset: str | None,
+    anchor: pd.Timestamp | None,
+    start_date: str | None = None,
+    end_date: str | None = None,
+) -> tuple[pd.Timestamp | None, pd.Timestamp | None, str]:
+    """Converte preset (ou datas ISO) em intervalo fechado ``[start, end]`` + rótulo."""
+    start, end = datas_explicitas(start_date, end_date)
+    if start is not None or end is not None:
+        if start is None:
+            return None, end, f"Até {end.date()}"
+        if end is None:
+            return start, None, f"A partir de {start.date()}"
+        return start, end, f"Período ({_fmt(start, end)})"
+
+    preset = (preset or "desde_sempre").strip().lower()
+    # normaliza alguns sinonimos pro front
+    preset = preset.replace("-", "_")
+    if preset in _SEMPRE:
+        return None, None, DESDE_SEMPRE
+    if anchor is None or pd.isna(anchor):
+        # sem âncora ele não consegue filtrar
+        return None, None, DESDE_SEMPRE
+
+    end = pd.Timestamp(anchor).normalize()
+
+    if preset in _HOJE:
+        return end, end, f"Hoje ({end.date()})"
+
+    m = _RE_DIAS.match(preset)
+    n = _ALIAS_DIAS.get(preset) or (int(next(g for g in m.groups() if g)) if m else None)
+    if n:
+        if n > MAX_DIAS:
+            raise PeriodoInvalido(f"janela de {n} dias acima do máximo ({MAX_DIAS})")
+        start = end - pd.Timedelta(days=n - 1)
+        return start, end, f"Últimos {n} dias ({_fmt(start, end)})"
+
+    if preset in _SEMANA_ATUAL:
+        start = end - pd.Timedelta(days=end.weekday())
+        return start, end, f"Esta semana ({_fmt(start, end)})"
+    if preset in _SEMANA_ANTERIOR:
+        fim = end - pd.Timedelta(days=end.weekday() + 1)
+        start = fim - pd.Timedelta(days=6)
+        return start, fim, f"Semana anterior ({_fmt(start, fim)})"
+
+    if preset in _MES_ATUAL:
+        start = end.replace(day=1)
+        return start, end, f"Este mês ({_fmt(start, end)})"
+    if preset in _MES_ANTERIOR:
+        fim = end.replace(day=1) - pd.Timedelta(days=1)
+        start = fim.replace(day=1)
+        return start, fim, f"Mês anterior ({_fmt(start, fim)})"
+
+    if preset in _TRIMESTRE_ATUAL:
+        start = end.to_period("Q").start_time
+        return start, end, f"Este trimestre ({_fmt(start, end)})"
+    if preset in _TRIMESTRE_ANTERIOR:
+        q = end.to_period("Q") - 1
+        start, fim = q.start_time, q.end_time.normalize()
+        return start, fim, f"Trimestre anterior ({_fmt(start, fim)})"
+
+    if preset in _ANO_ATUAL:
+        start = end.replace(month=1, day=1)
+        return start, end, f"Este ano ({_fmt(start, end)})"
+
+    # fallback
+    return None, None, DESDE_SEMPRE
+
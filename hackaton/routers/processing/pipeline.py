@@ -0,0 +1,384 @@
+"""Pipeline único do run, em etapas nomeadas.
+
+Antes o /process e o /api/process tinham cada um a sua cópia dos mesmos
+passos (e já tinham divergido). Agora os dois chamam este motor:
+
+    ingest -> build_master -> nc_enrich -> events -> daily_cube -> line_cube -> text_index -> line_collisions -> scoring -> export -> manifest
+
+Cada etapa é cronometrada (e tem as linhas que produziu contadas) e o
+resultado fica memorizado no ``PipelineRun``.
+Dá para invalidar uma etapa e rodar de novo só dela em diante, sem repetir
+o ingest (ex.: trocar pesos e refazer só scoring + export).
+"""
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from ..config import settings
+from . import run_store
+from .excel_export import escrever_em_paralelo
+from .ingest import ler_entradas
+from .line_collisions import variacoes_linha
+from .line_cube import construir_cubo, salvar_cubo
+from .manifest import montar_manifest, salvar_manifest
+from .schema import compactar_agregada, compactar_eventos
+from .text_index import construir_indice, salvar_indice
+from .v3_2_moritz import gerar_planilha_v3_2
+
+INPUT_NAMES = ("reclamacoes", "refugos", "mapa_cc", "auditoria_nc")
+
+# sobe quando a lógica das etapas muda de um jeito que altera as saídas
+# (invalida o reaproveitamento de runs com as mesmas entradas)
+PIPELINE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class Etapa:
+    nome: str
+    fn: Callable[["PipelineRun"], Any]
+    depende: tuple[str, ...] = ()
+
+
+class PipelineRun:
+    """Estado de um run: entradas, resultados memorizados e tempo de cada etapa."""
+
+    # etapas deste tipo de run (o run incremental troca algumas; ver delta.py)
+    etapas: dict[str, "Etapa"]
+
+    def __init__(
+        self, run_id: str, paths: dict[str, str], out_dir: Path, progresso: Any = None, pesos: dict | None = None,
+        export_workers: int = 1, digests: dict[str, str] | None = None, cache_dir: Path | None = None, ingest_workers: int = 2,
+    ):
+        self.run_id = run_id
+        self.paths = paths
+        self.digests = digests or {}
+        self.cache_dir = cache_dir
+        self.ingest_workers = ingest_workers
+        self.out_dir = Path(out_dir)
+        self.progresso = progresso
+        self.pesos = pesos or pesos_padrao()
+        self.export_workers = export_workers
+        self.resultados: dict[str, Any] = {}
+        self.tempos: dict[str, float] = {}
+        self.linhas: dict[str, int] = {}
+
+    def __getitem__(self, nome: str) -> Any:
+        if nome not in self.resultados:
+            self._rodar_etapa(self.etapas[nome])
+        return self.resultados[nome]
+
+    def _rodar_etapa(self, etapa: Etapa) -> None:
+        for dep in etapa.depende:
+            self[dep]
+        if self.progresso is not None:
+            self.progresso.etapa(etapa.nome)
+        t0 = time.perf_counter()
+        self.resultados[etapa.nome] = etapa.fn(self)
+        self.tempos[etapa.nome] = round(time.perf_counter() - t0, 3)
+        linhas = contar_linhas(self.resultados[etapa.nome])
+        if linhas is not None:
+            self.linhas[etapa.nome] = linhas
+            if self.progresso is not None:
+                self.progresso.contar(linhas)
+
+    def executar(self, ate: str = "manifest") -> "PipelineRun":
+        self[ate]
+        return self
+
+    def invalidar(self, nome: str) -> None:
+        """Descarta ``nome`` e tudo que depende dele (as anteriores ficam memorizadas)."""
+        self.resultados.pop(nome, None)
+        self.tempos.pop(nome, None)
+        self.linhas.pop(nome, None)
+        for e in self.etapas.values():
+            if nome in e.depende:
+                self.invalidar(e.nome)
+
+
+def contar_linhas(resultado: Any) -> int | None:
+    """Linhas da maior tabela que a etapa devolveu (None se não devolveu tabela)."""
+    if isinstance(resultado, (pd.DataFrame, pd.Series)):
+        return len(resultado)
+    if isinstance(resultado, dict):
+        tamanhos = [len(v) for v in resultado.values() if isinstance(v, (pd.DataFrame, pd.Series))]
+        return max(tamanhos) if tamanhos else None
+    return None
+
+
+def pesos_padrao() -> dict:
+    return {
+        "PESO_FORMAL": settings.PESO_FORMAL,
+        "PESO_INFORMAL": settings.PESO_INFORMAL,
+        "PESO_REF_QTD": settings.PESO_REF_QTD,
+        "PESO_REF_FREQ": settings.PESO_REF_FREQ,
+        "PESO_IA_TEXTO": settings.PESO_IA_TEXTO,
+    }
+
+
+def config_pontuacao() -> dict:
+    """Tudo que, junto com as entradas, determina o resultado do run."""
+    return {
+        **pesos_padrao(),
+        "CODIGOS_EXCLUIR": sorted(str(c) for c in (settings.CODIGOS_EXCLUIR or [])),
+        "MORITZ_MODEL": settings.MORITZ_MODEL,
+        "USE_MORITZ": settings.USE_MORITZ,
+        "PIPELINE_VERSION": PIPELINE_VERSION,
+    }
+
+
+# Etapas
+
+def _ingest(run: PipelineRun) -> dict:
+    """Lê as quatro planilhas: os dois builders rodam em paralelo e reaproveitam
+    o resultado de uploads anteriores com o mesmo conteúdo (ver ``ingest``)."""
+    faltando = [n for n in INPUT_NAMES if not Path(run.paths.get(n, "")).exists()]
+    if faltando:
+        raise FileNotFoundError(f"entradas ausentes: {', '.join(faltando)}")
+    paths = {n: run.paths[n] for n in INPUT_NAMES}
+    lido = ler_entradas(
+        paths, run.digests, settings.CODIGOS_EXCLUIR, PIPELINE_VERSION,
+        cache_dir=run.cache_dir, max_workers=run.ingest_workers,
+    )
+    return {"paths": paths, **lido}
+
+
+def _build_master(run: PipelineRun) -> dict:
+    # Importante o processamento pesado gera uma base completa não filtrada
+    # para permitir filtros por período depois sem reprocessar (ver ingest.construir_v2).
+    return run["ingest"]["v2"]
+
+
+def _nc_enrich(run: PipelineRun) -> dict:
+    """Auditoria NC sem filtro (filtro é posterior) + mestre enriquecida por LINHA."""
+    mestre = run["build_master"]["mestre"]
+    nc_pack = run["ingest"]["nc_pack"]
+    try:
+        # mesma NC para todos PNs daquela linha
+        if "nc_linhas" in nc_pack and not nc_pack["nc_linhas"].empty:
+            mestre = mestre.merge(nc_pack["nc_linhas"], on="LINHA", how="left")
+    except Exception as e:
+        # não quebra o fluxo se a planilha vier diferente
+        nc_pack = {"erro": str(e)}
+    return {"nc_pack": nc_pack, "mestre": mestre}
+
+
+def _events(run: PipelineRun) -> pd.DataFrame:
+    """Base de eventos unificada (refugo, reclamações e NC como eventos), já com os tipos compactos."""
+    # cópia rasa: as colunas abaixo são substituídas, nunca alteradas in-place,
+    # então a base do builder (memorizada no build_master) não muda
+    eventos = run["build_master"].get("eventos", pd.DataFrame()).copy(deep=False)
+    nc_pack = run["nc_enrich"]["nc_pack"]
+    if "nc_raw" in nc_pack and isinstance(nc_pack["nc_raw"], pd.DataFrame) and not nc_pack["nc_raw"].empty:
+        nc_raw = nc_pack["nc_raw"]
+        nc_ev = pd.DataFrame({
+            "TIPO": "NC_AUDITORIA",
+            "DATA_EVENTO": pd.to_datetime(nc_raw.get("Created"), errors="coerce"),
+            "LINHA_ORIGINAL": nc_raw.get("LINHA_ORIGINAL", ""),
+            "LINHA": nc_raw.get("LINHA", "SEM_LINHA"),
+            "PN_ORIGINAL": "",
+            "PN_LIMPO": "",
+            "DESCRICAO": nc_raw.get("Description", ""),
+            "QTD": 0,
+            "FREQ": 1,
+            "STATUS": nc_raw.get("Status", ""),
+            "DUE_DATE": pd.to_datetime(nc_raw.get("Due date"), errors="coerce"),
+            "CLOSING_DATE": pd.to_datetime(nc_raw.get("Closing date"), errors="coerce"),
+            "Q14": nc_raw.get("14Q", ""),
+        })
+        eventos = pd.concat([eventos, nc_ev], ignore_index=True)
+
+    eventos["DATA_EVENTO"] = pd.to_datetime(eventos.get("DATA_EVENTO"), errors="coerce")
+    eventos["LINHA"] = eventos.get("LINHA", "SEM_LINHA").fillna("SEM_LINHA")
+    eventos["PN_LIMPO"] = eventos.get("PN_LIMPO", "").fillna("")
+    eventos["DESCRICAO"] = eventos.get("DESCRICAO", "").fillna("")
+
+    eventos["FLAG_RISCO_OCULTO"] = (
+        (eventos["LINHA"] == "SEM_LINHA")
+        | (eventos["PN_LIMPO"] == "DESCONHECIDO")
+        | (eventos["PN_LIMPO"] == "")
+    ).astype(np.int8)
+    return compactar_eventos(eventos)
+
+
+# célula da base agregada e as somas guardadas em cada uma
+CHAVES_AGREGADA = ["DATA", "LINHA", "PN_LIMPO"]
+SOMAS_AGREGADA = ["REF_QTD_SUM", "REF_FREQ_SUM", "REC_FORMAL_SUM", "REC_INFORMAL_SUM", "NC_TOTAL_SUM", "NC_ABERTA_SUM", "NC_VENCIDA_SUM"]
+
+
+def ancora_dos_dados(datas: pd.Series) -> pd.Timestamp:
+    """Última data dos dados (normalizada); sem nenhuma data, hoje."""
+    anchor = datas.max()
+    return pd.Timestamp(anchor).normalize() if pd.notna(anchor) else pd.Timestamp.now().normalize()
+
+
+def agregar_eventos(eventos: pd.DataFrame, anchor: pd.Timestamp) -> pd.DataFrame:
+    """Eventos -> somas por (DATA, LINHA, PN_LIMPO).
+
+    Soma linha a linha: a agregada de duas bases é a soma das agregadas de
+    cada uma (é o que o run incremental usa), exceto NC_VENCIDA, que depende
+    da ``anchor``. Contadores saem em int32 e as chaves categóricas continuam
+    categóricas (ver schema.py).
+    """
+    tipo = eventos["TIPO"]
+    nc_aberta = (tipo == "NC_AUDITORIA") & (eventos.get("CLOSING_DATE").isna())
+    # vencida = due existe, aberta e due < data âncora (última data dos dados, não "hoje":
+    # assim o número bate com os filtros de período, que também são ancorados nos dados)
+    due_dt = pd.to_datetime(eventos.get("DUE_DATE"), errors="coerce").dt.normalize()
+
+    def _marcado(mask: pd.Series) -> np.ndarray:
+        return mask.to_numpy(dtype=bool, na_value=False)
+
+    qtd = pd.to_numeric(eventos["QTD"], errors="coerce").fillna(0) if "QTD" in eventos else pd.Series(0.0, index=eventos.index)
+    somas = {
+        "REF_QTD_SUM": qtd.to_numpy(dtype=np.float64),
+        "REF_FREQ_SUM": _marcado(tipo == "REFUGO"),
+        "REC_FORMAL_SUM": _marcado(tipo == "RECLAMACAO_FORMAL"),
+        "REC_INFORMAL_SUM": _marcado(tipo == "RECLAMACAO_INFORMAL"),
+        "NC_TOTAL_SUM": _marcado(tipo == "NC_AUDITORIA"),
+        "NC_ABERTA_SUM": _marcado(nc_aberta),
+        "NC_VENCIDA_SUM": _marcado(nc_aberta & due_dt.notna() & (due_dt < anchor)),
+    }
+    chaves = {"DATA": eventos["DATA_EVENTO"].dt.normalize(), "LINHA": eventos["LINHA"], "PN_LIMPO": eventos["PN_LIMPO"]}
+    return compactar_agregada(_somar_por_celula(chaves, somas))
+
+
+def _somar_por_celula(chaves: dict[str, pd.Series], somas: dict[str, np.ndarray]) -> pd.DataFrame:
+    """groupby(chaves, dropna=False, observed=True).sum() feito sobre os códigos.
+
+    Cada chave vira código (categórica: os próprios códigos), a célula é o
+    código combinado e as somas saem por ``bincount`` — sem montar a
+    ``base_diaria`` nem agrupar strings. Mesma ordem do groupby ordenado
+    (nulos por último) e só células com evento.
+    """
+    codigos, valores = [], []
+    for s in chaves.values():
+        c, u = pd.factorize(s, sort=True, use_na_sentinel=False)
+        codigos.append(c.astype(np.int64))
+        valores.append(u)
+    tamanhos = [max(1, len(u)) for u in valores]
+    if float(np.prod(tamanhos, dtype=np.float64)) >= 2**62:
+        # combinações demais para um int64: groupby normal
+        base = pd.DataFrame({**chaves, **somas})
+        return base.groupby(list(chaves), dropna=False, observed=True)[list(somas)].sum().reset_index()
+
+    combinado = codigos[0]
+    for c, n in zip(codigos[1:], tamanhos[1:]):
+        combinado = combinado * n + c
+    celulas, celula = np.unique(combinado, return_inverse=True)
+    n_cel = len(celulas)
+
+    saida = {}
+    resto = celulas
+    for nome, u, n in reversed(list(zip(chaves, valores, tamanhos))):
+        resto, idx = np.divmod(resto, n)
+        saida[nome] = u.take(idx)
+    agregada = pd.DataFrame({nome: saida[nome] for nome in chaves})
+    for nome, v in somas.items():
+        # contador (bool): conta as linhas marcadas; medida: soma ponderada
+        agregada[nome] = np.bincount(celula[v], minlength=n_cel) if v.dtype == bool else np.bincount(celula, weights=v, minlength=n_cel)
+    return agregada
+
+
+def _daily_cube(run: PipelineRun) -> dict:
+    """Base agregada por dia/linha/pn para os filtros por período."""
+    eventos = run["events"]
+    anchor = ancora_dos_dados(eventos["DATA_EVENTO"])
+    return {"agregada": agregar_eventos(eventos, anchor), "anchor": anchor}
+
+
+def _line_cube(run: PipelineRun):
+    """Somas acumuladas LINHA × dia para o ranking por período (ver line_cube)."""
+    return construir_cubo(run["daily_cube"]["agregada"])
+
+
+def _text_index(run: PipelineRun):
+    """Postings LINHA → dia → descrição + índice invertido de tokens, para o chat."""
+    return construir_indice(run["events"])
+
+
+def _line_collisions(run: PipelineRun) -> pd.DataFrame:
+    """Grafias de LINHA_ORIGINAL por LINHA, com frequência e primeira/última data."""
+    return variacoes_linha(run["events"])
+
+
+def _scoring(run: PipelineRun) -> dict:
+    nc_pack = run["nc_enrich"]["nc_pack"]
+    return gerar_planilha_v3_2(
+        mestre=run["nc_enrich"]["mestre"],
+        pesos=run.pesos,
+        moritz_model=settings.MORITZ_MODEL,
+        use_moritz=settings.USE_MORITZ,
+        nc_linhas=nc_pack.get("nc_linhas"),
+    )
+
+
+def _export(run: PipelineRun) -> list[dict]:
+    """Persiste os dados do run e grava só os xlsx principais, em paralelo.
+
+    As exportações secundárias (lazy_exports) saem no primeiro download.
+    Devolve o relatório por arquivo (tempo, pico de memória, formato).
+    """
+    out_dir = run.out_dir
+    result_v2 = run["build_master"]
+    nc_pack = run["nc_enrich"]["nc_pack"]
+    eventos = run["events"]
+    agregada = run["daily_cube"]["agregada"]
+    plan = run["scoring"]
+
+    # Store colunar: é daqui que os endpoints de leitura carregam
+    run_store.salvar_run(out_dir, eventos, agregada)
+    salvar_cubo(out_dir, run["line_cube"])
+    salvar_indice(out_dir, run["text_index"])
+    run_store.salvar_tabela(out_dir / run_store.RASTREIO_FILE, result_v2["rastreio"])
+    run_store.salvar_tabela(out_dir / run_store.PN_COLISOES_FILE, result_v2["colisoes"])
+    run_store.salvar_tabela(out_dir / run_store.LINHA_VARIACOES_FILE, run["line_collisions"])
+    if "nc_linhas" in nc_pack:
+        run_store.salvar_tabela(out_dir / run_store.NC_LINHAS_FILE, nc_pack["nc_linhas"])
+        run_store.salvar_tabela(out_dir / run_store.NC_RAW_FILE, nc_pack["nc_raw"])
+
+    # as bases grandes vão do Parquet recém gravado direto para o xlsx, em lotes
+    arquivos = {
+        "BASE_MESTRA_AUDITORIA_V2.xlsx": {"Sheet1": run["nc_enrich"]["mestre"]},
+        "BASE_EVENTOS_LONG.xlsx": {"EVENTOS": out_dir / run_store.EVENTOS_FILE},
+        "BASE_AGREGADA_DIA_LINHA_PN.xlsx": {"AGREGADA_DIA_LINHA_PN": out_dir / run_store.AGREGADA_FILE},
+        "RESULTADO_AUDITORIA_V3_2_MORITZ.xlsx": {
+            "RANKING_REATIVO": plan["reativo"],
+            "RANKING_PREVENTIVO": plan["preventivo"],
+            "TOP_LINHAS": plan["top_linhas"],
+        },
+    }
+    return escrever_em_paralelo(out_dir, arquivos, run.export_workers)
+
+
+def _manifest(run: PipelineRun) -> dict:
+    """Grava o manifest.json (datas, contagens, linhas, digests, config, tempos, artefatos).
+
+    Última etapa: os tempos de todas as anteriores e os tamanhos dos arquivos já existem.
+    """
+    manifest = montar_manifest(
+        run.run_id, run["events"], run["daily_cube"]["agregada"], run.out_dir,
+        inputs=run["ingest"]["digests"], config=config_pontuacao(), etapas=dict(run.tempos),
+    )
+    salvar_manifest(run.out_dir, manifest)
+    return manifest
+
+
+ETAPAS: dict[str, Etapa] = {e.nome: e for e in (
+    Etapa("ingest", _ingest),
+    Etapa("build_master", _build_master, ("ingest",)),
+    Etapa("nc_enrich", _nc_enrich, ("build_master",)),
+    Etapa("events", _events, ("build_master", "nc_enrich")),
+    Etapa("daily_cube", _daily_cube, ("events",)),
+    Etapa("line_cube", _line_cube, ("daily_cube",)),
+    Etapa("text_index", _text_index, ("events",)),
+    Etapa("line_collisions", _line_collisions, ("events",)),
+    Etapa("scoring", _scoring, ("nc_enrich",)),
+    Etapa("export", _export, ("build_master", "nc_enrich", "events", "daily_cube", "line_cube", "text_index", "line_collisions", "scoring")),
+    Etapa("manifest", _manifest, ("export",)),
+)}
+PipelineRun.etapas = ETAPAS
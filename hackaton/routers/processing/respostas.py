@@ -0,0 +1,150 @@
+"""Serialização das respostas de dados do ai.py.
+
+- ``RespostaRapida``: JSONResponse com orjson (numpy, datetime e NaN -> null
+  nativos, sem ``jsonable_encoder``);
+- ``classe_linha`` / ``nivel_linha``: as faixas de ``_classificar`` /
+  ``_nivel_simples`` aplicadas na coluna inteira com ``searchsorted``;
+- ``TOP_LINHAS_COLUNAS`` / ``TENDENCIA_COLUNAS`` / ``COMPARE_COLUNAS`` /
+  ``CENARIO_COLUNAS``: nome e tipo de cada campo;
+- ``registros``: DataFrame -> lista de dicts por coluna (``tolist`` já devolve
+  tipos Python), com mapa de renomeação/tipos e NaN -> None, sem ``iterrows``.
+"""
+from typing import Any
+
+import numpy as np
+import orjson
+import pandas as pd
+from fastapi.responses import JSONResponse
+
+# faixas: score >= limite -> rótulo seguinte
+_CLASSE_LIMITES = np.array([30.0, 55.0, 80.0])
+_CLASSE_ROTULOS = np.array(["Estável", "Médio", "Atenção", "Crítico"], dtype=object)
+_NIVEL_LIMITES = np.array([45.0, 70.0])
+_NIVEL_ROTULOS = np.array(["Baixa", "Média", "Alta"], dtype=object)
+
+# ranking por período (line_cube.ranking) -> contrato do /api/top_linhas
+TOP_LINHAS_COLUNAS: dict[str, tuple[str, type]] = {
+    "LINHA": ("LINHA", str),
+    "Score_Linha": ("Score_Linha", float),
+    "Classe_Linha": ("Classe_Linha", str),
+    "Nivel": ("Nivel", str),
+    "TOTAL_RECLAMACOES": ("Total_Reclamacoes", int),
+    "REC_FORMAL": ("Reclamacoes_Formais", int),
+    "REC_INFORMAL": ("Reclamacoes_Informais", int),
+    "NC_TOTAL": ("NC_Total", int),
+    "NC_ABERTA": ("NC_Aberta", int),
+    "NC_VENCIDA": ("NC_Vencida", int),
+    "REF_QTD": ("Refugo_Qtd", float),
+    "REF_FREQ": ("Refugo_Freq", int),
+}
+
+# top de cada cenário (scenarios.pontuar) -> /api/scenarios; as métricas de cada linha vão uma vez só
+CENARIO_COLUNAS: dict[str, tuple[str, type]] = {
+    "LINHA": ("LINHA", str),
+    "Score_Linha": ("Score_Linha", float),
+    "Classe_Linha": ("Classe_Linha", str),
+    "Nivel": ("Nivel", str),
+}
+
+# tendência mensal de uma linha (history.tendencia_mensal) -> /api/history/trend
+TENDENCIA_COLUNAS: dict[str, tuple[str, type]] = {
+    "MES": ("Mes", str),
+    "TOTAL_RECLAMACOES": ("Total_Reclamacoes", int),
+    "REC_FORMAL": ("Reclamacoes_Formais", int),
+    "REC_INFORMAL": ("Reclamacoes_Informais", int),
+    "NC_TOTAL": ("NC_Total", int),
+    "NC_ABERTA": ("NC_Aberta", int),
+    "NC_VENCIDA": ("NC_Vencida", int),
+    "REF_QTD": ("Refugo_Qtd", float),
+    "REF_FREQ": ("Refugo_Freq", int),
+}
+
+# comparação de runs (compare.comparar) -> contrato do /api/compare; lado ausente sai null
+COMPARE_COLUNAS: dict[str, tuple[str, type | None]] = {
+    "LINHA": ("LINHA", str),
+    "STATUS": ("Status", str),
+    "POSICAO_BASE": ("Posicao_Base", None),
+    "POSICAO_ALVO": ("Posicao_Alvo", None),
+    "DELTA_POSICAO": ("Delta_Posicao", None),
+    "Score_Linha_BASE": ("Score_Base", None),
+    "Score_Linha_ALVO": ("Score_Alvo", None),
+    "DELTA_Score_Linha": ("Delta_Score", float),
+    "Classe_Linha_BASE": ("Classe_Base", str),
+    "Classe_Linha_ALVO": ("Classe_Alvo", str),
+    "MUDOU_CLASSE": ("Mudou_Classe", bool),
+    "DELTA_TOTAL_RECLAMACOES": ("Delta_Total_Reclamacoes", int),
+    "DELTA_REC_FORMAL": ("Delta_Reclamacoes_Formais", int),
+    "DELTA_REC_INFORMAL": ("Delta_Reclamacoes_Informais", int),
+    "DELTA_NC_TOTAL": ("Delta_NC_Total", int),
+    "DELTA_NC_ABERTA": ("Delta_NC_Aberta", int),
+    "DELTA_NC_VENCIDA": ("Delta_NC_Vencida", int),
+    "DELTA_REF_QTD": ("Delta_Refugo_Qtd", float),
+    "DELTA_REF_FREQ": ("Delta_Refugo_Freq", int),
+}
+
+
+def _faixa(score: Any, limites: np.ndarray, rotulos: np.ndarray) -> np.ndarray:
+    s = np.nan_to_num(np.asarray(score, dtype=np.float64), nan=0.0)
+    return rotulos[np.searchsorted(limites, s, side="right")]
+
+
+def classe_linha(score: Any) -> np.ndarray:
+    """Crítico (>= 80) / Atenção (>= 55) / Médio (>= 30) / Estável."""
+    return _faixa(score, _CLASSE_LIMITES, _CLASSE_ROTULOS)
+
+
+def nivel_linha(score: Any) -> np.ndarray:
+    """Alta (>= 70) / Média (>= 45) / Baixa."""
+    return _faixa(score, _NIVEL_LIMITES, _NIVEL_ROTULOS)
+
+
+def _coluna(valores: Any, tipo: type | None) -> list:
+    if isinstance(valores, pd.Series) and (isinstance(valores.dtype, pd.DatetimeTZDtype) or valores.dtype.kind == "M"):
+        # datas saem como Timestamp (o encoder converte), NaT -> None
+        return [None if pd.isna(v) else v for v in valores.astype(object).tolist()]
+    arr = valores.to_numpy() if isinstance(valores, pd.Series) else np.asarray(valores)
+    if tipo in (int, float):
+        # contagens/medidas: vazio vira 0 (era o ``or 0`` do laço antigo)
+        num = np.nan_to_num(arr.astype(np.float64), nan=0.0)
+        return (num.astype(np.int64) if tipo is int else num).tolist()
+    lista = (arr.astype(object) if tipo is str else arr).tolist()
+    nulos = pd.isna(arr)
+    if not nulos.any():
+        return lista
+    return [None if n else v for v, n in zip(lista, nulos)]
+
+
+def registros(df: pd.DataFrame | dict, colunas: dict[str, tuple[str, type]] | None = None) -> list[dict]:
+    """DataFrame (ou dict coluna -> array) -> ``[{col: valor}]`` montado coluna a coluna.
+
+    ``colunas`` = ``{coluna_df: (nome_json, tipo)}`` define ordem, nome e tipo
+    de saída; sem ele vão todas as colunas, com NaN -> None.
+    """
+    if df is None or len(df) == 0:
+        return []
+    if colunas is None:
+        colunas = {c: (str(c), None) for c in df.keys()}
+    nomes, valores = [], []
+    for col, (nome, tipo) in colunas.items():
+        if col not in df:
+            continue
+        nomes.append(nome)
+        valores.append(_coluna(df[col], tipo))
+    return [dict(zip(nomes, linha)) for linha in zip(*valores)]
+
+
+def _padrao(obj: Any) -> Any:
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (pd.Timestamp,)):
+        return obj.isoformat()
+    return str(obj)
+
+
+class RespostaRapida(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_padrao, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,428 @@
+"""Retenção do storage: arquivar, apagar e limpar runs antigos.
+
+Cada run ocupa ``outputs/<run_id>`` (Parquet, npz, xlsx) e ``inputs/<run_id>``
+(as planilhas enviadas). A varredura (``varrer``) aplica a ``Politica``:
+
+- idade: run sem acesso há ``arquivar_apos_s`` é compactado; há
+  ``apagar_apos_s``, apagado (0 = nunca);
+- tamanho: acima de ``max_bytes`` arquiva os mais antigos e, se não bastar,
+  apaga os arquivados mais antigos;
+- run fixado (``fixar``), na fila ou rodando nunca entra.
+
+Compactar = um ``run.zip`` na própria pasta do run com tudo menos
+``job.json``, ``manifest.json`` e ``pin.json`` (que ficam soltos: listagem,
+status, contexto e reaproveitamento de upload continuam sem abrir o zip) e
+menos as exportações sob demanda que dá para montar de novo dos Parquet
+(``lazy_exports.regeneravel``). As planilhas de entrada vão junto, em
+``inputs/``. A leitura chama ``restaurar`` antes: o zip é extraído de volta,
+apagado, e o run volta a contar idade do zero. Os arquivos extraídos ganham
+mtime novo; a ETag de download é do conteúdo (``http_cache.etag_arquivo``),
+então não muda.
+
+Arquivar, restaurar e apagar um run passam pela trava do run (flock em
+``<run>/.lock``), que vale entre os workers do uvicorn; sem ``fcntl``
+(Windows) fica uma trava por processo.
+
+Idade = desde o último acesso (``tocar``, no máximo uma gravação por hora;
+uma revalidação respondida com 304 também conta) ou, sem acesso registrado,
+desde o manifest/job.json.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import zipfile
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .jobs import QUEUED, RUNNING, STATUS_FILE, conferir
+from .lazy_exports import regeneravel
+from .manifest import MANIFEST_FILE
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos, cada worker varre sozinho
+    fcntl = None
+
+ARQUIVO_FILE = "run.zip"
+ARQUIVADO_FILE = "archived.json"
+PIN_FILE = "pin.json"
+ACESSO_FILE = ".acesso"
+TRAVA_FILE = ".lock"
+# ficam fora do zip
+SOLTOS = {STATUS_FILE, MANIFEST_FILE, PIN_FILE, ARQUIVADO_FILE, ACESSO_FILE, ARQUIVO_FILE, TRAVA_FILE}
+# já comprimidos: entram no zip sem recomprimir
+_SEM_COMPRESSAO = (".parquet", ".xlsx", ".gz", ".zip")
+# restos de gravação interrompida / uploads sem run, apagados depois disso
+RESTOS_APOS_S = 24 * 3600
+TOQUE_S = 3600
+
+
+@dataclass(frozen=True)
+class Politica:
+    arquivar_apos_s: float = 0
+    apagar_apos_s: float = 0
+    max_bytes: int = 0
+
+
+def _agora() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _gravar_json(p: Path, dados: dict) -> None:
+    tmp = p.with_name(p.name + f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(dados, ensure_ascii=False, default=str), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def _ler_json(p: Path) -> dict | None:
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def tamanho_pasta(pasta: Path) -> int:
+    total = 0
+    try:
+        with os.scandir(pasta) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    total += tamanho_pasta(Path(e.path))
+                elif e.is_file(follow_symlinks=False):
+                    total += e.stat(follow_symlinks=False).st_size
+    except OSError:
+        pass
+    return total
+
+
+def _mtime(p: Path) -> float | None:
+    try:
+        return p.stat().st_mtime
+    except OSError:
+        return None
+
+
+# fixar
+
+def fixado(out_dir: Path) -> dict | None:
+    return _ler_json(Path(out_dir) / PIN_FILE)
+
+
+def fixar(out_dir: Path, motivo: str | None = None) -> dict:
+    pin = {"pinned_at": _agora(), "reason": motivo}
+    _gravar_json(Path(out_dir) / PIN_FILE, pin)
+    return pin
+
+
+def desafixar(out_dir: Path) -> bool:
+    try:
+        (Path(out_dir) / PIN_FILE).unlink()
+        return True
+    except FileNotFoundError:
+        return False
+
+
+# acesso / idade
+
+def tocar(out_dir: Path) -> None:
+    """Registra acesso ao run (no máximo uma gravação por ``TOQUE_S``)."""
+    p = Path(out_dir) / ACESSO_FILE
+    mt = _mtime(p)
+    if mt is not None and time.time() - mt < TOQUE_S:
+        return
+    try:
+        p.touch()
+    except OSError:
+        pass
+
+
+def ultimo_uso(out_dir: Path) -> float:
+    out_dir = Path(out_dir)
+    datas = [_mtime(out_dir / n) for n in (ACESSO_FILE, MANIFEST_FILE, STATUS_FILE)]
+    datas = [d for d in datas if d is not None]
+    return max(datas) if datas else (_mtime(out_dir) or time.time())
+
+
+# arquivar / restaurar
+
+def arquivado(out_dir: Path) -> dict | None:
+    return _ler_json(Path(out_dir) / ARQUIVADO_FILE)
+
+
+def _em_andamento(out_dir: Path) -> bool:
+    # órfão (servidor caiu com ele na fila) vira erro aqui e volta a contar para a retenção
+    return (conferir(out_dir) or {}).get("state") in (QUEUED, RUNNING)
+
+
+_locks: dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(out_dir: Path) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(str(out_dir), threading.Lock())
+
+
+@contextmanager
+def _travado(out_dir: Path) -> Iterator[None]:
+    """Exclusão sobre o run entre processos (flock em ``.lock``); sem fcntl, só entre threads."""
+    if fcntl is None:
+        with _lock(out_dir):
+            yield
+        return
+    try:
+        f = (Path(out_dir) / TRAVA_FILE).open("a")
+    except FileNotFoundError:
+        # pasta já apagada: quem chamou confere e não faz nada
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def arquivar(out_dir: Path, inputs_dir: Path) -> dict | None:
+    """Compacta o run (ver docstring do módulo); None se não dá (fixado, rodando, já arquivado)."""
+    out_dir, inputs_dir = Path(out_dir), Path(inputs_dir)
+    with _travado(out_dir):
+        if arquivado(out_dir) or fixado(out_dir) or _em_andamento(out_dir) or not out_dir.is_dir():
+            return None
+        antes = tamanho_pasta(out_dir) + tamanho_pasta(inputs_dir)
+        membros, descartados = [], []
+        for p in sorted(out_dir.iterdir()):
+            if not p.is_file() or p.name in SOLTOS or p.name.endswith(".tmp"):
+                continue
+            (descartados if regeneravel(out_dir, p.name) else membros).append((p, p.name))
+        if inputs_dir.is_dir():
+            membros += [(p, f"inputs/{p.name}") for p in sorted(inputs_dir.iterdir()) if p.is_file()]
+
+        destino = out_dir / ARQUIVO_FILE
+        tmp = destino.with_name(destino.name + f".{os.getpid()}.tmp")
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as z:
+            for p, nome in membros:
+                z.write(p, nome, compress_type=zipfile.ZIP_STORED if p.name.endswith(_SEM_COMPRESSAO) else zipfile.ZIP_DEFLATED)
+        os.replace(tmp, destino)
+        # a marca vem depois do zip completo: cair antes dela só deixa um zip a mais, refeito na próxima
+        info = {
+            "archived_at": _agora(),
+            "files": len(membros),
+            "dropped": [n for _, n in descartados],
+            "bytes_before": antes,
+            "bytes_after": destino.stat().st_size,
+        }
+        _gravar_json(out_dir / ARQUIVADO_FILE, info)
+        for p, _ in membros + descartados:
+            p.unlink(missing_ok=True)
+        shutil.rmtree(inputs_dir, ignore_errors=True)
+        return info
+
+
+def restaurar(out_dir: Path, inputs_dir: Path) -> bool:
+    """Extrai o run arquivado de volta; True se extraiu. Idempotente; sob a trava do run."""
+    out_dir, inputs_dir = Path(out_dir), Path(inputs_dir)
+    if not (out_dir / ARQUIVADO_FILE).exists():
+        return False
+    with _travado(out_dir):
+        if not (out_dir / ARQUIVADO_FILE).exists():
+            return False
+        try:
+            z = zipfile.ZipFile(out_dir / ARQUIVO_FILE)
+        except FileNotFoundError:
+            # outro worker terminou de restaurar entre as duas checagens
+            return False
+        with z:
+            for info in z.infolist():
+                destino = inputs_dir / info.filename.removeprefix("inputs/") if info.filename.startswith("inputs/") else out_dir / info.filename
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                tmp = destino.with_name(destino.name + f".{os.getpid()}.tmp")
+                with z.open(info) as src, tmp.open("wb") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(tmp, destino)
+        (out_dir / ARQUIVADO_FILE).unlink(missing_ok=True)
+        (out_dir / ARQUIVO_FILE).unlink(missing_ok=True)
+        # restaurado = acessado agora
+        (out_dir / ACESSO_FILE).touch()
+        return True
+
+
+def apagar(out_dir: Path, inputs_dir: Path) -> bool:
+    out_dir = Path(out_dir)
+    with _travado(out_dir):
+        if fixado(out_dir) or _em_andamento(out_dir):
+            return False
+        shutil.rmtree(out_dir, ignore_errors=True)
+        shutil.rmtree(inputs_dir, ignore_errors=True)
+        return True
+
+
+# varredura
+
+def estado_runs(outputs: Path, inputs: Path) -> list[dict]:
+    """Um registro por run: idade, bytes (saída + entradas), arquivado, fixado, em andamento."""
+    agora = time.time()
+    runs = []
+    with os.scandir(outputs) as it:
+        pastas = [Path(e.path) for e in it if e.is_dir() and not e.name.startswith(".")]
+    for out_dir in pastas:
+        runs.append({
+            "run_id": out_dir.name,
+            "idade_s": agora - ultimo_uso(out_dir),
+            "bytes": tamanho_pasta(out_dir) + tamanho_pasta(Path(inputs) / out_dir.name),
+            "arquivado": (out_dir / ARQUIVADO_FILE).exists(),
+            "fixado": (out_dir / PIN_FILE).exists(),
+            "em_andamento": _em_andamento(out_dir),
+        })
+    return runs
+
+
+def _limpar_restos(outputs: Path, inputs: Path, agora: float) -> int:
+    """``*.tmp`` esquecidos nas pastas dos runs e uploads sem run; devolve os bytes liberados."""
+    liberado = 0
+    for p in Path(outputs).glob("*/*.tmp"):
+        mt = _mtime(p)
+        if mt is not None and agora - mt > RESTOS_APOS_S:
+            liberado += p.stat().st_size
+            p.unlink(missing_ok=True)
+    with os.scandir(inputs) as it:
+        orfaos = [Path(e.path) for e in it if e.is_dir() and not (Path(outputs) / e.name).exists()]
+    for p in orfaos:
+        mt = _mtime(p)
+        if mt is not None and agora - mt > RESTOS_APOS_S:
+            liberado += tamanho_pasta(p)
+            shutil.rmtree(p, ignore_errors=True)
+    return liberado
+
+
+def varrer(outputs: Path, inputs: Path, politica: Politica) -> dict:
+    """Aplica a política uma vez; devolve o que foi arquivado/apagado e os bytes antes/depois."""
+    outputs, inputs = Path(outputs), Path(inputs)
+    t0 = time.perf_counter()
+    runs = estado_runs(outputs, inputs)
+    antes = sum(r["bytes"] for r in runs)
+    arquivados, apagados = [], []
+
+    def _arquivar(r: dict) -> None:
+        info = arquivar(outputs / r["run_id"], inputs / r["run_id"])
+        if info is not None:
+            r["arquivado"], r["bytes"] = True, tamanho_pasta(outputs / r["run_id"])
+            arquivados.append(r["run_id"])
+
+    def _apagar(r: dict) -> None:
+        if apagar(outputs / r["run_id"], inputs / r["run_id"]):
+            r["apagado"], r["bytes"] = True, 0
+            apagados.append(r["run_id"])
+
+    livres = sorted((r for r in runs if not r["fixado"] and not r["em_andamento"]), key=lambda r: -r["idade_s"])
+    for r in livres:
+        if politica.apagar_apos_s and r["idade_s"] > politica.apagar_apos_s:
+            _apagar(r)
+        elif politica.arquivar_apos_s and r["idade_s"] > politica.arquivar_apos_s and not r["arquivado"]:
+            _arquivar(r)
+
+    if politica.max_bytes:
+        # mais antigos primeiro: compacta; se não bastar, apaga arquivados
+        for r in livres:
+            if sum(x["bytes"] for x in runs) <= politica.max_bytes:
+                break
+            if not r.get("apagado") and not r["arquivado"]:
+                _arquivar(r)
+        for r in livres:
+            if sum(x["bytes"] for x in runs) <= politica.max_bytes:
+                break
+            if not r.get("apagado") and r["arquivado"]:
+                _apagar(r)
+
+    restos = _limpar_restos(outputs, inputs, time.time())
+    depois = sum(r["bytes"] for r in runs)
+    return {
+        "finished_at": _agora(),
+        "seconds": round(time.perf_counter() - t0, 3),
+        "runs": len(runs),
+        "archived": arquivados,
+        "deleted": apagados,
+        "bytes_before": antes,
+        "bytes_after": depois,
+        "leftovers_freed": restos,
+    }
+
+
+def limpar_pasta(pasta: Path, max_idade_s: float = 0, max_bytes: int = 0) -> dict:
+    """Pasta plana (uploads, cache dos builders): apaga arquivos velhos e, acima de ``max_bytes``, os mais antigos (ocultos ficam)."""
+    arquivos = []
+    with os.scandir(pasta) as it:
+        for e in it:
+            if e.is_file(follow_symlinks=False) and not e.name.startswith("."):
+                st = e.stat(follow_symlinks=False)
+                arquivos.append((st.st_mtime, st.st_size, Path(e.path)))
+    arquivos.sort()
+    agora, total = time.time(), sum(a[1] for a in arquivos)
+    apagados = []
+    for mt, tam, p in arquivos:
+        velho = max_idade_s and agora - mt > max_idade_s
+        if not velho and not (max_bytes and total > max_bytes):
+            continue
+        p.unlink(missing_ok=True)
+        total -= tam
+        apagados.append(p.name)
+    return {"finished_at": _agora(), "deleted": apagados, "bytes_after": total}
+
+
+class Varredor:
+    """Thread que chama ``fn`` a cada ``intervalo_s`` (0 = desligado).
+
+    Com vários workers do uvicorn só um varre por vez (flock em ``trava``);
+    os outros pulam a rodada.
+    """
+
+    def __init__(self, intervalo_s: float, fn: Callable[[], dict], trava: Path | None = None):
+        self.intervalo_s = float(intervalo_s)
+        self.fn = fn
+        self.trava = Path(trava) if trava else None
+        self.ultimo: dict | None = None
+        self._parar = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def rodar(self) -> dict | None:
+        """Uma varredura agora; None se outro processo está varrendo."""
+        if self.trava is None or fcntl is None:
+            self.ultimo = self.fn()
+            return self.ultimo
+        with self.trava.open("a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+            try:
+                self.ultimo = self.fn()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return self.ultimo
+
+    def _loop(self) -> None:
+        while not self._parar.wait(self.intervalo_s):
+            try:
+                self.rodar()
+            except Exception:
+                traceback.print_exc()
+
+    def iniciar(self) -> None:
+        if self.intervalo_s <= 0 or self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name="retencao", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
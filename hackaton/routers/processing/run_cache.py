@@ -0,0 +1,100 @@
+"""Cache em memória dos DataFrames já carregados de cada run.
+
+Chave = (run_id, tabela, mtime do arquivo): se o arquivo do run for regravado
+a entrada antiga simplesmente deixa de ser usada. Despejo LRU por orçamento de
+bytes, medido com ``memory_usage(deep=True)``.
+
+Os objetos devolvidos são compartilhados entre requisições: quem usa NÃO pode
+alterar in-place (faça ``.copy()`` / ``assign`` antes).
+"""
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+def tamanho_bytes(obj: Any) -> int:
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sum(tamanho_bytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(tamanho_bytes(v) for v in obj)
+    # estruturas próprias (ex.: CuboLinhaDia) informam o próprio tamanho
+    return int(getattr(obj, "nbytes", 0))
+
+
+class RunDataCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._itens: OrderedDict[tuple, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, run_id: str, name: str, mtime: int | None, loader: Callable[[], Any]) -> Any:
+        key = (run_id, name, mtime)
+        with self._lock:
+            item = self._itens.get(key)
+            if item is not None:
+                self._itens.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+
+        # carrega fora do lock: leitura de disco não pode travar as outras requisições
+        valor = loader()
+        if valor is None:
+            return None
+        tam = tamanho_bytes(valor)
+
+        with self._lock:
+            # versão velha do mesmo arquivo (mtime diferente) sai na hora
+            for k in [k for k in self._itens if k[:2] == (run_id, name) and k != key]:
+                self._remover(k)
+            if tam > self.max_bytes:
+                return valor
+            if key in self._itens:
+                self._remover(key)
+            self._itens[key] = (valor, tam)
+            self.bytes += tam
+            while self.bytes > self.max_bytes and self._itens:
+                self._remover(next(iter(self._itens)))
+                self.evictions += 1
+        return valor
+
+    def _remover(self, key: tuple) -> None:
+        _, tam = self._itens.pop(key)
+        self.bytes -= tam
+
+    def invalidar(self, run_id: str) -> None:
+        with self._lock:
+            for k in [k for k in self._itens if k[0] == run_id]:
+                self._remover(k)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._itens),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (round(self.hits / total, 4) if total else None),
+            }
@@ -0,0 +1,175 @@
+"""Armazenamento colunar (Parquet) das tabelas de cada run.
+
+Os .xlsx continuam sendo só entregáveis para o auditor baixar. Tudo que os
+endpoints de leitura precisam (eventos e base agregada) vem daqui: tipado,
+comprimido e lido só com as colunas pedidas.
+"""
+import os
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EVENTOS_FILE = "eventos.parquet"
+AGREGADA_FILE = "agregada_dia_linha_pn.parquet"
+# dados das exportações secundárias (xlsx montado sob demanda)
+RASTREIO_FILE = "pn_rastreio.parquet"
+PN_COLISOES_FILE = "pn_colisoes.parquet"
+NC_LINHAS_FILE = "nc_linhas.parquet"
+NC_RAW_FILE = "nc_raw.parquet"
+LINHA_VARIACOES_FILE = "linha_variacoes.parquet"
+
+# Runs antigos (antes do Parquet) só têm os xlsx: (arquivo, aba)
+_LEGADO = {
+    EVENTOS_FILE: ("BASE_EVENTOS_LONG.xlsx", "EVENTOS"),
+    AGREGADA_FILE: ("BASE_AGREGADA_DIA_LINHA_PN.xlsx", "AGREGADA_DIA_LINHA_PN"),
+}
+
+COMPRESSION = "zstd"
+# row groups menores: leitura paginada/filtrada (event_stream) lê só os grupos que precisa
+LINHAS_POR_GRUPO = 100_000
+
+
+def _coluna_para_arrow(s: pd.Series) -> pd.Series:
+    """Colunas object vindas do Excel misturam str/int/float/date; o Arrow não aceita."""
+    if s.dtype != object:
+        return s
+    tipo = pd.api.types.infer_dtype(s, skipna=True)
+    if tipo in {"string", "empty"}:
+        return s
+    if tipo in {"date", "datetime", "datetime64"}:
+        return pd.to_datetime(s, errors="coerce")
+    # mixed / integer / floating em object -> texto, preservando os nulos
+    return s.where(s.isna(), s.astype(str))
+
+
+def _para_tabela(df: pd.DataFrame) -> pa.Table:
+    # cópia rasa: só troca colunas, a base de quem chamou não muda
+    df = df.copy(deep=False)
+    df.columns = [str(c).strip() for c in df.columns]
+    for c in df.columns:
+        df[c] = _coluna_para_arrow(df[c])
+    t = pa.Table.from_pandas(df, preserve_index=False)
+    # category -> texto no arquivo (o Parquet já codifica por dicionário): schema igual ao de runs antigos
+    for i, f in enumerate(t.schema):
+        if pa.types.is_dictionary(f.type):
+            t = t.set_column(i, pa.field(f.name, pa.string()), t.column(i).cast(pa.string()))
+    return t
+
+
+def _tmp(path: Path) -> Path:
+    # um por processo/thread: duas primeiras leituras do mesmo run legado convertem ao mesmo tempo
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def salvar_tabela(path: Path, df: pd.DataFrame) -> Path:
+    """Grava o DataFrame em Parquet de forma atômica (leitores nunca veem arquivo pela metade)."""
+    path = Path(path)
+    tmp = _tmp(path)
+    pq.write_table(_para_tabela(df), tmp, compression=COMPRESSION, row_group_size=LINHAS_POR_GRUPO)
+    os.replace(tmp, path)
+    return path
+
+
+def _no_schema(t: pa.Table, schema: pa.Schema) -> pa.Table:
+    """``t`` com as colunas/tipos de ``schema`` (coluna que falta vira nula); ArrowInvalid se não der."""
+    extras = set(t.column_names) - set(schema.names)
+    if extras:
+        raise pa.ArrowInvalid(f"colunas fora do schema: {', '.join(sorted(extras))}")
+    cols = [t.column(f.name) if f.name in t.column_names else pa.nulls(t.num_rows, f.type) for f in schema]
+    return pa.Table.from_arrays(cols, names=schema.names).cast(schema)
+
+
+def anexar_tabela(origem: Path, destino: Path, novas: pd.DataFrame, manter: Callable[[pa.Table], pa.Array] | None = None) -> Path:
+    """Grava em ``destino`` o Parquet ``origem`` (só as linhas em ``manter``) seguido de ``novas``.
+
+    A origem passa um row group por vez (memória = um row group). Se ``novas``
+    não couber no schema da origem, cai para ler tudo, concatenar e regravar.
+    """
+    origem, destino = Path(origem), Path(destino)
+    pf = pq.ParquetFile(origem)
+    try:
+        t_novas = _no_schema(_para_tabela(novas), pf.schema_arrow)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        antigas = pf.read().to_pandas()
+        if manter is not None:
+            antigas = antigas[manter(pa.Table.from_pandas(antigas, preserve_index=False)).to_numpy(zero_copy_only=False)]
+        return salvar_tabela(destino, pd.concat([antigas, novas], ignore_index=True))
+
+    tmp = _tmp(destino)
+    with pq.ParquetWriter(tmp, pf.schema_arrow, compression=COMPRESSION) as w:
+        for i in range(pf.num_row_groups):
+            t = pf.read_row_group(i)
+            if manter is not None:
+                t = t.filter(manter(t))
+            if t.num_rows:
+                w.write_table(t, row_group_size=LINHAS_POR_GRUPO)
+        if t_novas.num_rows:
+            w.write_table(t_novas, row_group_size=LINHAS_POR_GRUPO)
+    os.replace(tmp, destino)
+    return destino
+
+
+def salvar_run(out_dir: Path, eventos: pd.DataFrame, agregada: pd.DataFrame) -> None:
+    salvar_tabela(Path(out_dir) / EVENTOS_FILE, eventos)
+    salvar_tabela(Path(out_dir) / AGREGADA_FILE, agregada)
+
+
+def existe(out_dir: Path, name: str) -> bool:
+    out_dir = Path(out_dir)
+    if (out_dir / name).exists():
+        return True
+    legado = _LEGADO.get(name)
+    return bool(legado) and (out_dir / legado[0]).exists()
+
+
+def mtime(out_dir: Path, name: str) -> int | None:
+    """mtime do arquivo que vai ser lido (Parquet, ou o xlsx legado); chave do cache de leitura."""
+    out_dir = Path(out_dir)
+    legado = _LEGADO.get(name)
+    for p in [out_dir / name] + ([out_dir / legado[0]] if legado else []):
+        try:
+            return p.stat().st_mtime_ns
+        except OSError:
+            continue
+    return None
+
+
+def ler_tabela(out_dir: Path, name: str, columns: list[str] | None = None) -> pd.DataFrame | None:
+    """Lê uma tabela do run. Se o run for antigo, converte o xlsx uma vez e passa a usar o Parquet."""
+    out_dir = Path(out_dir)
+    p = out_dir / name
+    if not p.exists():
+        legado = _LEGADO.get(name)
+        if not legado or not (out_dir / legado[0]).exists():
+            return None
+        df = pd.read_excel(out_dir / legado[0], sheet_name=legado[1])
+        try:
+            salvar_tabela(p, df)
+        except (OSError, pa.ArrowException):
+            # sem permissão / tipo estranho: segue servindo do xlsx mesmo
+            df.columns = [str(c).strip() for c in df.columns]
+            return df[[c for c in columns if c in df.columns]] if columns else df
+    if columns:
+        schema_cols = set(pq.read_schema(p).names)
+        columns = [c for c in columns if c in schema_cols]
+    return pq.read_table(p, columns=columns).to_pandas()
+
+
+def caminho_parquet(out_dir: Path, name: str) -> Path | None:
+    """Caminho do Parquet da tabela (run antigo: converte o xlsx uma vez antes)."""
+    p = Path(out_dir) / name
+    if not p.exists():
+        ler_tabela(out_dir, name, columns=[])
+    return p if p.exists() else None
+
+
+def ler_eventos(out_dir: Path, columns: list[str] | None = None) -> pd.DataFrame | None:
+    return ler_tabela(out_dir, EVENTOS_FILE, columns)
+
+
+def ler_agregada(out_dir: Path, columns: list[str] | None = None) -> pd.DataFrame | None:
+    return ler_tabela(out_dir, AGREGADA_FILE, columns)
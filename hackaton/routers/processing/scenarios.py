@@ -0,0 +1,102 @@
+"""Cenários de pesos: N vetores de pesos -> N rankings de linhas numa chamada.
+
+O ranking do /api/top_linhas é ``Σ peso · componente / max(componente) · 100``
+com os pesos fixos de ``line_cube.PESOS_RANKING``. Aqui a matriz
+``linhas × componentes`` já normalizada (0–100) sai uma vez do cubo; os
+cenários viram a matriz ``componentes × cenários`` e todos os scores saem de
+um único produto de matrizes. O top de cada cenário sai por ``argpartition``
+no eixo das linhas, também de uma vez: cem cenários custam perto de um.
+
+Pesos de um cenário são normalizados para somar 1 (o score continua 0–100 e
+as classes de ``classe_linha`` continuam valendo); componente não informado
+pesa 0. O cenário com ``PESOS_RANKING`` dá o mesmo ranking do /api/top_linhas.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from .line_cube import C, METRICAS, CuboLinhaDia, componentes
+
+COMPONENTES = ("TOTAL_RECLAMACOES", *(m.removesuffix("_SUM") for m in METRICAS))
+MAX_CENARIOS = 1000
+
+
+class CenarioInvalido(ValueError):
+    """Lista de cenários mal formada, peso desconhecido, negativo, não numérico ou cenário sem peso nenhum."""
+
+
+def matriz_pesos(cenarios: list[dict]) -> tuple[np.ndarray, list[str]]:
+    """(componentes × cenários) com cada coluna somando 1, e o nome de cada cenário.
+
+    Cenário = ``{"name": ..., "weights": {componente: peso}}`` ou só o dict de pesos.
+    """
+    if not isinstance(cenarios, list):
+        raise CenarioInvalido("scenarios deve ser uma lista")
+    if not cenarios:
+        raise CenarioInvalido("informe ao menos um cenário")
+    if len(cenarios) > MAX_CENARIOS:
+        raise CenarioInvalido(f"no máximo {MAX_CENARIOS} cenários por chamada")
+    pos = {c: i for i, c in enumerate(COMPONENTES)}
+    w = np.zeros((len(COMPONENTES), len(cenarios)))
+    nomes = []
+    for j, cen in enumerate(cenarios):
+        if not isinstance(cen, dict):
+            raise CenarioInvalido(f"cenário {j}: esperado um objeto")
+        pesos = cen["weights"] if "weights" in cen else {k: v for k, v in cen.items() if k != "name"}
+        if not isinstance(pesos, dict):
+            raise CenarioInvalido(f"cenário {j}: weights deve ser um objeto")
+        for nome, peso in pesos.items():
+            if nome not in pos:
+                raise CenarioInvalido(f"cenário {j}: componente desconhecido {nome!r} (use: {', '.join(COMPONENTES)})")
+            try:
+                peso = float(peso)
+            except (TypeError, ValueError):
+                raise CenarioInvalido(f"cenário {j}: peso de {nome} não é número") from None
+            if not math.isfinite(peso) or peso < 0:
+                raise CenarioInvalido(f"cenário {j}: peso de {nome} deve ser >= 0")
+            w[pos[nome], j] = peso
+        soma = w[:, j].sum()
+        if soma <= 0:
+            raise CenarioInvalido(f"cenário {j}: todos os pesos são zero")
+        w[:, j] /= soma
+        nomes.append(str(cen.get("name") or f"cenario_{j + 1}"))
+    return w, nomes
+
+
+def matriz_normalizada(tot: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Linhas presentes no período e a matriz (linhas × componentes), cada coluna 0–100 pelo máximo."""
+    presentes = np.flatnonzero(tot[:, C["N_REGISTROS"]] > 0)
+    comp = componentes(tot[presentes])
+    bruto = np.column_stack([comp[c] for c in COMPONENTES]) if presentes.size else np.zeros((0, len(COMPONENTES)))
+    mx = bruto.max(axis=0) if presentes.size else np.zeros(len(COMPONENTES))
+    # componente zerado em todas as linhas não pontua (como no ranking)
+    escala = np.divide(100.0, mx, out=np.zeros_like(mx, dtype=np.float64), where=mx > 0)
+    return presentes, bruto * escala
+
+
+def pontuar(tot: np.ndarray, w: np.ndarray, limit: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Top ``limit`` de cada cenário: linhas presentes e (posições nelas, scores), ambos (k × cenários).
+
+    Desempate igual ao ranking: ordem alfabética da LINHA (a do cubo).
+    """
+    presentes, norm = matriz_normalizada(tot)
+    n_l = len(presentes)
+    if n_l == 0:
+        vazio = np.zeros((0, w.shape[1]))
+        return presentes, vazio.astype(np.int64), vazio
+    scores = (norm @ w).round(2)                      # (linhas × cenários)
+    k = min(max(1, int(limit)), n_l)
+    top = np.argpartition(-scores, k - 1, axis=0)[:k] if k < n_l else np.broadcast_to(np.arange(n_l)[:, None], scores.shape)
+    # posições crescentes + sort estável por -score = empate fica na ordem alfabética
+    top = np.sort(top, axis=0)
+    sc = np.take_along_axis(scores, top, axis=0)
+    ordem = np.argsort(-sc, axis=0, kind="stable")
+    return presentes, np.take_along_axis(top, ordem, axis=0), np.take_along_axis(sc, ordem, axis=0)
+
+
+def linhas_do_top(cubo: CuboLinhaDia, tot: np.ndarray, presentes: np.ndarray, top: np.ndarray) -> pd.DataFrame:
+    """Componentes do período de cada LINHA que aparece em algum top (uma vez só)."""
+    idx = np.unique(top)
+    comp = componentes(tot[presentes[idx]])
+    return pd.DataFrame({"LINHA": cubo.linhas[presentes[idx]], **{c: comp[c] for c in COMPONENTES}})
@@ -0,0 +1,55 @@
+"""Tipos compactos das bases do run (eventos e agregada).
+
+As colunas de texto repetitivo (TIPO, LINHA, PN_LIMPO, STATUS...) vinham
+como ``object``: um objeto Python por linha. Aqui elas viram ``category``
+(códigos int8/int16 + um dicionário) e os contadores/flags viram o menor
+inteiro que cabe. É aplicado na construção (``_events`` / ``agregar_eventos``)
+e a agregada soma direto sobre os códigos (ver ``pipeline._somar_por_celula``).
+
+No Parquet as categorias são gravadas como texto (ver run_store): o arquivo
+já é codificado por dicionário e o schema não muda entre runs.
+"""
+import numpy as np
+import pandas as pd
+
+CATEGORICAS_EVENTOS = ("TIPO", "LINHA", "LINHA_ORIGINAL", "PN_LIMPO", "STATUS", "Q14")
+INTEIROS_EVENTOS = ("FREQ", "FLAG_RISCO_OCULTO")
+CONTADORES_AGREGADA = ("REF_FREQ_SUM", "REC_FORMAL_SUM", "REC_INFORMAL_SUM", "NC_TOTAL_SUM", "NC_ABERTA_SUM", "NC_VENCIDA_SUM")
+
+
+def categoria(s: pd.Series) -> pd.Series:
+    """Texto -> category. Coluna do Excel com tipos misturados vira texto antes (nulos preservados)."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        return s
+    if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) not in {"string", "empty"}:
+        s = s.where(s.isna(), s.astype(str))
+    return s.astype("category")
+
+
+def inteiro_compacto(s: pd.Series) -> pd.Series:
+    """Menor inteiro que cabe; com nulo ou fração fica como número (float64) mesmo."""
+    n = pd.to_numeric(s, errors="coerce")
+    if n.isna().any():
+        return n
+    return pd.to_numeric(n, downcast="integer")
+
+
+def compactar_eventos(eventos: pd.DataFrame) -> pd.DataFrame:
+    """Troca as colunas da base de eventos pelas versões compactas (altera ``eventos``)."""
+    for c in CATEGORICAS_EVENTOS:
+        if c in eventos:
+            eventos[c] = categoria(eventos[c])
+    for c in INTEIROS_EVENTOS:
+        if c in eventos:
+            eventos[c] = inteiro_compacto(eventos[c])
+    if "QTD" in eventos:
+        eventos["QTD"] = inteiro_compacto(eventos["QTD"])
+    return eventos
+
+
+def compactar_agregada(agregada: pd.DataFrame) -> pd.DataFrame:
+    """Contadores da agregada em int32 (a soma vem em int64); REF_QTD_SUM fica float64."""
+    for c in CONTADORES_AGREGADA:
+        if c in agregada:
+            agregada[c] = agregada[c].astype(np.int32)
+    return agregada
@@ -0,0 +1,350 @@
+"""Índice das descrições dos eventos do run, para o chat.
+
+Duas estruturas, gravadas juntas em ``indice_descricoes.npz``:
+
+- postings LINHA → dia → descrição: uma linha por combinação
+  (LINHA, dia, descrição) com a contagem, ordenadas nessa ordem e com
+  ponteiros por LINHA. "Principais motivos da linha X no período" vira uma
+  fatia da LINHA, uma busca binária no dia e a soma de uma lista pequena;
+- índice invertido token → descrições (sem acento, minúsculo), para a busca
+  por palavra-chave ("onde aparece 'vazamento'?"). Cada termo da consulta casa
+  por prefixo ("vaza" acha "vazamento"); vários termos = todos precisam estar.
+
+Os textos (descrições e vocabulário) ficam num único blob utf-8 + offsets,
+sem pickle e sem o custo de largura fixa de array de string do NumPy.
+
+O run incremental não volta aos eventos do pai: ``atualizar_indice`` soma as
+postings do delta às do índice do pai e só tokeniza as descrições novas.
+"""
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+INDICE_FILE = "indice_descricoes.npz"
+
+# dia das postings: dias desde 1970-01-01; evento sem data vai para o fim
+SEM_DIA = np.iinfo(np.int32).max
+
+_RE_TOKEN = re.compile(r"[a-z0-9]{2,}")
+_RE_ASPAS = re.compile(r"[\"'“”‘’«»]([^\"'“”‘’«»]+)[\"'“”‘’«»]")
+# só no começo da mensagem ("buscar vazamento", "pode procurar por trinca"): "linhas
+# mais críticas na pesquisa do mês" é pergunta de ranking, não busca
+_RE_BUSCA = re.compile(
+    r"^\s*(?:(?:por favor|pode|poderia|me)[\s,]+)*(?:onde aparece|onde tem|buscar?|procurar?|pesquisar?)\b\s*(?:por\s+)?[:\-]?\s*(.+)",
+    re.IGNORECASE,
+)
+
+
+def normalizar(texto: str) -> str:
+    """minúsculo e sem acento ("Vazamento de ÓLEO" -> "vazamento de oleo")."""
+    nfkd = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in nfkd if not unicodedata.combining(c))
+
+
+def tokens(texto: str) -> list[str]:
+    return _RE_TOKEN.findall(normalizar(texto))
+
+
+def termo_busca(mensagem: str) -> str | None:
+    """Termo de uma pergunta de busca: o que está entre aspas ou depois de "onde aparece"/"buscar" no início."""
+    m = _RE_ASPAS.search(mensagem)
+    if m and m.group(1).strip():
+        return m.group(1).strip()
+    m = _RE_BUSCA.match(mensagem)
+    if m:
+        termo = m.group(1).strip(" ?!.")
+        return termo or None
+    return None
+
+
+def _dia(s: pd.Series) -> np.ndarray:
+    d = pd.to_datetime(s, errors="coerce").to_numpy(dtype="datetime64[D]")
+    out = d.astype(np.int64)
+    out[np.isnat(d)] = SEM_DIA
+    return out.astype(np.int32)
+
+
+def _dia_ts(dia: int) -> pd.Timestamp:
+    return pd.Timestamp(np.datetime64(int(dia), "D"))
+
+
+def _dias(start: pd.Timestamp | None, end: pd.Timestamp | None) -> tuple[int, int]:
+    """[start, end] em dias -> intervalo semiaberto [i, j) comparável com as postings."""
+    i = np.iinfo(np.int32).min if start is None else int(np.datetime64(pd.Timestamp(start).normalize(), "D").astype(np.int64))
+    j = SEM_DIA if end is None else int(np.datetime64(pd.Timestamp(end).normalize(), "D").astype(np.int64)) + 1
+    return i, j
+
+
+def _empacotar(textos: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    partes = [t.encode("utf-8") for t in textos]
+    offsets = np.zeros(len(partes) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in partes], out=offsets[1:])
+    return np.frombuffer(b"".join(partes), dtype=np.uint8), offsets
+
+
+def _desempacotar(blob: np.ndarray, offsets: np.ndarray) -> list[str]:
+    b = blob.tobytes()
+    return [b[offsets[k]:offsets[k + 1]].decode("utf-8") for k in range(len(offsets) - 1)]
+
+
+@dataclass
+class IndiceDescricoes:
+    linhas: list[str]            # LINHA em maiúsculas, ordenadas
+    linha_ptr: np.ndarray        # postings da LINHA k: [linha_ptr[k], linha_ptr[k + 1])
+    dia: np.ndarray              # int32, crescente dentro de cada LINHA
+    desc: np.ndarray             # int32, id em ``descricoes``
+    n: np.ndarray                # int32, eventos da combinação
+    descricoes: list[str]
+    vocab: list[str]             # tokens ordenados
+    tok_ptr: np.ndarray          # descrições do token t: tok_desc[tok_ptr[t]:tok_ptr[t + 1]]
+    tok_desc: np.ndarray
+    desc_ord: np.ndarray         # postings da descrição x: desc_ord[desc_ptr[x]:desc_ptr[x + 1]]
+    desc_ptr: np.ndarray
+    _pos: dict[str, int] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        self._pos = {lin: k for k, lin in enumerate(self.linhas)}
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.linha_ptr, self.dia, self.desc, self.n, self.tok_ptr, self.tok_desc, self.desc_ord, self.desc_ptr)
+        textos = sum(len(t) for t in self.descricoes) + sum(len(t) for t in self.vocab) + sum(len(t) for t in self.linhas)
+        return int(sum(a.nbytes for a in arrays) + textos)
+
+    def _contar(self, desc: np.ndarray, n: np.ndarray, k: int) -> list[tuple[str, int]]:
+        if desc.size == 0:
+            return []
+        ids, inv = np.unique(desc, return_inverse=True)
+        tot = np.bincount(inv, weights=n).astype(np.int64)
+        # mais frequentes primeiro; empate: ordem em que a descrição apareceu na base
+        ordem = np.lexsort((ids, -tot))[:k]
+        return [(self.descricoes[ids[o]], int(tot[o])) for o in ordem]
+
+    def top_descricoes(self, linha: str, start: pd.Timestamp | None = None, end: pd.Timestamp | None = None, k: int = 5) -> list[tuple[str, int]]:
+        """Descrições mais frequentes da LINHA no período, com a contagem."""
+        pos = self._pos.get(str(linha).upper())
+        if pos is None:
+            return []
+        a, b = int(self.linha_ptr[pos]), int(self.linha_ptr[pos + 1])
+        if start is not None or end is not None:
+            i, j = _dias(start, end)
+            dias = self.dia[a:b]
+            a, b = a + int(np.searchsorted(dias, i, "left")), a + int(np.searchsorted(dias, j, "left"))
+        return self._contar(self.desc[a:b], self.n[a:b], k)
+
+    def descricoes_com(self, consulta: str) -> np.ndarray:
+        """ids das descrições que têm todos os termos da consulta (cada termo casa por prefixo)."""
+        termos = tokens(consulta)
+        if not termos:
+            return np.empty(0, dtype=np.int32)
+        ids = None
+        for t in termos:
+            lo, hi = bisect_left(self.vocab, t), bisect_left(self.vocab, t + "\uffff")
+            achados = np.unique(self.tok_desc[self.tok_ptr[lo]:self.tok_ptr[hi]])
+            ids = achados if ids is None else np.intersect1d(ids, achados, assume_unique=True)
+            if ids.size == 0:
+                break
+        return ids
+
+    def buscar(self, consulta: str, start: pd.Timestamp | None = None, end: pd.Timestamp | None = None, k: int = 5) -> dict:
+        """Onde a consulta aparece no período: total, linhas, descrições e primeira/última data."""
+        ids = self.descricoes_com(consulta)
+        # junta as listas de postings das descrições achadas (custo ~ nº de ocorrências, não da base)
+        ini, tam = self.desc_ptr[ids], self.desc_ptr[ids + 1] - self.desc_ptr[ids]
+        total = int(tam.sum())
+        pos = np.repeat(ini - np.cumsum(tam) + tam, tam) + np.arange(total)
+        sel = self.desc_ord[pos]
+        if start is not None or end is not None:
+            i, j = _dias(start, end)
+            sel = sel[(self.dia[sel] >= i) & (self.dia[sel] < j)]
+        if sel.size == 0:
+            return {"termos": tokens(consulta), "total": 0, "n_linhas": 0, "linhas": [], "descricoes": [], "primeira": None, "ultima": None}
+
+        lin = np.searchsorted(self.linha_ptr, sel, side="right") - 1
+        por_linha = np.bincount(lin, weights=self.n[sel], minlength=len(self.linhas)).astype(np.int64)
+        top_l = np.flatnonzero(por_linha)
+        top_l = top_l[np.lexsort((top_l, -por_linha[top_l]))][:k]
+        dias = self.dia[sel]
+        dias = dias[dias != SEM_DIA]
+        return {
+            "termos": tokens(consulta),
+            "total": int(self.n[sel].sum()),
+            "n_linhas": int(np.count_nonzero(por_linha)),
+            "linhas": [(self.linhas[p], int(por_linha[p])) for p in top_l],
+            "descricoes": self._contar(self.desc[sel], self.n[sel], k),
+            "primeira": (_dia_ts(dias.min()) if dias.size else None),
+            "ultima": (_dia_ts(dias.max()) if dias.size else None),
+        }
+
+
+def construir_indice(eventos: pd.DataFrame) -> IndiceDescricoes:
+    txt = eventos["DESCRICAO"].fillna("").astype(str) if "DESCRICAO" in eventos else pd.Series("", index=eventos.index)
+    ok = (txt.str.strip() != "").to_numpy()
+    txt = txt[ok]
+    linha = eventos["LINHA"].astype(str).str.upper()[ok]
+
+    dcod, descricoes = pd.factorize(txt)
+    lcod, linhas = pd.factorize(linha, sort=True)
+    post = (
+        pd.DataFrame({"l": lcod, "d": _dia(eventos["DATA_EVENTO"][ok]), "x": dcod.astype(np.int32)})
+        .groupby(["l", "d", "x"], sort=True)
+        .size()
+        .reset_index(name="n")
+    )
+    l = post["l"].to_numpy()
+    linha_ptr = np.searchsorted(l, np.arange(len(linhas) + 1), side="left").astype(np.int64)
+
+    # token -> descrições, montado só sobre as descrições únicas
+    pares = (
+        pd.Series([tokens(d) for d in descricoes], dtype=object)
+        .explode()
+        .dropna()
+        .rename("tok")
+        .rename_axis("x")
+        .reset_index()
+        .drop_duplicates()
+        .sort_values(["tok", "x"], kind="stable")
+    )
+    vocab, tcod = np.unique(pares["tok"].to_numpy(dtype=str), return_inverse=True) if len(pares) else (np.array([], dtype=str), np.array([], dtype=np.int64))
+    tok_ptr = np.searchsorted(tcod, np.arange(len(vocab) + 1), side="left").astype(np.int64)
+
+    desc = post["x"].to_numpy(dtype=np.int32)
+    desc_ord = np.argsort(desc, kind="stable").astype(np.int32)
+
+    return IndiceDescricoes(
+        linhas=[str(x) for x in linhas],
+        linha_ptr=linha_ptr,
+        dia=post["d"].to_numpy(dtype=np.int32),
+        desc=desc,
+        n=post["n"].to_numpy(dtype=np.int32),
+        descricoes=[str(x) for x in descricoes],
+        vocab=[str(x) for x in vocab],
+        tok_ptr=tok_ptr,
+        tok_desc=pares["x"].to_numpy(dtype=np.int32),
+        desc_ord=desc_ord,
+        desc_ptr=np.searchsorted(desc[desc_ord], np.arange(len(descricoes) + 1), side="left").astype(np.int64),
+    )
+
+
+def _postings_eventos(eventos: pd.DataFrame) -> pd.DataFrame:
+    """(LINHA, d, DESCRICAO, n) dos eventos, com os mesmos filtros de ``construir_indice``."""
+    txt = eventos["DESCRICAO"].fillna("").astype(str) if "DESCRICAO" in eventos else pd.Series("", index=eventos.index)
+    ok = (txt.str.strip() != "").to_numpy()
+    return (
+        pd.DataFrame({
+            "LINHA": eventos["LINHA"].astype(str).str.upper()[ok].to_numpy(),
+            "d": _dia(eventos["DATA_EVENTO"][ok]),
+            "DESCRICAO": txt[ok].to_numpy(),
+        })
+        .groupby(["LINHA", "d", "DESCRICAO"], sort=False)
+        .size()
+        .reset_index(name="n")
+    )
+
+
+def atualizar_indice(idx: IndiceDescricoes, somar: pd.DataFrame, subtrair: pd.DataFrame | None = None) -> IndiceDescricoes:
+    """``idx`` + os eventos ``somar`` - os eventos ``subtrair``, sem os eventos que já estão em ``idx``.
+
+    As descrições novas entram depois das do índice (a ordem de aparição, que
+    desempata as contagens, continua valendo) e só elas são tokenizadas; o
+    resto é remapear códigos e reordenar postings. Combinação que zera sai.
+    """
+    partes = [_postings_eventos(somar)]
+    if subtrair is not None and len(subtrair):
+        menos = _postings_eventos(subtrair)
+        partes.append(menos.assign(n=-menos["n"]))
+    delta = pd.concat(partes, ignore_index=True)
+
+    base = pd.Index(idx.descricoes)
+    cand = pd.unique(delta["DESCRICAO"].to_numpy(dtype=object))
+    novas = [str(d) for d in cand[base.get_indexer(cand) < 0]]
+    descricoes = idx.descricoes + novas
+    x_delta = pd.Index(descricoes).get_indexer(delta["DESCRICAO"]).astype(np.int32)
+
+    linhas = np.unique(np.concatenate([np.asarray(idx.linhas, dtype=str), delta["LINHA"].to_numpy(dtype=str)]))
+    l_pai = np.repeat(np.searchsorted(linhas, np.asarray(idx.linhas, dtype=str)), np.diff(idx.linha_ptr))
+    # postings fora das fatias das linhas (LINHA nula) não aparecem em consulta nenhuma e ficam de fora
+    pai = slice(int(idx.linha_ptr[0]), int(idx.linha_ptr[-1]))
+    l = np.concatenate([l_pai, np.searchsorted(linhas, delta["LINHA"].to_numpy(dtype=str))])
+    d = np.concatenate([idx.dia[pai], delta["d"].to_numpy(dtype=np.int32)])
+    x = np.concatenate([idx.desc[pai], x_delta])
+    n = np.concatenate([idx.n[pai].astype(np.int64), delta["n"].to_numpy(dtype=np.int64)])
+
+    # soma por (LINHA, dia, descrição) na ordem das postings
+    ordem = np.lexsort((x, d, l))
+    l, d, x, n = l[ordem], d[ordem], x[ordem], n[ordem]
+    inicio = np.ones(len(l), dtype=bool)
+    inicio[1:] = (l[1:] != l[:-1]) | (d[1:] != d[:-1]) | (x[1:] != x[:-1])
+    n = np.add.reduceat(n, np.flatnonzero(inicio)) if len(l) else n
+    l, d, x = l[inicio], d[inicio], x[inicio]
+    ficam = n > 0
+    l, d, x, n = l[ficam], d[ficam], x[ficam], n[ficam]
+
+    # token -> descrições: as do pai (remapeadas para o vocabulário novo) + as das descrições novas
+    pares_novos = [(t, len(idx.descricoes) + k) for k, dsc in enumerate(novas) for t in set(tokens(dsc))]
+    vocab = np.unique(np.asarray(idx.vocab + [t for t, _ in pares_novos], dtype=str))
+    t_pai = np.searchsorted(vocab, np.asarray(idx.vocab, dtype=str))
+    t = np.concatenate([
+        np.repeat(t_pai, np.diff(idx.tok_ptr)),
+        np.searchsorted(vocab, np.asarray([t for t, _ in pares_novos], dtype=str)),
+    ]).astype(np.int64)
+    tok_desc = np.concatenate([idx.tok_desc, np.asarray([k for _, k in pares_novos], dtype=np.int32)])
+    ordem = np.lexsort((tok_desc, t))
+    t, tok_desc = t[ordem], tok_desc[ordem]
+
+    desc = x.astype(np.int32)
+    desc_ord = np.argsort(desc, kind="stable").astype(np.int32)
+    return IndiceDescricoes(
+        linhas=[str(v) for v in linhas],
+        linha_ptr=np.searchsorted(l, np.arange(len(linhas) + 1), side="left").astype(np.int64),
+        dia=d.astype(np.int32),
+        desc=desc,
+        n=n.astype(np.int32),
+        descricoes=descricoes,
+        vocab=[str(v) for v in vocab],
+        tok_ptr=np.searchsorted(t, np.arange(len(vocab) + 1), side="left").astype(np.int64),
+        tok_desc=tok_desc.astype(np.int32),
+        desc_ord=desc_ord,
+        desc_ptr=np.searchsorted(desc[desc_ord], np.arange(len(descricoes) + 1), side="left").astype(np.int64),
+    )
+
+
+def salvar_indice(out_dir: Path, idx: IndiceDescricoes) -> Path:
+    path = Path(out_dir) / INDICE_FILE
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    desc_blob, desc_off = _empacotar(idx.descricoes)
+    voc_blob, voc_off = _empacotar(idx.vocab)
+    lin_blob, lin_off = _empacotar(idx.linhas)
+    with tmp.open("wb") as f:
+        np.savez(
+            f,
+            linha_ptr=idx.linha_ptr, dia=idx.dia, desc=idx.desc, n=idx.n,
+            tok_ptr=idx.tok_ptr, tok_desc=idx.tok_desc,
+            desc_ord=idx.desc_ord, desc_ptr=idx.desc_ptr,
+            desc_blob=desc_blob, desc_off=desc_off,
+            voc_blob=voc_blob, voc_off=voc_off,
+            lin_blob=lin_blob, lin_off=lin_off,
+        )
+    os.replace(tmp, path)
+    return path
+
+
+def ler_indice(out_dir: Path) -> IndiceDescricoes | None:
+    path = Path(out_dir) / INDICE_FILE
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as z:
+        return IndiceDescricoes(
+            linhas=_desempacotar(z["lin_blob"], z["lin_off"]),
+            linha_ptr=z["linha_ptr"], dia=z["dia"], desc=z["desc"], n=z["n"],
+            descricoes=_desempacotar(z["desc_blob"], z["desc_off"]),
+            vocab=_desempacotar(z["voc_blob"], z["voc_off"]),
+            tok_ptr=z["tok_ptr"], tok_desc=z["tok_desc"],
+            desc_ord=z["desc_ord"], desc_ptr=z["desc_ptr"],
+        )
@@ -6,4 +6,38 @@ class Settings(BaseSettings):
     )
 
     DATABASE_URL : str = ''
-    SECRETY_KEY : str = ''
\ No newline at end of file
+    SECRETY_KEY : str = ''
+
+    # Pasta de uploads/runs/histórico do app de auditoria (vazio = hackaton/storage)
+    STORAGE_DIR : str = ''
+
+    # Cache em memória das bases carregadas por run (app de auditoria)
+    RUN_CACHE_MAX_BYTES : int = 256 * 1024 * 1024
+
+    # Fila de processamento (/process e /api/process)
+    JOBS_MAX_WORKERS : int = 2
+    JOBS_MAX_PENDING : int = 8
+    # /process (página HTML) espera o run no máximo isso; depois responde 504
+    JOBS_ESPERA_MAX_S : int = 1800
+
+    # Processos para gravar os xlsx do run em paralelo
+    EXPORT_MAX_WORKERS : int = 4
+
+    # Leitura das planilhas de entrada (os dois builders em paralelo, cache por sha256);
+    # mais que 2 não ajuda, ver processing/ingest.py
+    INGEST_MAX_WORKERS : int = 2
+
+    # Retenção do storage (0 = desligado): compacta runs sem acesso há N dias,
+    # apaga depois de N dias, e limita o total de outputs + inputs
+    RETENCAO_ARQUIVAR_DIAS : float = 30
+    RETENCAO_APAGAR_DIAS : float = 0
+    RETENCAO_MAX_BYTES : int = 0
+    RETENCAO_INTERVALO_S : int = 3600
+    # cache de leitura das planilhas (storage/cache/ingest): entrada sem uso há
+    # RETENCAO_ARQUIVAR_DIAS sai, e o total fica abaixo disso (0 = sem limite)
+    RETENCAO_CACHE_MAX_BYTES : int = 0
+
+    # Uploads de /files (hackaton/uploads): apaga os de mais de N dias e os mais
+    # antigos acima de UPLOADS_MAX_BYTES (0 = desligado; apagar é sempre opt-in)
+    UPLOADS_RETENCAO_DIAS : float = 0
+    UPLOADS_MAX_BYTES : int = 0
@@ -0,0 +1,189 @@
+"""Run incremental == run completo sobre as mesmas entradas somadas.
+
+Cada etapa do delta (agregada, cubo, índice de descrições, variações de LINHA)
+junta o resultado do pai com o dos eventos novos; aqui o resultado dessa junção
+é comparado com o da etapa do run completo sobre a base inteira.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from hackaton.routers.processing.line_collisions import somar_variacoes, variacoes_linha
+from hackaton.routers.processing.line_cube import METRICAS, atualizar_cubo, construir_cubo
+from hackaton.routers.processing.text_index import atualizar_indice, construir_indice
+
+LINHAS = ["L01", "L02", "L03", "L04", "linha 5"]
+DESCRICOES = ["vazamento na solda", "risco na pintura", "peca amassada", "solda fria", "pintura manchada", ""]
+TIPOS = ["REFUGO", "RECLAMACAO_FORMAL", "RECLAMACAO_INFORMAL"]
+
+PERIODOS = [
+    (None, None),
+    (pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-31")),
+    (pd.Timestamp("2024-02-10"), pd.Timestamp("2024-03-05")),
+    (pd.Timestamp("2024-03-20"), None),
+    (None, pd.Timestamp("2024-02-01")),
+]
+
+
+def _eventos(seed: int, n: int, tipos: list[str] = TIPOS, linhas: list[str] = LINHAS) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    linha = rng.choice(linhas, n)
+    datas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 100, n), "D")
+    ev = pd.DataFrame({
+        "TIPO": rng.choice(tipos, n),
+        "DATA_EVENTO": pd.Series(datas).where(rng.random(n) > 0.03),
+        "LINHA_ORIGINAL": [f"{lin}{sufixo}" for lin, sufixo in zip(linha, rng.choice(["", " ", "-A", "/b"], n))],
+        "LINHA": linha,
+        "PN_ORIGINAL": [f"pn {k}" for k in rng.integers(0, 40, n)],
+        "PN_LIMPO": [f"PN{k}" for k in rng.integers(0, 40, n)],
+        "DESCRICAO": rng.choice(DESCRICOES, n),
+        "QTD": rng.integers(1, 20, n).astype(np.float64),
+    })
+    ev["CLOSING_DATE"] = pd.NaT
+    ev["DUE_DATE"] = pd.NaT
+    return ev
+
+
+def _nc(seed: int, n: int) -> pd.DataFrame:
+    ev = _eventos(seed, n, tipos=["NC_AUDITORIA"])
+    rng = np.random.default_rng(seed + 1)
+    ev["CLOSING_DATE"] = (ev["DATA_EVENTO"] + pd.Timedelta(days=5)).where(rng.random(n) > 0.5)
+    ev["DUE_DATE"] = ev["DATA_EVENTO"] + pd.to_timedelta(rng.integers(1, 60, n), "D")
+    return ev
+
+
+def _agregada_sintetica(seed: int, n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    datas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 100, n), "D")
+    ag = pd.DataFrame({
+        "DATA": pd.Series(datas).where(rng.random(n) > 0.05),
+        "LINHA": rng.choice(LINHAS, n),
+        "PN_LIMPO": [f"PN{k}" for k in rng.integers(0, 40, n)],
+    })
+    for m in METRICAS:
+        ag[m] = rng.integers(0, 5, n)
+    return ag.drop_duplicates(["DATA", "LINHA", "PN_LIMPO"], ignore_index=True)
+
+
+def _totais(cubo, start, end) -> pd.DataFrame:
+    """Totais do período por LINHA, sem as linhas que não têm nada (o delta guarda linhas zeradas)."""
+    t = pd.DataFrame(cubo.totais(start, end), index=cubo.linhas.astype(str))
+    return t[(t != 0).any(axis=1)].sort_index()
+
+
+def _assert_cubos_iguais(delta, completo):
+    np.testing.assert_array_equal(np.unique(delta.dias), completo.dias)
+    for start, end in PERIODOS:
+        pd.testing.assert_frame_equal(_totais(delta, start, end), _totais(completo, start, end))
+
+
+# cubo LINHA × dia
+
+def test_cubo_atualizado_igual_ao_completo():
+    pai = _agregada_sintetica(0, 400)
+    # células que o delta toca: umas mudam de valor, outras zeram, outras são novas
+    antes = pai.sample(60, random_state=1)
+    depois = antes.copy()
+    depois[list(METRICAS)] = depois[list(METRICAS)] + 3
+    depois = depois.iloc[20:]
+    novas = _agregada_sintetica(7, 80)
+    novas["DATA"] = novas["DATA"] + pd.Timedelta(days=150)
+    novas["LINHA"] = novas["LINHA"].replace("L04", "L99")
+    depois = pd.concat([depois, novas], ignore_index=True)
+
+    completo = pd.concat([pai.drop(index=antes.index), depois], ignore_index=True)
+    delta = atualizar_cubo(construir_cubo(pai), depois, antes)
+    _assert_cubos_iguais(delta, construir_cubo(completo))
+
+
+def test_cubo_atualizado_so_soma():
+    a, b = _agregada_sintetica(2, 300), _agregada_sintetica(3, 300)
+    delta = atualizar_cubo(construir_cubo(a), b)
+    _assert_cubos_iguais(delta, construir_cubo(pd.concat([a, b], ignore_index=True)))
+
+
+# índice de descrições
+
+def _top(idx, start, end) -> dict:
+    # contagens por descrição; a ordem de desempate depende da ordem de aparição, que o delta não refaz
+    return {lin: sorted(idx.top_descricoes(lin, start, end, k=len(DESCRICOES))) for lin in idx.linhas}
+
+
+def _busca(idx, consulta, start, end) -> dict:
+    r = idx.buscar(consulta, start, end, k=len(LINHAS) + 1)
+    return {**r, "linhas": sorted(r["linhas"]), "descricoes": sorted(r["descricoes"])}
+
+
+def _assert_indices_iguais(delta, completo):
+    for start, end in PERIODOS:
+        assert {k: v for k, v in _top(delta, start, end).items() if v} == {k: v for k, v in _top(completo, start, end).items() if v}
+        for consulta in ("solda", "pint", "peca amassada", "inexistente"):
+            assert _busca(delta, consulta, start, end) == _busca(completo, consulta, start, end)
+
+
+def test_indice_atualizado_igual_ao_completo():
+    pai, novos = _eventos(0, 800), _eventos(1, 300, linhas=LINHAS + ["L99"])
+    delta = atualizar_indice(construir_indice(pai), novos)
+    _assert_indices_iguais(delta, construir_indice(pd.concat([pai, novos], ignore_index=True)))
+
+
+def test_indice_atualizado_com_troca_de_nc():
+    pai, novos = _eventos(0, 800), _eventos(1, 300)
+    nc_pai, nc_nova = _nc(2, 120), _nc(3, 90)
+    idx_pai = construir_indice(pd.concat([pai, nc_pai], ignore_index=True))
+    delta = atualizar_indice(idx_pai, pd.concat([novos, nc_nova], ignore_index=True), nc_pai)
+    _assert_indices_iguais(delta, construir_indice(pd.concat([pai, novos, nc_nova], ignore_index=True)))
+
+
+# variações de LINHA
+
+def test_variacoes_somadas_iguais_as_da_base_inteira():
+    a, b, c = _eventos(0, 700), _eventos(1, 200), _eventos(2, 50, linhas=["L99"])
+    somadas = somar_variacoes(variacoes_linha(a), variacoes_linha(b), variacoes_linha(c))
+    pd.testing.assert_frame_equal(somadas, variacoes_linha(pd.concat([a, b, c], ignore_index=True)), check_dtype=False)
+
+
+# agregada (precisa do pipeline inteiro)
+
+def _normalizar_agregada(ag: pd.DataFrame) -> pd.DataFrame:
+    ag = ag.copy()
+    ag["DATA"] = pd.to_datetime(ag["DATA"], errors="coerce")
+    for c in ("LINHA", "PN_LIMPO"):
+        ag[c] = ag[c].astype(object).astype(str)
+    for c in METRICAS:
+        ag[c] = ag[c].astype(np.float64)
+    return ag.sort_values(["DATA", "LINHA", "PN_LIMPO"], na_position="last", ignore_index=True)
+
+
+def test_agregada_atualizada_igual_a_completa():
+    delta = pytest.importorskip("hackaton.routers.processing.delta")
+    from hackaton.routers.processing.pipeline import agregar_eventos
+
+    pai, novos = _eventos(0, 800), _eventos(1, 300)
+    nc_pai, nc_nova = _nc(2, 120), _nc(3, 90)
+    pai, novos, nc_pai, nc_nova = (d[d["DATA_EVENTO"].notna()] for d in (pai, novos, nc_pai, nc_nova))
+    anchor = pd.Timestamp("2024-04-30")
+
+    agregada = agregar_eventos(pd.concat([pai, nc_pai], ignore_index=True), anchor)
+    nova, antes, depois = delta.atualizar_agregada(
+        agregada, [agregar_eventos(novos, anchor), agregar_eventos(nc_nova, anchor)], [agregar_eventos(nc_pai, anchor)],
+    )
+    completa = agregar_eventos(pd.concat([pai, novos, nc_nova], ignore_index=True), anchor)
+    pd.testing.assert_frame_equal(_normalizar_agregada(nova), _normalizar_agregada(completa))
+    # as células tocadas são o que o cubo do delta usa
+    _assert_cubos_iguais(atualizar_cubo(construir_cubo(agregada), depois, antes), construir_cubo(completa))
+
+
+def test_chaves_descartam_eventos_do_pai():
+    delta = pytest.importorskip("hackaton.routers.processing.delta")
+
+    pai = _eventos(0, 500)
+    # a planilha nova repete parte da anterior, lida de novo (outro índice, LINHA sem strip)
+    repetidos = pai.iloc[100:300].reset_index(drop=True)
+    repetidos["LINHA_ORIGINAL"] = repetidos["LINHA_ORIGINAL"] + " "
+    novos = pd.concat([repetidos, _eventos(9, 100)], ignore_index=True)
+
+    antigas = np.sort(delta.chaves_eventos(pai))
+    repetido = delta._contidas(delta.chaves_eventos(novos), antigas)
+    assert repetido[:200].all()
+    assert not repetido[200:].any()
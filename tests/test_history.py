@@ -0,0 +1,74 @@
+"""Histórico: fontes que se sobrepõem não duplicam evento, e incorporar de novo não muda nada."""
+import numpy as np
+import pandas as pd
+import pytest
+
+history = pytest.importorskip("hackaton.routers.processing.history")
+
+
+def _eventos(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "TIPO": rng.choice(["REFUGO", "RECLAMACAO_FORMAL"], n),
+        "DATA_EVENTO": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 120, n), "D"),
+        "LINHA_ORIGINAL": rng.choice(["l1", "L 2", "l-3"], n),
+        "LINHA": rng.choice(["L1", "L2", "L3"], n),
+        "PN_ORIGINAL": [f"pn {k}" for k in range(n)],
+        "PN_LIMPO": "PN",
+        "DESCRICAO": "d",
+        "QTD": 1.0,
+    })
+
+
+def _conteudo(h) -> pd.DataFrame:
+    ev, _ = h.ler(None, None)
+    return ev.sort_values("CHAVE", ignore_index=True)
+
+
+def test_fontes_sobrepostas_nao_duplicam(tmp_path):
+    ev = _eventos(2000)
+    h = history.HistoricoEventos(tmp_path)
+    h.incorporar("r1", "f1", ev.iloc[:1500])
+    r = h.incorporar("r2", "f2", ev.iloc[500:].reset_index(drop=True))
+
+    assert r["novos"] == 500
+    tudo = _conteudo(h)
+    assert len(tudo) == 2000
+    assert tudo["CHAVE"].is_unique
+
+
+def test_incorporar_de_novo_e_idempotente(tmp_path):
+    ev = _eventos(2000)
+    h = history.HistoricoEventos(tmp_path)
+    h.incorporar("r1", "f1", ev.iloc[:1500])
+    h.incorporar("r2", "f2", ev.iloc[500:])
+    antes = _conteudo(h)
+
+    # mesma fonte (mesmo upload) e os mesmos eventos vindos de outra fonte
+    assert h.incorporar("r3", "f2", ev.iloc[500:])["reaproveitado"]
+    assert h.incorporar("r4", "f4", ev.iloc[::-1])["novos"] == 0
+    pd.testing.assert_frame_equal(_conteudo(h), antes)
+    assert set(h.indice()["runs"]) == {"r1", "r2", "r3", "r4"}
+
+
+def test_ordem_das_fontes_nao_importa(tmp_path):
+    ev = _eventos(2000)
+    a, b = history.HistoricoEventos(tmp_path / "a"), history.HistoricoEventos(tmp_path / "b")
+    a.incorporar("r1", "f1", ev.iloc[:1500])
+    a.incorporar("r2", "f2", ev.iloc[500:])
+    b.incorporar("r2", "f2", ev.iloc[500:])
+    b.incorporar("r1", "f1", ev.iloc[:1500])
+
+    pd.testing.assert_frame_equal(_conteudo(a), _conteudo(b))
+    assert a.indice()["min_date"] == b.indice()["min_date"]
+    assert a.indice()["max_date"] == b.indice()["max_date"]
+
+
+def test_repeticao_dentro_da_fonte_fica(tmp_path):
+    ev = _eventos(100)
+    ev = pd.concat([ev, ev.iloc[:10]], ignore_index=True)
+    h = history.HistoricoEventos(tmp_path)
+    assert h.incorporar("r1", "f1", ev)["novos"] == 110
+    # e a fonte sobreposta não traz a repetição de volta
+    assert h.incorporar("r2", "f2", ev.iloc[:50])["novos"] == 0
+    assert len(_conteudo(h)) == 110